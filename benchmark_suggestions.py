@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput and latency of the suggestion pipeline for one backend.
+
+The suggestion cache and request coalescing are bypassed, so every request reaches the
+backend. Prompt-based backends also report the time spent parsing answers.
+
+    python benchmark_suggestions.py --backend rules --requests 5000
+    python fake_gemini_server.py --latency-ms 800 &
+    GEMINI_API_BASE=http://127.0.0.1:8765 python benchmark_suggestions.py --backend http --concurrency 20
+"""
+
+import argparse
+import itertools
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_app import MAINTENANCE_TYPE_TRANSLATIONS, create_suggestion_backend
+
+VEHICLES = [
+    {'marca': 'Toyota', 'modelo': 'Corolla', 'anio': 2020, 'tipo_motor': 'Gasolina', 'tipo_transmision': 'Automática'},
+    {'marca': 'Nissan', 'modelo': 'Leaf', 'anio': 2022, 'tipo_motor': 'Eléctrico', 'tipo_transmision': 'Automática'},
+    {'marca': 'Suzuki', 'modelo': 'Swift', 'anio': 2018, 'tipo_motor': 'Gasolina', 'tipo_transmision': 'Manual'},
+]
+CAMPOS = ['miles', 'meses', 'categoria', 'todo']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a suggestion backend')
+    parser.add_argument('--backend', default='rules', help='gemini, http or rules')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    backend = create_suggestion_backend(args.backend)
+    casos = list(itertools.product(VEHICLES, MAINTENANCE_TYPE_TRANSLATIONS.values(), CAMPOS))
+    trabajos = [casos[i % len(casos)] for i in range(args.requests)]
+
+    def ejecutar(caso):
+        vehiculo, tipo, campo = caso
+        inicio = time.perf_counter()
+        try:
+            ok = backend.suggest(vehiculo, tipo, campo)['success']
+        except Exception:
+            ok = False
+        return time.perf_counter() - inicio, ok
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        resultados = list(executor.map(ejecutar, trabajos))
+    total = time.perf_counter() - inicio
+
+    latencias = sorted(r[0] * 1000 for r in resultados)
+    fallos = sum(1 for r in resultados if not r[1])
+    print(f"Backend: {args.backend}  requests: {args.requests}  concurrency: {args.concurrency}")
+    print(f"Throughput: {args.requests / total:,.1f} suggestions/s  ({total:.2f} s total)")
+    print(f"Latency ms: p50 {statistics.median(latencias):.2f}  "
+          f"p95 {latencias[int(len(latencias) * 0.95) - 1]:.2f}  max {latencias[-1]:.2f}")
+    print(f"Unsuccessful answers: {fallos}")
+    print(f"Backend stats: {backend.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Export the maintenance history as typed, columnar files (Parquet or Arrow IPC) for analytics.
+
+Each record joins Mantenimiento with its Mileage reading, Tipo_Mantenimiento, Mecánico and
+vehicle, so analysts can scan the files (pandas, Polars, DuckDB, Spark...) instead of
+querying the production database. Rows are read and written in batches with bounded memory.
+
+A full export replaces the dataset with a single file. With --incremental, only records
+newer than the last exported one (the watermark kept in _export_state.json) are written,
+as a new part file next to the previous ones; read the directory as one dataset.
+
+Requires pyarrow (pip install pyarrow).
+
+Usage:
+    python export_analytics.py analytics/                 # full snapshot as Parquet
+    python export_analytics.py analytics/ --incremental   # append records added since the last run
+    python export_analytics.py analytics/ --format arrow  # Arrow IPC (Feather v2) instead
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from flask_app import ANALYTICS_BATCH_ROWS, DB_PATH, get_db_connection, iter_analytics_batches
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+STATE_FILE = '_export_state.json'
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def analytics_schema():
+    """Column types of the exported records, in ANALYTICS_EXPORT_SQL order."""
+    return pa.schema([
+        ('maintenance_id', pa.int64()),
+        ('vehicle_id', pa.int64()),
+        ('vehicle', pa.string()),
+        ('make', pa.string()),
+        ('model', pa.string()),
+        ('year', pa.int32()),
+        ('service_date', pa.date32()),
+        ('mileage', pa.int64()),
+        ('maintenance_type_id', pa.int64()),
+        ('maintenance_type', pa.string()),
+        ('category', pa.string()),
+        ('mechanic_id', pa.int64()),
+        ('mechanic', pa.string()),
+        ('price', pa.float64()),
+        ('miles_next_maintenance', pa.int64()),
+        ('months_next_maintenance', pa.int32()),
+        ('next_due_date', pa.date32()),
+        ('next_due_mileage', pa.int64()),
+    ])
+
+
+def record_batch(rows, schema):
+    columnas = []
+    for i, campo in enumerate(schema):
+        valores = [row[i] for row in rows]
+        if pa.types.is_date32(campo.type):
+            # SQLite stores dates as ISO text
+            columnas.append(pa.array(valores, pa.string()).cast(campo.type))
+        else:
+            columnas.append(pa.array(valores, campo.type))
+    return pa.RecordBatch.from_arrays(columnas, schema=schema)
+
+
+class BatchWriter:
+    """Write record batches to one Parquet file (one row group per batch) or Arrow IPC file."""
+
+    def __init__(self, path, schema, formato):
+        if formato == 'parquet':
+            self._writer = pq.ParquetWriter(path, schema, compression='zstd')
+            self._write = self._writer.write_batch
+        else:
+            self._sink = pa.OSFile(str(path), 'wb')
+            self._writer = ipc.new_file(self._sink, schema,
+                                        options=ipc.IpcWriteOptions(compression='zstd'))
+            self._write = self._writer.write_batch
+        self._formato = formato
+
+    def write(self, batch):
+        self._write(batch)
+
+    def close(self):
+        self._writer.close()
+        if self._formato == 'arrow':
+            self._sink.close()
+
+
+def load_state(directorio):
+    try:
+        with open(directorio / STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(directorio, state):
+    # Written to a temporary file first, so the watermark never points past a lost file
+    temporal = directorio / (STATE_FILE + '.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporal, directorio / STATE_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export maintenance history as Parquet or Arrow files')
+    parser.add_argument('directory', help='dataset directory (created if missing)')
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), default='parquet')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only export records added since the last export to this directory')
+    parser.add_argument('--batch-size', type=int, default=ANALYTICS_BATCH_ROWS,
+                        help='rows per batch (and Parquet row group)')
+    args = parser.parse_args()
+
+    if pa is None:
+        print("pyarrow is required for this export: pip install pyarrow", file=sys.stderr)
+        return 2
+
+    directorio = Path(args.directory)
+    directorio.mkdir(parents=True, exist_ok=True)
+    state = load_state(directorio)
+    if args.incremental and state is not None:
+        if state['format'] != args.format:
+            print(f"{directorio} holds a {state['format']} dataset; use --format {state['format']} "
+                  f"or a full export", file=sys.stderr)
+            return 2
+        watermark = state['watermark']
+    else:
+        state = {'format': args.format, 'watermark': 0, 'rows': 0, 'files': [],
+                 'previous_files': (state or {}).get('files', [])}
+        watermark = 0
+
+    print(f"Database: {DB_PATH}")
+    schema = analytics_schema()
+    inicio = time.perf_counter()
+    marca = datetime.now().strftime('%Y%m%dT%H%M%S')
+    nombre = f"maintenance-{marca}-{watermark + 1:09d}.{EXTENSIONS[args.format]}"
+    temporal = directorio / (nombre + '.tmp')
+    writer = None
+    filas = 0
+    ultimo_id = watermark
+
+    conn = get_db_connection(read_only=True)
+    try:
+        # One SELECT, so the whole export reads a single consistent snapshot
+        for rows in iter_analytics_batches(conn, watermark, args.batch_size):
+            if writer is None:
+                writer = BatchWriter(temporal, schema, args.format)
+            writer.write(record_batch(rows, schema))
+            filas += len(rows)
+            ultimo_id = rows[-1][0]
+            print(f"\r{filas:,} rows ({filas / (time.perf_counter() - inicio):,.0f} rows/s)",
+                  end='', file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            temporal.unlink()
+        raise
+    finally:
+        conn.close()
+
+    if writer is not None:
+        writer.close()
+        os.replace(temporal, directorio / nombre)
+        state['files'].append({'file': nombre, 'rows': filas, 'first_id': watermark + 1,
+                               'last_id': ultimo_id, 'exported_at': datetime.now().isoformat()})
+    state['watermark'] = ultimo_id
+    state['rows'] += filas
+    # A full export replaces the files of the previous dataset once the new one is complete.
+    # A new file started in the same second as an old one has its name and is kept.
+    actuales = {archivo['file'] for archivo in state['files']}
+    for anterior in state.pop('previous_files', []):
+        if anterior['file'] in actuales:
+            continue
+        try:
+            (directorio / anterior['file']).unlink()
+        except FileNotFoundError:
+            pass
+    save_state(directorio, state)
+
+    if filas:
+        print(f"Wrote {filas:,} rows to {directorio / nombre} in {time.perf_counter() - inicio:.1f} s")
+    else:
+        print("No new records since the last export")
+    print(f"Dataset: {state['rows']:,} rows in {len(state['files'])} file(s), watermark id {state['watermark']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini generateContent and streamGenerateContent REST APIs.
+
+Answers the prompts sent by the suggestion backends in the same formats Gemini is asked
+for (MILES/MONTHS/EXPLANATION, a category word, or the combined APPLICABLE... block),
+after a configurable latency. Point the app at it to benchmark or load test the
+suggestion routes without network access or API quota:
+
+    python fake_gemini_server.py --port 8765 --latency-ms 800 --jitter-ms 300
+    SUGGESTION_BACKEND=http GEMINI_API_BASE=http://127.0.0.1:8765 python flask_app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CATEGORIES = ["Engine", "Brakes", "Transmission", "Suspension", "Electrical", "Tires", "Body", "Cooling"]
+
+# (keyword, category) used to pick a plausible category for the maintenance type
+CATEGORY_KEYWORDS = [
+    ('brake', 'Brakes'), ('freno', 'Brakes'), ('pastilla', 'Brakes'),
+    ('tire', 'Tires'), ('llanta', 'Tires'), ('rotation', 'Tires'), ('balanc', 'Tires'),
+    ('transmission', 'Transmission'), ('clutch', 'Transmission'), ('embrague', 'Transmission'),
+    ('alignment', 'Suspension'), ('alinea', 'Suspension'), ('shock', 'Suspension'),
+    ('battery', 'Electrical'), ('bater', 'Electrical'),
+    ('coolant', 'Cooling'), ('refrigerante', 'Cooling'),
+]
+
+
+def maintenance_type(prompt):
+    match = re.search(r"Maintenance type: (.+)", prompt) or re.search(r"maintenance task '([^']+)'", prompt)
+    return match.group(1).strip() if match else 'maintenance'
+
+
+def answer(prompt):
+    """Deterministic answer for a prompt: the same maintenance type always gets the same interval."""
+    tipo = maintenance_type(prompt)
+    seed = int(hashlib.sha256(tipo.lower().encode('utf-8')).hexdigest(), 16)
+    miles = 1000 * (3 + seed % 60)
+    months = 3 + seed % 45
+    categoria = next((cat for word, cat in CATEGORY_KEYWORDS if word in tipo.lower()), 'Engine')
+    why = f"{tipo} keeps the vehicle safe and reliable. Skipping it increases wear on related components."
+    delay = f"Delaying {tipo} leads to faster wear and higher repair costs. Problems compound over time."
+
+    if 'APPLICABLE:' in prompt:
+        return (f"APPLICABLE: YES\nMILES: {miles}\nMILES_EXPLANATION: {why}\n"
+                f"MONTHS: {months}\nMONTHS_EXPLANATION: {delay}\nCATEGORY: {categoria}")
+    if 'MILES:' in prompt:
+        return f"MILES: {miles}\nEXPLANATION: {why}"
+    if 'MONTHS:' in prompt:
+        return f"MONTHS: {months}\nEXPLANATION: {delay}"
+    return categoria
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        stream = ':streamGenerateContent' in self.path
+        if not stream and ':generateContent' not in self.path:
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        prompt = ''.join(part.get('text', '')
+                         for content in body.get('contents', [])
+                         for part in content.get('parts', []))
+
+        latency = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        # A streamed answer starts after half the latency and arrives over the other half
+        time.sleep(latency / 2 if stream else latency)
+        if random.random() < self.error_rate:
+            self._send_json(503, {'error': {'code': 503, 'message': 'The model is overloaded.',
+                                            'status': 'UNAVAILABLE'}})
+            return
+
+        text = answer(prompt)
+        if stream:
+            self._send_stream(text, latency / 2)
+            return
+        self._send_json(200, {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0,
+            }],
+            'usageMetadata': {
+                'promptTokenCount': len(prompt.split()),
+                'candidatesTokenCount': len(text.split()),
+                'totalTokenCount': len(prompt.split()) + len(text.split()),
+            },
+        })
+
+    def _send_stream(self, text, duration):
+        # Server-Sent Events as sent by streamGenerateContent?alt=sse, a few words per chunk
+        words = text.split(' ')
+        chunks = [' '.join(words[i:i + 4]) + (' ' if i + 4 < len(words) else '')
+                  for i in range(0, len(words), 4)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for chunk in chunks:
+            time.sleep(duration / len(chunks))
+            event = {'candidates': [{'content': {'parts': [{'text': chunk}], 'role': 'model'}, 'index': 0}]}
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8'))
+            self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Gemini generateContent API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=800, help='mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=300, help='uniform +/- latency jitter')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    FakeGeminiHandler.latency = args.latency_ms / 1000
+    FakeGeminiHandler.jitter = args.jitter_ms / 1000
+    FakeGeminiHandler.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeGeminiHandler)
+    print(f"Fake Gemini listening on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, error rate {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
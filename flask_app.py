@@ -1,14 +1,38 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, g
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, g, Response
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime
 import pytz
+import numpy as np
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 import google.generativeai as genai
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+import csv
 import functools
+import hashlib
+import io
+import json
+import math
+import queue
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import urllib.error
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+# Future.result() raises this, which is not the builtin TimeoutError before Python 3.11
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from typing import Dict
+from xml.sax.saxutils import escape as xml_escape
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +43,65 @@ app.config['JSON_AS_ASCII'] = False  # Add this for proper encoding
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching in development
 
 DB_PATH = Path(os.environ.get('DB_PATH', 'mantenimiento.db'))
+# Apply pending schema migrations when the app is imported, for servers that import it
+# (gunicorn, flask run). Otherwise they run through `python initialize_db.py` or when
+# the app is started with `python flask_app.py`, so importing it never touches the database
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '0') == '1'
+# Maximum number of idle connections kept per process for reuse between requests
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+# Same for the read-only connections used by GET requests and exports
+DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', '16'))
+# Send every write through one writer thread per process that commits the writes queued
+# meanwhile together (see WriteQueue): up to DB_WRITE_BATCH_MAX operations per commit,
+# waiting DB_WRITE_COMMIT_INTERVAL seconds for more; at most DB_WRITE_QUEUE_SIZE queued
+DB_WRITE_QUEUE = os.environ.get('DB_WRITE_QUEUE', '0') == '1'
+DB_WRITE_COMMIT_INTERVAL = float(os.environ.get('DB_WRITE_COMMIT_INTERVAL', '0'))
+DB_WRITE_BATCH_MAX = int(os.environ.get('DB_WRITE_BATCH_MAX', '5000'))
+DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', '1000'))
+# Seconds a logged-in user's row is reused before it is read from Usuario again
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+# Maintenance history pages (one per vehicle, filter, search, sort and offset) kept in memory
+HISTORY_PAGE_CACHE_SIZE = int(os.environ.get('HISTORY_PAGE_CACHE_SIZE', '256'))
+# Gemini suggestions are reused from the Sugerencia_Cache table for this many seconds
+SUGGESTION_CACHE_TTL = float(os.environ.get('SUGGESTION_CACHE_TTL', str(30 * 24 * 3600)))
+# Least recently used suggestions beyond this count are evicted
+SUGGESTION_CACHE_MAX_ENTRIES = int(os.environ.get('SUGGESTION_CACHE_MAX_ENTRIES', '5000'))
+# SQLite performance profile applied to every connection (see DB_PROFILES)
+DB_PROFILE = os.environ.get('DB_PROFILE', 'balanced')
+
+# PRAGMA settings per profile. 'safe' keeps SQLite's stock behaviour (rollback journal,
+# synchronous=FULL); 'balanced' uses WAL so readers never block on a writer;
+# 'fast' trades durability of the last transactions on power loss for throughput.
+DB_PROFILES: Dict[str, Dict[str, object]] = {
+    'safe': {
+        'journal_mode': 'delete',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    'balanced': {
+        'journal_mode': 'wal',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,        # 16 MB page cache
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'fast': {
+        'journal_mode': 'wal',
+        'synchronous': 'OFF',
+        'busy_timeout': 10000,
+        'cache_size': -64000,        # 64 MB page cache
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Numeric values PRAGMA synchronous / temp_store report back for each setting name
+_SYNCHRONOUS_VALUES = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+_TEMP_STORE_VALUES = {'DEFAULT': 0, 'FILE': 1, 'MEMORY': 2}
 
 # Configure Gemini (add your API key in environment variables)
 # Using gemini-2.0-flash - the latest FREE tier model
@@ -26,6 +109,47 @@ DB_PATH = Path(os.environ.get('DB_PATH', 'mantenimiento.db'))
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+# Where suggestions come from: 'gemini' (google.generativeai SDK), 'http' (Gemini REST API
+# at GEMINI_API_BASE, e.g. the local fake_gemini_server.py) or 'rules' (offline rule engine)
+SUGGESTION_BACKEND = os.environ.get('SUGGESTION_BACKEND', 'gemini')
+# Backend answering when the primary one fails (e.g. 'rules'); empty, the default, to
+# report the suggestion as unavailable instead
+SUGGESTION_FALLBACK_BACKEND = os.environ.get('SUGGESTION_FALLBACK_BACKEND', '')
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+# Seconds allowed for one model request, and for the whole call including retries
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', '10'))
+GEMINI_DEADLINE = float(os.environ.get('GEMINI_DEADLINE', '20'))
+# Retries of timeouts, connection errors and HTTP 408/429/5xx, with jittered exponential backoff
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '2'))
+GEMINI_RETRY_BACKOFF = float(os.environ.get('GEMINI_RETRY_BACKOFF', '0.5'))
+# Consecutive failed calls that open the circuit breaker, and seconds it stays open
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get('GEMINI_BREAKER_THRESHOLD', '5'))
+GEMINI_BREAKER_RESET = float(os.environ.get('GEMINI_BREAKER_RESET', '30'))
+# Threads per worker process running background suggestion jobs, and seconds a finished
+# job's result stays available to its client
+SUGGESTION_JOB_WORKERS = int(os.environ.get('SUGGESTION_JOB_WORKERS', '4'))
+SUGGESTION_JOB_TTL = float(os.environ.get('SUGGESTION_JOB_TTL', '300'))
+# Fleet overview: maintenance due within this many days, or within this many miles of the
+# vehicle's latest odometer reading, is listed as upcoming
+FLEET_DUE_SOON_DAYS = int(os.environ.get('FLEET_DUE_SOON_DAYS', '30'))
+FLEET_DUE_SOON_MILES = int(os.environ.get('FLEET_DUE_SOON_MILES', '500'))
+# Odometer ingestion (POST /odometer_readings): readings arriving within this many seconds
+# of each other, up to ODOMETER_BATCH_MAX_ROWS, are written in one commit; at most
+# ODOMETER_QUEUE_SIZE requests wait for the writer before clients get 503. With
+# DB_WRITE_QUEUE=1 readings go through the shared writer and its settings apply instead
+ODOMETER_COMMIT_INTERVAL = float(os.environ.get('ODOMETER_COMMIT_INTERVAL', '0.05'))
+ODOMETER_BATCH_MAX_ROWS = int(os.environ.get('ODOMETER_BATCH_MAX_ROWS', '5000'))
+ODOMETER_QUEUE_SIZE = int(os.environ.get('ODOMETER_QUEUE_SIZE', '1000'))
+ODOMETER_MAX_READINGS = int(os.environ.get('ODOMETER_MAX_READINGS', '10000'))
+# 'reject' drops readings that contradict a vehicle's earlier or later ones; 'flag' keeps
+# them in Mileage_Marcado for review
+ODOMETER_ROLLBACK_MODE = os.environ.get('ODOMETER_ROLLBACK_MODE', 'reject')
+# Seconds between mileage projection refits while readings are being ingested
+ODOMETER_PROJECTION_INTERVAL = float(os.environ.get('ODOMETER_PROJECTION_INTERVAL', '60'))
+# Bearer token for telematics clients without a user session (unset disables token access)
+ODOMETER_API_TOKEN = os.environ.get('ODOMETER_API_TOKEN')
 
 # Translation dictionaries
 CATEGORY_TRANSLATIONS: Dict[str, str] = {
@@ -61,11 +185,1083 @@ MECHANIC_TRANSLATIONS: Dict[str, str] = {
     'Agencia': 'Dealership'
 }
 
-def get_db_connection():
-    conn = sqlite3.connect(str(DB_PATH))
+def get_db_profile(name=None):
+    name = name or DB_PROFILE
+    if name not in DB_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{name}'. Valid profiles: {', '.join(DB_PROFILES)}")
+    return DB_PROFILES[name]
+
+def apply_db_profile(conn, profile=None, read_only=False):
+    """Apply the PRAGMA settings of a performance profile to an open connection."""
+    settings = profile or get_db_profile()
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['busy_timeout'])}")
+    if read_only:
+        # The journal mode is stored in the database file and set by read-write
+        # connections; query_only makes any write attempt fail instead of running
+        conn.execute('PRAGMA query_only = ON')
+    else:
+        conn.execute(f"PRAGMA journal_mode = {settings['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {settings['temp_store']}")
+
+def get_db_connection(read_only=False):
+    # check_same_thread=False lets pooled connections move between worker threads;
+    # a connection is only ever used by one request at a time.
+    profile = get_db_profile()
+    if read_only:
+        # mode=ro opens the file read-only, so the database must already exist
+        database, uri = f'{DB_PATH.resolve().as_uri()}?mode=ro', True
+    else:
+        database, uri = str(DB_PATH), False
+    conn = sqlite3.connect(database, uri=uri, check_same_thread=False, cached_statements=256,
+                           timeout=profile['busy_timeout'] / 1000)
     conn.row_factory = sqlite3.Row
+    apply_db_profile(conn, profile, read_only)
     return conn
 
+def check_db_settings():
+    """Read back the effective PRAGMA values and log any that differ from the profile.
+
+    Some settings can silently fall back (WAL is unavailable on network filesystems,
+    mmap may be capped by the SQLite build), so the effective values are reported at startup.
+    """
+    profile = get_db_profile()
+    conn = get_db_connection()
+    try:
+        effective = {
+            'journal_mode': conn.execute('PRAGMA journal_mode').fetchone()[0],
+            'synchronous': conn.execute('PRAGMA synchronous').fetchone()[0],
+            'busy_timeout': conn.execute('PRAGMA busy_timeout').fetchone()[0],
+            'cache_size': conn.execute('PRAGMA cache_size').fetchone()[0],
+            'mmap_size': conn.execute('PRAGMA mmap_size').fetchone()[0],
+            'temp_store': conn.execute('PRAGMA temp_store').fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+    expected = dict(profile)
+    expected['synchronous'] = _SYNCHRONOUS_VALUES[str(profile['synchronous']).upper()]
+    expected['temp_store'] = _TEMP_STORE_VALUES[str(profile['temp_store']).upper()]
+    mismatches = {
+        key: (expected[key], value) for key, value in effective.items()
+        if str(value).lower() != str(expected[key]).lower()
+    }
+
+    app.logger.info("SQLite profile '%s' on %s: %s", DB_PROFILE, DB_PATH, effective)
+    for key, (wanted, actual) in mismatches.items():
+        app.logger.warning("SQLite setting %s is %s (profile '%s' requested %s)",
+                           key, actual, DB_PROFILE, wanted)
+    return {'profile': DB_PROFILE, 'settings': effective, 'mismatches': sorted(mismatches)}
+
+class ConnectionPool:
+    """Bounded pool of idle SQLite connections shared by the worker threads of a process.
+
+    Reusing connections keeps SQLite's prepared-statement cache warm and avoids the
+    connect/close cost on every request. Connections beyond ``size`` are closed on
+    release instead of being kept.
+    """
+
+    def __init__(self, size, connect=get_db_connection):
+        self.size = size
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must never cross a fork; a child process starts with an empty pool
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside of a request (background threads, scripts)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+# Read-only connections (mode=ro, query_only) for GET requests and exports. With WAL they
+# read a snapshot without ever waiting on the writer, so they are pooled separately
+db_read_pool = ConnectionPool(DB_READ_POOL_SIZE, functools.partial(get_db_connection, read_only=True))
+
+# Requests with these methods only read, and get a read-only connection from get_db()
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def get_db():
+    """Return the connection bound to the current request, borrowing one from the pool.
+
+    GET requests get a read-only connection from db_read_pool; writes from them fail
+    with "attempt to write a readonly database". Other requests get a read-write one.
+    """
+    if request.method in READ_ONLY_METHODS:
+        return get_read_db()
+    return get_write_db()
+
+def get_read_db():
+    """The current request's read-only connection."""
+    if 'db_read' not in g:
+        g.db_read = db_read_pool.acquire()
+    return g.db_read
+
+def get_write_db():
+    """The current request's read-write connection, whatever the request method."""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+    conn = g.pop('db_read', None)
+    if conn is not None:
+        db_read_pool.release(conn)
+
+@contextmanager
+def transaction(conn):
+    """Run a block of writes as one IMMEDIATE transaction: committed if it completes,
+    rolled back if it raises.
+
+    Taking the write lock up front means the block never fails halfway with SQLITE_BUSY
+    on lock upgrade, and a multi-statement save costs a single commit.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+class WriteQueue:
+    """Single writer thread that group-commits write operations.
+
+    submit() queues fn(conn) and returns a Future. The writer takes every operation
+    queued while it was busy (waiting up to ``commit_interval`` seconds for more, until
+    their summed ``peso`` reaches ``max_batch``) and runs them in one transaction, each
+    inside its own SAVEPOINT: an operation that raises is rolled back alone and its
+    Future gets the exception, the others are committed together. With one writer per
+    process, requests no longer wait on each other's write locks and share an fsync.
+    """
+
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, name, commit_interval, max_batch, queue_size):
+        self.name = name
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self.operations = 0
+        self.failed_operations = 0
+        self.cancelled_operations = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.restarts = 0
+
+    def _ensure_started(self):
+        # The writer thread (and its queue) must belong to this process; a forked
+        # worker starts its own on first use
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self._queue_size)
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                # A writer killed by an error is replaced; queued operations are kept
+                if self._thread is not None:
+                    self.restarts += 1
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, peso=1, block=True, timeout=None):
+        """Queue fn(conn) for the next group commit. Raises queue.Full if the queue
+        stays full (immediately with block=False)."""
+        self._ensure_started()
+        futuro = Future()
+        self._queue.put((fn, peso, futuro), block, timeout)
+        return futuro
+
+    @staticmethod
+    def wait(futuro, timeout):
+        """Outcome of a submitted operation. One still queued after ``timeout`` seconds
+        is cancelled and concurrent.futures.TimeoutError raised, so nothing was written;
+        one already running is waited for until it commits or fails."""
+        try:
+            return futuro.result(timeout)
+        except FutureTimeoutError:
+            if futuro.cancel():
+                raise
+            return futuro.result()
+
+    def run(self, fn, timeout):
+        """Run fn(conn) in the next group commit and return its result (or raise its
+        exception). If the queue stays full, or the operation has not started, after
+        ``timeout`` seconds nothing is written and sqlite3.OperationalError is raised,
+        like a busy database."""
+        try:
+            futuro = self.submit(fn, timeout=timeout)
+        except queue.Full:
+            raise sqlite3.OperationalError('database is busy: the write queue is full')
+        try:
+            return self.wait(futuro, timeout)
+        except FutureTimeoutError:
+            if futuro.cancelled():
+                raise sqlite3.OperationalError('database is busy: timed out waiting for the write queue')
+            raise
+
+    def _next_batch(self):
+        lote = [self._queue.get()]
+        peso = lote[0][1]
+        limite = time.monotonic() + self.commit_interval
+        while peso < self.max_batch:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._queue.get(timeout=restante) if restante > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+            peso += lote[-1][1]
+        return lote
+
+    @staticmethod
+    def _fail(futuro, error):
+        try:
+            futuro.set_exception(error)
+        except InvalidStateError:
+            pass  # cancelled by its caller, or already resolved
+
+    def _run(self):
+        conn = None
+        while True:
+            lote = self._next_batch()
+            try:
+                if conn is None:
+                    conn = get_db_connection()
+                self._commit(conn, lote)
+            except BaseException as e:
+                # No caller may be left waiting: fail the batch and reconnect
+                app.logger.exception('%s: writer error', self.name)
+                with self._lock:
+                    self.failed_commits += 1
+                for _, _, futuro in lote:
+                    self._fail(futuro, e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                if not isinstance(e, Exception):
+                    # This thread ends: hand the queue to a new writer first, as a submit()
+                    # racing with its exit would still see it alive and not start one. The
+                    # error is logged above, so the thread returns instead of re-raising it
+                    with self._lock:
+                        self.restarts += 1
+                        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                        self._thread.start()
+                    return
+
+    def _commit(self, conn, lote):
+        inicio = time.perf_counter()
+        resultados = []
+        try:
+            with transaction(conn):
+                for fn, _, futuro in lote:
+                    # Skips operations whose caller gave up waiting and cancelled them
+                    if not futuro.set_running_or_notify_cancel():
+                        continue
+                    conn.execute('SAVEPOINT operacion')
+                    try:
+                        resultados.append((futuro, fn(conn), None))
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO operacion')
+                        resultados.append((futuro, None, e))
+                    conn.execute('RELEASE operacion')
+        except Exception as e:
+            app.logger.warning('%s: commit of %s operations failed: %s', self.name, len(lote), e)
+            with self._lock:
+                self.failed_commits += 1
+            for _, _, futuro in lote:
+                self._fail(futuro, e)
+            return
+        with self._lock:
+            self._latencies.append(time.perf_counter() - inicio)
+            self.commits += 1
+            self.operations += len(resultados)
+            self.failed_operations += sum(1 for _, _, error in resultados if error is not None)
+            self.cancelled_operations += len(lote) - len(resultados)
+        for futuro, resultado, error in resultados:
+            if error is None:
+                futuro.set_result(resultado)
+            else:
+                futuro.set_exception(error)
+
+    def stats(self):
+        with self._lock:
+            latencias = sorted(self._latencies)
+            return {
+                'queued': self._queue.qsize() if self._pid == os.getpid() else 0,
+                'operations': self.operations,
+                'failed_operations': self.failed_operations,
+                'cancelled_operations': self.cancelled_operations,
+                'commits': self.commits,
+                'failed_commits': self.failed_commits,
+                'restarts': self.restarts,
+                'operations_per_commit': round(self.operations / self.commits, 1) if self.commits else None,
+                'commit_latency_ms': {
+                    'p50': round(latencias[len(latencias) // 2] * 1000, 1),
+                    'p95': round(latencias[int(len(latencias) * 0.95)] * 1000, 1),
+                    'max': round(latencias[-1] * 1000, 1),
+                } if latencias else None,
+            }
+
+db_writer = WriteQueue('db-writer', DB_WRITE_COMMIT_INTERVAL, DB_WRITE_BATCH_MAX, DB_WRITE_QUEUE_SIZE)
+
+def write_transaction(fn, conn=None):
+    """Run fn(conn) as one write transaction and return its result.
+
+    With DB_WRITE_QUEUE=1 it is group-committed by db_writer; otherwise it runs in
+    transaction() on ``conn`` (by default the request's read-write connection). Either
+    way an exception raised by fn rolls back everything fn wrote.
+    """
+    if DB_WRITE_QUEUE:
+        return db_writer.run(fn, get_db_profile()['busy_timeout'] / 1000)
+    conn = conn or get_write_db()
+    with transaction(conn):
+        return fn(conn)
+
+# --- Schema migrations ---
+# Every DDL statement lives in a numbered migration. Applied versions are recorded in
+# schema_version, so each migration runs exactly once per database.
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def _migration_base_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Detalle_Vehiculo (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            marca TEXT NOT NULL,
+            modelo TEXT NOT NULL,
+            anio INTEGER NOT NULL,
+            tipo TEXT,
+            tipo_motor TEXT,
+            tipo_transmision TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Vehiculo (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alias TEXT NOT NULL,
+            detalle_id INTEGER,
+            FOREIGN KEY (detalle_id) REFERENCES Detalle_Vehiculo(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Mecánico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre_mecanico TEXT NOT NULL,
+            telefono_mecanico TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Tipo_Mantenimiento (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            meses_proximo_mantenimiento INTEGER,
+            miles_next_maintenance INTEGER,
+            vehiculo_detalle_id INTEGER NOT NULL,
+            FOREIGN KEY (vehiculo_detalle_id) REFERENCES Detalle_Vehiculo(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Mileage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehiculo_id INTEGER,
+            fecha DATE NOT NULL,
+            mileage INTEGER NOT NULL,
+            FOREIGN KEY (vehiculo_id) REFERENCES Vehiculo(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Mantenimiento (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehiculo_id INTEGER,
+            tipo_mantenimiento_id INTEGER,
+            mileage_id INTEGER,
+            mecanico_id INTEGER,
+            fecha_proximo_mantenimiento DATE,
+            precio REAL,
+            FOREIGN KEY (vehiculo_id) REFERENCES Vehiculo(id),
+            FOREIGN KEY (tipo_mantenimiento_id) REFERENCES Tipo_Mantenimiento(id),
+            FOREIGN KEY (mileage_id) REFERENCES Mileage(id),
+            FOREIGN KEY (mecanico_id) REFERENCES Mecánico(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Usuario (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )
+    ''')
+
+def _migration_kilometers_to_miles(conn):
+    """Convert databases created before the switch from kilometers to miles."""
+    km_to_miles = 0.621371
+
+    if _table_exists(conn, 'Kilometraje'):
+        conn.execute(f'''
+            INSERT OR IGNORE INTO Mileage (id, vehiculo_id, fecha, mileage)
+            SELECT id, vehiculo_id, fecha, CAST(kilometraje * {km_to_miles} AS INTEGER)
+            FROM Kilometraje
+        ''')
+        conn.execute('DROP TABLE Kilometraje')
+
+    if 'kilometros_proximo_mantenimiento' in _table_columns(conn, 'Tipo_Mantenimiento'):
+        conn.execute('''
+            ALTER TABLE Tipo_Mantenimiento
+            RENAME COLUMN kilometros_proximo_mantenimiento TO miles_next_maintenance
+        ''')
+        conn.execute(f'''
+            UPDATE Tipo_Mantenimiento
+            SET miles_next_maintenance = CAST(miles_next_maintenance * {km_to_miles} AS INTEGER)
+            WHERE miles_next_maintenance IS NOT NULL
+        ''')
+
+    if 'kilometraje_id' in _table_columns(conn, 'Mantenimiento'):
+        conn.execute('''
+            ALTER TABLE Mantenimiento
+            RENAME COLUMN kilometraje_id TO mileage_id
+        ''')
+
+def _migration_tipo_mantenimiento_primary_key(conn):
+    """Rebuild Tipo_Mantenimiento on old databases where id is not an INTEGER PRIMARY KEY."""
+    table_info = conn.execute("PRAGMA table_info(Tipo_Mantenimiento)").fetchall()
+    if any(col[5] == 1 for col in table_info):
+        return
+
+    conn.execute('''
+        CREATE TABLE Tipo_Mantenimiento_temp (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            miles_next_maintenance INTEGER,
+            meses_proximo_mantenimiento INTEGER,
+            vehiculo_detalle_id INTEGER NOT NULL,
+            categoria TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO Tipo_Mantenimiento_temp (id, nombre, miles_next_maintenance,
+                                           meses_proximo_mantenimiento, vehiculo_detalle_id, categoria)
+        SELECT id, nombre, miles_next_maintenance,
+               meses_proximo_mantenimiento, vehiculo_detalle_id, categoria
+        FROM Tipo_Mantenimiento
+        WHERE id IS NOT NULL
+    ''')
+    # Rows with a NULL id get new autoincremented ids
+    conn.execute('''
+        INSERT INTO Tipo_Mantenimiento_temp (nombre, miles_next_maintenance,
+                                           meses_proximo_mantenimiento, vehiculo_detalle_id, categoria)
+        SELECT nombre, miles_next_maintenance,
+               meses_proximo_mantenimiento, vehiculo_detalle_id, categoria
+        FROM Tipo_Mantenimiento
+        WHERE id IS NULL
+    ''')
+    conn.execute('DROP TABLE Tipo_Mantenimiento')
+    conn.execute('ALTER TABLE Tipo_Mantenimiento_temp RENAME TO Tipo_Mantenimiento')
+
+def _migration_lookup_indexes(conn):
+    """Indexes for the per-vehicle history queries and the lookups done on every request."""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mileage_vehiculo_fecha ON Mileage(vehiculo_id, fecha, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mantenimiento_vehiculo ON Mantenimiento(vehiculo_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mantenimiento_mileage ON Mantenimiento(mileage_id)')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tipo_mantenimiento_detalle
+        ON Tipo_Mantenimiento(vehiculo_detalle_id, categoria, nombre)
+    ''')
+    # Usuario.username is normally UNIQUE (and therefore indexed) already
+    username_indexed = any(
+        [col[2] for col in conn.execute(f'PRAGMA index_info("{index[1]}")')] == ['username']
+        for index in conn.execute('PRAGMA index_list(Usuario)')
+    )
+    if not username_indexed:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_usuario_username ON Usuario(username)')
+    conn.execute('ANALYZE')
+
+def _migration_suggestion_cache(conn):
+    """Gemini answers shared by every worker process (see SuggestionCache)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Sugerencia_Cache (
+            clave TEXT PRIMARY KEY,
+            campo TEXT NOT NULL,
+            respuesta TEXT NOT NULL,
+            creado REAL NOT NULL,
+            ultimo_uso REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sugerencia_cache_ultimo_uso ON Sugerencia_Cache(ultimo_uso)')
+
+# Tag whose Cache_Version row is bumped by every write to each reference table
+CACHE_VERSION_TAGS = {
+    'Vehiculo': 'vehiculos',
+    'Detalle_Vehiculo': 'vehiculos',
+    'Mecánico': 'mecanicos',
+    'Tipo_Mantenimiento': 'tipos',
+}
+
+def _migration_reference_cache_versions(conn):
+    """Version counters validating ReferenceCache entries, kept current by triggers.
+
+    Triggers instead of application code bump the versions so that every writer
+    (routes, scripts, manual edits) invalidates the cached lists.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Cache_Version (
+            etiqueta TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for table, tag in CACHE_VERSION_TAGS.items():
+        stem = _normalize_text(table).replace('á', 'a')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cache_version_{stem}_{event.lower()}
+                AFTER {event} ON "{table}"
+                BEGIN
+                    INSERT INTO Cache_Version (etiqueta, version) VALUES ({_sql_literal(tag)}, 1)
+                    ON CONFLICT(etiqueta) DO UPDATE SET version = version + 1;
+                END
+            ''')
+
+def _migration_history_cache_versions(conn):
+    """Per-vehicle 'historial:<vehiculo_id>' versions, bumped when its history changes."""
+    for table in ('Mantenimiento', 'Mileage'):
+        for event, rows in (('INSERT', ('NEW',)), ('UPDATE', ('NEW', 'OLD')), ('DELETE', ('OLD',))):
+            bumps = []
+            for row in rows:
+                # An update moving a row to another vehicle changes both histories
+                condition = 'OLD.vehiculo_id IS NOT NEW.vehiculo_id' if row == 'OLD' and event == 'UPDATE' else '1'
+                bumps.append(f'''
+                    INSERT INTO Cache_Version (etiqueta, version)
+                    SELECT 'historial:' || {row}.vehiculo_id, 1 WHERE {condition}
+                    ON CONFLICT(etiqueta) DO UPDATE SET version = version + 1;''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cache_version_{table.lower()}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN{''.join(bumps)}
+                END
+            ''')
+
+# Merged rows logged per table by _merge_duplicates (all are counted)
+MERGE_LOG_MAX_ROWS = 100
+
+def _merge_duplicates(conn, table, key_sql, references):
+    """Keep the lowest id of each group of rows of table sharing key_sql, repointing
+    the (referencing table, column) pairs in references to it, and delete the rest.
+    Every deleted row is logged with the id it was merged into."""
+    conn.execute('DROP TABLE IF EXISTS temp.duplicados')
+    conn.execute(f'''
+        CREATE TEMP TABLE duplicados AS
+        SELECT id, MIN(id) OVER (PARTITION BY {key_sql}) as conservar FROM "{table}"
+    ''')
+    conn.execute('DELETE FROM temp.duplicados WHERE id = conservar')
+    total = conn.execute('SELECT COUNT(*) FROM temp.duplicados').fetchone()[0]
+    if total:
+        filas = conn.execute(f'''
+            SELECT d.conservar as merged_into, t.* FROM temp.duplicados d JOIN "{table}" t ON t.id = d.id
+            ORDER BY d.conservar, d.id LIMIT ?
+        ''', (MERGE_LOG_MAX_ROWS,)).fetchall()
+        app.logger.warning('Merging %d duplicate rows of %s', total, table)
+        for fila in filas:
+            app.logger.warning('  %s row merged: %s', table, dict(fila))
+        if total > len(filas):
+            app.logger.warning('  ... and %d more %s rows', total - len(filas), table)
+    for ref_table, ref_column in references:
+        conn.execute(f'''
+            UPDATE "{ref_table}"
+            SET {ref_column} = (SELECT conservar FROM temp.duplicados WHERE id = "{ref_table}".{ref_column})
+            WHERE {ref_column} IN (SELECT id FROM temp.duplicados)
+        ''')
+    conn.execute(f'DELETE FROM "{table}" WHERE id IN (SELECT id FROM temp.duplicados)')
+    conn.execute('DROP TABLE temp.duplicados')
+
+def _migration_natural_key_constraints(conn):
+    """Unique indexes on the natural keys the create routes used to check by hand.
+
+    Existing duplicates (possible through concurrent saves) are merged first, and the
+    merged rows are logged. NULL intervals are compared as equal, like the routes'
+    duplicate checks. A NULL phone is the same as an empty one, although the old
+    mechanic check never matched NULL: such mechanics are merged too, so check the log.
+    """
+    _merge_duplicates(conn, 'Mileage', 'vehiculo_id, fecha, mileage', [('Mantenimiento', 'mileage_id')])
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_mileage_lectura
+        ON Mileage(vehiculo_id, fecha, mileage)
+    ''')
+    _merge_duplicates(conn, 'Mecánico', "nombre_mecanico, IFNULL(telefono_mecanico, '')",
+                      [('Mantenimiento', 'mecanico_id')])
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_mecanico_nombre_telefono
+        ON Mecánico(nombre_mecanico, IFNULL(telefono_mecanico, ''))
+    ''')
+    _merge_duplicates(
+        conn, 'Tipo_Mantenimiento',
+        'vehiculo_detalle_id, nombre, categoria, IFNULL(miles_next_maintenance, -1), '
+        'IFNULL(meses_proximo_mantenimiento, -1)',
+        [('Mantenimiento', 'tipo_mantenimiento_id')])
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_tipo_mantenimiento_definicion
+        ON Tipo_Mantenimiento(vehiculo_detalle_id, nombre, categoria,
+                              IFNULL(miles_next_maintenance, -1), IFNULL(meses_proximo_mantenimiento, -1))
+    ''')
+    _merge_duplicates(conn, 'Mantenimiento', 'vehiculo_id, tipo_mantenimiento_id, mileage_id', [])
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_mantenimiento_servicio
+        ON Mantenimiento(vehiculo_id, tipo_mantenimiento_id, mileage_id)
+    ''')
+
+# Last service and next due date/mileage of the (vehicle, maintenance type) pairs returned
+# by the pares subquery, or of every pair. The due values follow the type's current
+# intervals, the same way INSERT_MANTENIMIENTO_SQL computes fecha_proximo_mantenimiento.
+def _next_due_rows_sql(pares=None):
+    condicion = f'WHERE (man.vehiculo_id, man.tipo_mantenimiento_id) IN ({pares})' if pares else ''
+    return f'''
+        SELECT vehiculo_id, tipo_mantenimiento_id, id, fecha, mileage, fecha_proximo, mileage_proximo
+        FROM (
+            SELECT man.vehiculo_id, man.tipo_mantenimiento_id, man.id, mil.fecha, mil.mileage,
+                   CASE WHEN t.meses_proximo_mantenimiento
+                        THEN date(mil.fecha, '+' || t.meses_proximo_mantenimiento || ' months')
+                   END as fecha_proximo,
+                   mil.mileage + t.miles_next_maintenance as mileage_proximo,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY man.vehiculo_id, man.tipo_mantenimiento_id
+                       ORDER BY mil.fecha DESC, man.id DESC
+                   ) as orden
+            FROM Mantenimiento man
+            JOIN Mileage mil ON man.mileage_id = mil.id
+            JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
+            {condicion}
+        )
+        WHERE orden = 1'''
+
+def _next_due_refresh_sql(pares):
+    """Trigger statements recomputing the Proximo_Mantenimiento rows of the given pairs."""
+    return f'''
+            DELETE FROM Proximo_Mantenimiento
+            WHERE (vehiculo_id, tipo_mantenimiento_id) IN ({pares});
+            INSERT INTO Proximo_Mantenimiento {_next_due_rows_sql(pares)};'''
+
+def _migration_next_due(conn):
+    """Proximo_Mantenimiento: the last service and next due date/mileage of every
+    (vehicle, maintenance type) pair, maintained by triggers like Cache_Version.
+
+    A new service replaces its pair's row only when it is the latest one, so saves and
+    backdated entries cost one primary-key lookup. Deleted or edited services, corrected
+    mileage readings and interval changes recompute the affected rows. Due dates are
+    indexed for fleet-wide range scans; due mileages are indexed per vehicle, since they
+    are compared against each vehicle's own odometer.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Proximo_Mantenimiento (
+            vehiculo_id INTEGER NOT NULL,
+            tipo_mantenimiento_id INTEGER NOT NULL,
+            mantenimiento_id INTEGER NOT NULL,
+            fecha_ultimo DATE NOT NULL,
+            mileage_ultimo INTEGER,
+            fecha_proximo DATE,
+            mileage_proximo INTEGER,
+            PRIMARY KEY (vehiculo_id, tipo_mantenimiento_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_proximo_mantenimiento_fecha
+        ON Proximo_Mantenimiento(fecha_proximo) WHERE fecha_proximo IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_proximo_mantenimiento_mileage
+        ON Proximo_Mantenimiento(vehiculo_id, mileage_proximo) WHERE mileage_proximo IS NOT NULL
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_proximo_mantenimiento_tipo
+        ON Proximo_Mantenimiento(tipo_mantenimiento_id)
+    ''')
+    conn.execute(f'''
+        INSERT OR REPLACE INTO Proximo_Mantenimiento {_next_due_rows_sql()}
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_proximo_mantenimiento_insert
+        AFTER INSERT ON Mantenimiento
+        BEGIN
+            INSERT INTO Proximo_Mantenimiento
+            SELECT NEW.vehiculo_id, NEW.tipo_mantenimiento_id, NEW.id, mil.fecha, mil.mileage,
+                   CASE WHEN t.meses_proximo_mantenimiento
+                        THEN date(mil.fecha, '+' || t.meses_proximo_mantenimiento || ' months')
+                   END,
+                   mil.mileage + t.miles_next_maintenance
+            FROM Mileage mil, Tipo_Mantenimiento t
+            WHERE mil.id = NEW.mileage_id AND t.id = NEW.tipo_mantenimiento_id
+            ON CONFLICT(vehiculo_id, tipo_mantenimiento_id) DO UPDATE SET
+                mantenimiento_id = excluded.mantenimiento_id,
+                fecha_ultimo = excluded.fecha_ultimo,
+                mileage_ultimo = excluded.mileage_ultimo,
+                fecha_proximo = excluded.fecha_proximo,
+                mileage_proximo = excluded.mileage_proximo
+            WHERE (excluded.fecha_ultimo, excluded.mantenimiento_id) > (fecha_ultimo, mantenimiento_id);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_proximo_mantenimiento_delete
+        AFTER DELETE ON Mantenimiento
+        BEGIN{_next_due_refresh_sql('SELECT OLD.vehiculo_id, OLD.tipo_mantenimiento_id')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_proximo_mantenimiento_update
+        AFTER UPDATE OF vehiculo_id, tipo_mantenimiento_id, mileage_id ON Mantenimiento
+        BEGIN{_next_due_refresh_sql(
+            'SELECT OLD.vehiculo_id, OLD.tipo_mantenimiento_id '
+            'UNION SELECT NEW.vehiculo_id, NEW.tipo_mantenimiento_id')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_proximo_mantenimiento_mileage_update
+        AFTER UPDATE OF fecha, mileage ON Mileage
+        BEGIN{_next_due_refresh_sql(
+            'SELECT vehiculo_id, tipo_mantenimiento_id FROM Mantenimiento WHERE mileage_id = NEW.id')}
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_proximo_mantenimiento_intervalo
+        AFTER UPDATE OF meses_proximo_mantenimiento, miles_next_maintenance ON Tipo_Mantenimiento
+        BEGIN
+            UPDATE Proximo_Mantenimiento
+            SET fecha_proximo = CASE WHEN NEW.meses_proximo_mantenimiento
+                                     THEN date(fecha_ultimo, '+' || NEW.meses_proximo_mantenimiento || ' months')
+                                END,
+                mileage_proximo = mileage_ultimo + NEW.miles_next_maintenance
+            WHERE tipo_mantenimiento_id = NEW.id;
+        END
+    ''')
+
+def _odometer_refresh_sql(vehiculo_id):
+    """Trigger statements recomputing one vehicle's Ultimo_Mileage row."""
+    return f'''
+            DELETE FROM Ultimo_Mileage WHERE vehiculo_id = {vehiculo_id};
+            INSERT INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage)
+            SELECT vehiculo_id, id, fecha, mileage FROM Mileage
+            WHERE vehiculo_id = {vehiculo_id}
+            ORDER BY fecha DESC, id DESC
+            LIMIT 1;'''
+
+def _migration_latest_odometer(conn):
+    """Ultimo_Mileage: each vehicle's latest odometer reading (value, date and Mileage id),
+    maintained by triggers.
+
+    "Latest" is the newest fecha, then the highest id, as in the history page. A new
+    reading replaces the row only when it is newer, so backdated readings leave it alone;
+    deleted or corrected readings recompute the vehicle's row with one index lookup.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Ultimo_Mileage (
+            vehiculo_id INTEGER PRIMARY KEY,
+            mileage_id INTEGER NOT NULL,
+            fecha DATE NOT NULL,
+            mileage INTEGER
+        )
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage)
+        SELECT vehiculo_id, id, fecha, mileage FROM (
+            SELECT vehiculo_id, id, fecha, mileage,
+                   ROW_NUMBER() OVER (PARTITION BY vehiculo_id ORDER BY fecha DESC, id DESC) as orden
+            FROM Mileage
+        )
+        WHERE orden = 1
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ultimo_mileage_insert
+        AFTER INSERT ON Mileage
+        BEGIN
+            INSERT INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage)
+            VALUES (NEW.vehiculo_id, NEW.id, NEW.fecha, NEW.mileage)
+            ON CONFLICT(vehiculo_id) DO UPDATE SET
+                mileage_id = excluded.mileage_id,
+                fecha = excluded.fecha,
+                mileage = excluded.mileage
+            WHERE (excluded.fecha, excluded.mileage_id) > (fecha, mileage_id);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ultimo_mileage_delete
+        AFTER DELETE ON Mileage
+        BEGIN{_odometer_refresh_sql('OLD.vehiculo_id')}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_ultimo_mileage_update
+        AFTER UPDATE OF vehiculo_id, fecha, mileage ON Mileage
+        BEGIN{_odometer_refresh_sql('OLD.vehiculo_id')}{_odometer_refresh_sql('NEW.vehiculo_id')}
+        END
+    ''')
+
+def _migration_odometer_projections(conn):
+    """Proyeccion_Mileage: each vehicle's fitted daily mileage rate (see
+    refresh_odometer_projections). migrate_db() fits the existing history once every
+    migration is applied, so this migration does not depend on the runtime fit."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Proyeccion_Mileage (
+            vehiculo_id INTEGER PRIMARY KEY,
+            millas_dia REAL,
+            lecturas INTEGER NOT NULL,
+            dias INTEGER NOT NULL,
+            version INTEGER,
+            calculado_en TEXT NOT NULL
+        )
+    ''')
+
+def _migration_odometer_trigger_fixes(conn):
+    """Rebuild Ultimo_Mileage without phantom rows and fix the triggers behind them.
+
+    A Mileage row without a vehicle made the latest-reading trigger insert NULL into the
+    INTEGER PRIMARY KEY, which SQLite turns into a new id: a row for a vehicle that does
+    not exist. The history cache version triggers failed on such rows as well. Moving a
+    reading to another vehicle also left the next-due rows of the services recorded at
+    it unrefreshed; those rows (under the services' vehicle, normally the reading's old
+    one) are now recomputed too.
+    """
+    conn.execute('DROP TRIGGER IF EXISTS trg_ultimo_mileage_insert')
+    conn.execute('''
+        CREATE TRIGGER trg_ultimo_mileage_insert
+        AFTER INSERT ON Mileage
+        WHEN NEW.vehiculo_id IS NOT NULL
+        BEGIN
+            INSERT INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage)
+            VALUES (NEW.vehiculo_id, NEW.id, NEW.fecha, NEW.mileage)
+            ON CONFLICT(vehiculo_id) DO UPDATE SET
+                mileage_id = excluded.mileage_id,
+                fecha = excluded.fecha,
+                mileage = excluded.mileage
+            WHERE (excluded.fecha, excluded.mileage_id) > (fecha, mileage_id);
+        END
+    ''')
+    conn.execute('DELETE FROM Ultimo_Mileage')
+    conn.execute('''
+        INSERT INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage)
+        SELECT vehiculo_id, id, fecha, mileage FROM (
+            SELECT vehiculo_id, id, fecha, mileage,
+                   ROW_NUMBER() OVER (PARTITION BY vehiculo_id ORDER BY fecha DESC, id DESC) as orden
+            FROM Mileage
+            WHERE vehiculo_id IS NOT NULL
+        )
+        WHERE orden = 1
+    ''')
+    # The history cache version triggers failed on such rows too ('historial:' || NULL)
+    for table in ('Mantenimiento', 'Mileage'):
+        for event, rows in (('INSERT', ('NEW',)), ('UPDATE', ('NEW', 'OLD')), ('DELETE', ('OLD',))):
+            bumps = []
+            for row in rows:
+                condition = 'OLD.vehiculo_id IS NOT NEW.vehiculo_id' if row == 'OLD' and event == 'UPDATE' else '1'
+                bumps.append(f'''
+                    INSERT INTO Cache_Version (etiqueta, version)
+                    SELECT 'historial:' || {row}.vehiculo_id, 1
+                    WHERE {condition} AND {row}.vehiculo_id IS NOT NULL
+                    ON CONFLICT(etiqueta) DO UPDATE SET version = version + 1;''')
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_cache_version_{table.lower()}_{event.lower()}')
+            conn.execute(f'''
+                CREATE TRIGGER trg_cache_version_{table.lower()}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN{''.join(bumps)}
+                END
+            ''')
+    conn.execute('DROP TRIGGER IF EXISTS trg_proximo_mantenimiento_mileage_update')
+    conn.execute(f'''
+        CREATE TRIGGER trg_proximo_mantenimiento_mileage_update
+        AFTER UPDATE OF vehiculo_id, fecha, mileage ON Mileage
+        BEGIN{_next_due_refresh_sql(
+            'SELECT vehiculo_id, tipo_mantenimiento_id FROM Mantenimiento '
+            'WHERE mileage_id IN (OLD.id, NEW.id)')}
+        END
+    ''')
+
+def _migration_flagged_readings(conn):
+    """Mileage_Marcado: odometer rollbacks received with on_rollback='flag', kept for
+    review outside Mileage so latest readings, next-due rows, projections and history
+    never see them. The neighbouring readings they contradict are stored alongside."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS Mileage_Marcado (
+            id INTEGER PRIMARY KEY,
+            vehiculo_id INTEGER NOT NULL,
+            fecha DATE NOT NULL,
+            mileage INTEGER NOT NULL,
+            fecha_anterior DATE,
+            mileage_anterior INTEGER,
+            fecha_siguiente DATE,
+            mileage_siguiente INTEGER,
+            recibido_en TEXT NOT NULL,
+            UNIQUE (vehiculo_id, fecha, mileage),
+            FOREIGN KEY (vehiculo_id) REFERENCES Vehiculo(id)
+        )
+    ''')
+
+def _migration_projection_cache_versions(conn):
+    """'proyeccion:<vehiculo_id>' versions, bumped when a vehicle's fitted rate changes.
+
+    History pages show estimated due dates computed from Proyeccion_Mileage, and a
+    refit can come later than the readings behind it (ODOMETER_PROJECTION_INTERVAL).
+    A separate tag is needed: a fit records the 'historial' version it was computed
+    from, so bumping that one would make every fit look stale again.
+    """
+    for event, row, condition in (('INSERT', 'NEW', ''),
+                                  ('UPDATE', 'NEW', 'WHEN OLD.millas_dia IS NOT NEW.millas_dia'),
+                                  ('DELETE', 'OLD', '')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_cache_version_proyeccion_{event.lower()}
+            AFTER {event} ON Proyeccion_Mileage
+            {condition}
+            BEGIN
+                INSERT INTO Cache_Version (etiqueta, version) VALUES ('proyeccion:' || {row}.vehiculo_id, 1)
+                ON CONFLICT(etiqueta) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+# (version, description, migration) - append new migrations, never reorder or edit applied ones
+SCHEMA_MIGRATIONS = [
+    (1, 'Base schema', _migration_base_schema),
+    (2, 'Convert kilometers to miles', _migration_kilometers_to_miles),
+    (3, 'Tipo_Mantenimiento integer primary key', _migration_tipo_mantenimiento_primary_key),
+    (4, 'Lookup indexes', _migration_lookup_indexes),
+    (5, 'Suggestion cache', _migration_suggestion_cache),
+    (6, 'Reference cache versions', _migration_reference_cache_versions),
+    (7, 'History cache versions', _migration_history_cache_versions),
+    (8, 'Natural key constraints', _migration_natural_key_constraints),
+    (9, 'Next-due maintenance table', _migration_next_due),
+    (10, 'Latest odometer per vehicle', _migration_latest_odometer),
+    (11, 'Odometer projections', _migration_odometer_projections),
+    (12, 'Odometer trigger fixes', _migration_odometer_trigger_fixes),
+    (13, 'Flagged odometer readings', _migration_flagged_readings),
+    (14, 'Projection cache versions', _migration_projection_cache_versions),
+]
+
+def get_schema_version(conn):
+    if not _table_exists(conn, 'schema_version'):
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate_db():
+    """Apply pending migrations in order and return the list of versions applied.
+
+    Each migration runs in its own IMMEDIATE transaction and re-checks schema_version
+    once it holds the write lock, so concurrent worker processes starting at the same
+    time apply each migration only once. When any was applied, the odometer projections
+    of vehicles without an up-to-date fit are then computed against the final schema.
+    """
+    conn = get_db_connection()
+    applied = []
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        for version, description, migration in SCHEMA_MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                    conn.rollback()
+                    continue
+                migration(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                    (version, description, get_cr_time().isoformat())
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+            app.logger.info('Applied schema migration %s: %s', version, description)
+        if applied and _table_exists(conn, 'Proyeccion_Mileage'):
+            with transaction(conn):
+                refresh_odometer_projections(conn)
+    finally:
+        conn.close()
+    return applied
+
+# Set once a request of this process has found every migration applied
+_schema_checked = False
+
+@app.before_request
+def require_current_schema():
+    """Refuse requests while migrations are pending, instead of failing on missing tables.
+
+    A server started without DB_AUTO_MIGRATE does not migrate, and importing the app must
+    not touch the database, so the first request of each process checks schema_version.
+    Until the check passes every request gets a 503 naming the fix.
+    """
+    global _schema_checked
+    if _schema_checked:
+        return None
+    esperada = SCHEMA_MIGRATIONS[-1][0]
+    try:
+        actual = get_schema_version(get_db())
+    except sqlite3.OperationalError:
+        # A database file that does not exist yet cannot be opened read-only
+        actual = 0
+    if actual < esperada:
+        mensaje = (f'Database {DB_PATH} is at schema version {actual}, this app needs version {esperada}. '
+                   'Run `python initialize_db.py` (or start the server with DB_AUTO_MIGRATE=1).')
+        app.logger.error(mensaje)
+        return mensaje, 503
+    _schema_checked = True
+    return None
+
 def get_cr_time():
     cr_tz = pytz.timezone('America/Costa_Rica')
     return datetime.now(cr_tz)
@@ -78,18 +1274,161 @@ def after_request(response):
     response.headers["Expires"] = "0"
     return response
 
+class UserCache:
+    """Per-process cache of logged-in users keyed by user id, with a short TTL.
+
+    Only the public columns are cached (never the password hash). Entries are dropped
+    explicitly through invalidate() when a user is created or changed.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = loader(user_id)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[user_id] = (now + self.ttl, user)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+            }
+
+user_cache = UserCache(USER_CACHE_TTL)
+
+class ReferenceCache:
+    """In-process cache of rarely changing lists (vehicles, mechanics, maintenance types).
+
+    Every entry records the versions its tags had in the Cache_Version table when it was
+    loaded, and is reused only while they are unchanged. Triggers bump the versions on
+    every write, so one primary-key read validates an entry in any worker process. Hits
+    and misses are counted per list name.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = {}
+
+    @staticmethod
+    def versions(conn, tags):
+        placeholders = ', '.join('?' for _ in tags)
+        rows = dict(conn.execute(
+            f'SELECT etiqueta, version FROM Cache_Version WHERE etiqueta IN ({placeholders})', tags
+        ).fetchall())
+        return tuple(rows.get(tag, 0) for tag in tags)
+
+    def get(self, conn, name, key, tags, loader):
+        """Cached loader(conn) for (name, key); callers must not modify the returned value."""
+        # Versions are read before loading, so a concurrent write can only cause a reload
+        versions = self.versions(conn, tags)
+        with self._lock:
+            hits_misses = self._counts.setdefault(name, [0, 0])
+            entry = self._entries.get((name, key))
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end((name, key))
+                hits_misses[0] += 1
+                return entry[1]
+            hits_misses[1] += 1
+
+        value = loader(conn)
+        with self._lock:
+            self._entries[(name, key)] = (versions, value)
+            self._entries.move_to_end((name, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = {'entries': len(self._entries)}
+            for name, (hits, misses) in sorted(self._counts.items()):
+                stats[name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / (hits + misses), 3),
+                }
+            return stats
+
+reference_cache = ReferenceCache()
+# History pages vary with every search and sort, so they get their own, smaller cache
+# instead of evicting the reference lists above
+history_page_cache = ReferenceCache(max_entries=HISTORY_PAGE_CACHE_SIZE)
+
+def _rows_as_dicts(rows):
+    return [dict(row) for row in rows]
+
+def get_vehiculos(conn):
+    """All vehicles with their make, model and year."""
+    return reference_cache.get(conn, 'vehiculos', None, ('vehiculos',), lambda conn: _rows_as_dicts(conn.execute('''
+        SELECT v.id, v.alias, d.marca, d.modelo, d.anio, d.id as detalle_id
+        FROM Vehiculo v
+        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
+    ''')))
+
+def get_mecanicos(conn):
+    """All mechanics, by name."""
+    return reference_cache.get(conn, 'mecanicos', None, ('mecanicos',), lambda conn: _rows_as_dicts(
+        conn.execute('SELECT * FROM Mecánico ORDER BY nombre_mecanico')))
+
+def get_tipos_vehiculo(conn, vehiculo_id):
+    """Maintenance types (id, nombre, categoria) defined for a vehicle's make and model."""
+    return reference_cache.get(conn, 'tipos', vehiculo_id, ('tipos',), lambda conn: _rows_as_dicts(conn.execute('''
+        SELECT t.id, t.nombre, t.categoria
+        FROM Vehiculo v
+        JOIN Tipo_Mantenimiento t ON t.vehiculo_detalle_id = v.detalle_id
+        WHERE v.id = ?
+        ORDER BY t.categoria, t.nombre
+    ''', (vehiculo_id,))))
+
+# Endpoints that never use g.user, so the session user is not loaded for them
+ANONYMOUS_ENDPOINTS = {'static', 'favicon', 'index', 'logout'}
+
+def _load_user(user_id):
+    user = get_db().execute(
+        'SELECT id, username FROM Usuario WHERE id = ?', (user_id,)
+    ).fetchone()
+    return dict(user) if user else None
+
 # Function to load user before each request
 @app.before_request
 def load_logged_in_user():
     user_id = session.get('user_id')
-    if user_id is None:
+    if user_id is None or request.endpoint is None or request.endpoint in ANONYMOUS_ENDPOINTS:
         g.user = None
     else:
-        conn = get_db_connection()
-        g.user = conn.execute(
-            'SELECT * FROM Usuario WHERE id = ?', (user_id,)
-        ).fetchone()
-        conn.close()
+        g.user = user_cache.get(user_id, _load_user)
 
 # Decorator for routes that require login
 def login_required(view):
@@ -128,152 +1467,826 @@ def index():
 @login_required
 def dashboard():
     # This is the new route for the main page after login
-    conn = get_db_connection()
-    vehiculos = conn.execute('''
-        SELECT v.id, v.alias, d.marca, d.modelo, d.anio
-        FROM Vehiculo v
-        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-    ''').fetchall()
+    conn = get_db()
+    vehiculos = get_vehiculos(conn)
 
     # Fetch mechanics for the new section
-    mecanicos = conn.execute('SELECT * FROM Mecánico ORDER BY nombre_mecanico').fetchall()
+    mecanicos = get_mecanicos(conn)
 
-    conn.close()
     return render_template('index.html', vehiculos=vehiculos, mecanicos=mecanicos)
 
 @app.route('/registration')
 @login_required
 def registro():
-    conn = get_db_connection()
-    vehiculos = conn.execute('''
-        SELECT v.id, v.alias, d.marca, d.modelo, d.anio, d.id as detalle_id
-        FROM Vehiculo v
-        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-    ''').fetchall()
-    mecanicos = conn.execute('SELECT * FROM Mecánico').fetchall()
-    conn.close()
+    conn = get_db()
+    vehiculos = get_vehiculos(conn)
+    mecanicos = get_mecanicos(conn)
     return render_template('mantenimiento_registro.html', vehiculos=vehiculos, mecanicos=mecanicos)
 
 @app.route('/maintenance_add')
 @login_required
 def maintenance_add():
-    conn = get_db_connection()
-    vehiculos = conn.execute('''
-        SELECT v.id, v.alias, d.marca, d.modelo, d.anio, d.id as detalle_id
-        FROM Vehiculo v
-        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-    ''').fetchall()
-    mecanicos = conn.execute('SELECT * FROM Mecánico').fetchall()
-    conn.close()
+    conn = get_db()
+    vehiculos = get_vehiculos(conn)
+    mecanicos = get_mecanicos(conn)
     return render_template('mantenimiento_registro.html', vehiculos=vehiculos, mecanicos=mecanicos)
 
+# --- Maintenance history queries ---
+
+def _sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _translation_sql(column, translations):
+    """SQL CASE expression applying one of the translation dictionaries inside a query."""
+    whens = ' '.join(f'WHEN {_sql_literal(k)} THEN {_sql_literal(v)}' for k, v in translations.items())
+    return f'CASE {column} {whens} ELSE {column} END'
+
+# Columns of one maintenance record with the same translated values the page displays
+HISTORY_COLUMNS_SQL = f'''
+        man.id,
+        man.vehiculo_id,
+        strftime('%d/%m/%Y', mil.fecha) as fecha,
+        mil.fecha as fecha_iso,
+        mil.mileage,
+        {_translation_sql('t.nombre', MAINTENANCE_TYPE_TRANSLATIONS)} as tipo_mantenimiento,
+        {_translation_sql('t.categoria', CATEGORY_TRANSLATIONS)} as categoria,
+        {_translation_sql('m.nombre_mecanico', MECHANIC_TRANSLATIONS)} as mecanico,
+        man.precio,
+        t.miles_next_maintenance,
+        CASE
+            WHEN man.fecha_proximo_mantenimiento IS NULL THEN ''
+            ELSE strftime('%d/%m/%Y', man.fecha_proximo_mantenimiento)
+        END as fecha_proximo,
+        man.fecha_proximo_mantenimiento as fecha_proximo_iso,
+        CASE
+            WHEN t.miles_next_maintenance IS NOT NULL THEN
+            mil.mileage + t.miles_next_maintenance
+            ELSE NULL
+        END as proximo_mileage
+'''
+
+def _estimated_due_sql(objetivo, lectura='um', proyeccion='pm'):
+    """SQL for the date a vehicle is expected to reach the objetivo odometer value: its
+    latest reading's date plus the miles to go at its fitted rate (see Odometer projections)."""
+    return f'''CASE WHEN {proyeccion}.millas_dia > 0 THEN date({lectura}.fecha, printf('%+d days',
+            CAST(ROUND(({objetivo} - {lectura}.mileage) / {proyeccion}.millas_dia) AS INTEGER))) END'''
+
+# One row per maintenance record. fecha_estimada_iso is when the record's next mileage is
+# expected to be reached. orden_tipo numbers the records of each maintenance type from
+# newest to oldest, so orden_tipo = 1 is the "Recent Maintenance" table and the rest are
+# "Repeated Maintenance".
+HISTORY_SQL = f'''
+    SELECT
+        {HISTORY_COLUMNS_SQL},
+        {_estimated_due_sql('mil.mileage + t.miles_next_maintenance')} as fecha_estimada_iso,
+        ROW_NUMBER() OVER (
+            PARTITION BY man.vehiculo_id, t.nombre
+            ORDER BY mil.fecha DESC, man.id DESC
+        ) as orden_tipo
+    FROM Mantenimiento man
+    JOIN Mileage mil ON man.mileage_id = mil.id
+    JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
+    JOIN Mecánico m ON man.mecanico_id = m.id
+    LEFT JOIN Ultimo_Mileage um ON um.vehiculo_id = man.vehiculo_id
+    LEFT JOIN Proyeccion_Mileage pm ON pm.vehiculo_id = man.vehiculo_id
+'''
+
+# Sortable columns of the history tables (DataTables column data name -> SQL expression)
+HISTORY_ORDER_COLUMNS = {
+    'fecha': 'fecha_iso',
+    'fecha_iso': 'fecha_iso',
+    'mileage': 'mileage',
+    'categoria': 'categoria',
+    'tipo_mantenimiento': 'tipo_mantenimiento',
+    'mecanico': 'mecanico',
+    'precio': 'precio',
+    'fecha_proximo': "COALESCE(fecha_proximo_iso, fecha_estimada_iso, '9999-12-31')",
+    'fecha_proximo_iso': "COALESCE(fecha_proximo_iso, fecha_estimada_iso, '9999-12-31')",
+    'proximo_mileage': 'proximo_mileage',
+}
+
+HISTORY_SEARCH_COLUMNS = ['fecha', 'CAST(mileage AS TEXT)', 'categoria', 'tipo_mantenimiento',
+                          'mecanico', 'CAST(precio AS TEXT)', 'fecha_proximo']
+
+def build_history_filters(scope=None, categoria=None, tipo=None, mecanico=None, search=None):
+    """Return (scope_sql, filter_sql, filter_params) for queries over the history CTE.
+
+    Filters compare against the translated values shown in the filter dropdowns.
+    """
+    scope_sql = '1'
+    if scope == 'latest':
+        scope_sql = 'orden_tipo = 1'
+    elif scope == 'repeated':
+        scope_sql = 'orden_tipo > 1'
+
+    conditions = []
+    params = []
+    for column, value in (('categoria', categoria), ('tipo_mantenimiento', tipo), ('mecanico', mecanico)):
+        if value:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if search:
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in HISTORY_SEARCH_COLUMNS) + ')')
+        params.extend([pattern] * len(HISTORY_SEARCH_COLUMNS))
+    filter_sql = ' AND '.join(conditions) if conditions else '1'
+    return scope_sql, filter_sql, params
+
+def query_history_page(conn, vehiculo_id, scope=None, categoria=None, tipo=None, mecanico=None,
+                       search=None, order_column='fecha_iso', order_dir='desc', start=0, length=100):
+    """One page of a vehicle's maintenance history plus total and filtered counts."""
+    scope_sql, filter_sql, filter_params = build_history_filters(
+        scope, categoria, tipo, mecanico, search)
+    base = f'WITH historial AS ({HISTORY_SQL} WHERE man.vehiculo_id = ?)'
+
+    totales = conn.execute(f'''
+        {base}
+        SELECT COUNT(*) as total,
+               COALESCE(SUM(CASE WHEN {filter_sql} THEN 1 ELSE 0 END), 0) as filtrados
+        FROM historial
+        WHERE {scope_sql}
+    ''', [vehiculo_id] + filter_params).fetchone()
+
+    order_sql = HISTORY_ORDER_COLUMNS.get(order_column, 'fecha_iso')
+    direction = 'ASC' if str(order_dir).lower() == 'asc' else 'DESC'
+    page_sql = f'''
+        {base}
+        SELECT * FROM historial
+        WHERE {scope_sql} AND {filter_sql}
+        ORDER BY {order_sql} {direction}, id DESC
+    '''
+    params = [vehiculo_id] + filter_params
+    if length is not None and length >= 0:
+        page_sql += ' LIMIT ? OFFSET ?'
+        params += [length, max(start, 0)]
+    rows = conn.execute(page_sql, params).fetchall()
+    return totales['total'], totales['filtrados'], [dict(row) for row in rows]
+
+def history_cache_tags(vehiculo_id):
+    """ReferenceCache tags of data derived from a vehicle's history.
+
+    Besides the vehicle's own maintenance and mileage rows, history rows show the
+    names of maintenance types and mechanics, which can be edited separately, and due
+    dates estimated from the vehicle's fitted mileage rate.
+    """
+    return (f'historial:{vehiculo_id}', f'proyeccion:{vehiculo_id}', 'tipos', 'mecanicos')
+
+def get_history_filter_values(conn, vehiculo_id):
+    """Unique (translated) categories, types and mechanics used in a vehicle's history."""
+    rows = conn.execute('''
+        SELECT DISTINCT t.categoria, t.nombre, m.nombre_mecanico
+        FROM Mantenimiento man
+        JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
+        JOIN Mecánico m ON man.mecanico_id = m.id
+        WHERE man.vehiculo_id = ?
+    ''', (vehiculo_id,)).fetchall()
+    categorias = sorted({CATEGORY_TRANSLATIONS.get(r['categoria'], r['categoria']) for r in rows})
+    tipos = sorted({MAINTENANCE_TYPE_TRANSLATIONS.get(r['nombre'], r['nombre']) for r in rows})
+    mecanicos = sorted({MECHANIC_TRANSLATIONS.get(r['nombre_mecanico'], r['nombre_mecanico']) for r in rows})
+    return categorias, tipos, mecanicos
+
 @app.route('/maintenance/<int:vehiculo_id>')
 @login_required
 def ver_mantenimientos(vehiculo_id):
-    conn = get_db_connection()
-    vehiculos = conn.execute('''
-        SELECT v.id, v.alias, d.marca, d.modelo, d.anio
-        FROM Vehiculo v
-        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-    ''').fetchall()
+    conn = get_db()
+    vehiculos = get_vehiculos(conn)
 
     # Get vehicle information
     vehiculo = conn.execute('''
-        SELECT v.id, v.alias,
-            (SELECT m.mileage
-             FROM Mileage m
-             WHERE m.vehiculo_id = v.id
-             ORDER BY m.fecha DESC, m.id DESC
-             LIMIT 1) as ultimo_mileage
+        SELECT v.id, v.alias, u.mileage as ultimo_mileage
         FROM Vehiculo v
         JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
+        LEFT JOIN Ultimo_Mileage u ON u.vehiculo_id = v.id
         WHERE v.id = ?
     ''', (vehiculo_id,)).fetchone()
 
-    # Get maintenance records
-    mantenimientos = conn.execute('''
-        SELECT
-            strftime('%d/%m/%Y', mil.fecha) as fecha,
-            mil.fecha as fecha_iso,
-            mil.mileage,
-            t.nombre as tipo_mantenimiento,
-            t.categoria,
-            m.nombre_mecanico as mecanico,
-            man.precio,
-            t.miles_next_maintenance,
-            CASE
-                WHEN man.fecha_proximo_mantenimiento IS NULL THEN ''
-                ELSE strftime('%d/%m/%Y', man.fecha_proximo_mantenimiento)
-            END as fecha_proximo,
-            man.fecha_proximo_mantenimiento as fecha_proximo_iso,
-            CASE
-                WHEN t.miles_next_maintenance IS NOT NULL THEN
-                mil.mileage + t.miles_next_maintenance
-                ELSE NULL
-            END as proximo_mileage
-        FROM Mantenimiento man
-        JOIN Mileage mil ON man.mileage_id = mil.id
-        JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
-        JOIN Mecánico m ON man.mecanico_id = m.id
-        WHERE man.vehiculo_id = ?
-        ORDER BY mil.fecha DESC
-    ''', (vehiculo_id,)).fetchall()
+    # Maintenance rows are loaded page by page from historial_mantenimientos;
+    # the page only needs the values for the filter dropdowns.
+    categorias_unicas, tipos_unicos, mecanicos_unicos = reference_cache.get(
+        conn, 'historial_filtros', vehiculo_id, history_cache_tags(vehiculo_id),
+        lambda conn: get_history_filter_values(conn, vehiculo_id))
 
-    # Convert to list of dicts and translate values
-    mantenimientos_list = []
-    for m in mantenimientos:
-        m_dict = dict(m)
-        m_dict['categoria'] = CATEGORY_TRANSLATIONS.get(m['categoria'], m['categoria'])
-        m_dict['tipo_mantenimiento'] = MAINTENANCE_TYPE_TRANSLATIONS.get(m['tipo_mantenimiento'], m['tipo_mantenimiento'])
-        m_dict['mecanico'] = MECHANIC_TRANSLATIONS.get(m['mecanico'], m['mecanico'])
-        mantenimientos_list.append(m_dict)
-
-    # Get unique values for filters (using translated values)
-    categorias_unicas = sorted(set(m['categoria'] for m in mantenimientos_list))
-    tipos_unicos = sorted(set(m['tipo_mantenimiento'] for m in mantenimientos_list))
-    mecanicos_unicos = sorted(set(m['mecanico'] for m in mantenimientos_list))
-
-    conn.close()
     # Get current date in ISO format for comparison
     today_iso = get_cr_time().strftime('%Y-%m-%d')
 
     return render_template('mantenimientos.html',
                          vehiculos=vehiculos,
                          vehiculo=vehiculo,
-                         mantenimientos=mantenimientos_list,
                          categorias_unicas=categorias_unicas,
                          tipos_unicos=tipos_unicos,
                          mecanicos_unicos=mecanicos_unicos,
                          today_iso=today_iso)
 
+@app.route('/maintenance/<int:vehiculo_id>/history')
+@login_required
+def historial_mantenimientos(vehiculo_id):
+    """DataTables server-side processing endpoint for the maintenance history tables.
+
+    Besides the standard draw/start/length/search/order parameters it accepts
+    scope (latest|repeated) and the categoria, tipo and mecanico filters.
+    """
+    args = request.args
+    try:
+        draw = int(args.get('draw', 0))
+        start = int(args.get('start', 0))
+        length = int(args.get('length', 100))
+        order_index = args.get('order[0][column]')
+    except ValueError:
+        return jsonify({'error': 'Invalid paging parameters'}), 400
+
+    order_column = 'fecha_iso'
+    if order_index is not None:
+        order_column = args.get(f'columns[{order_index}][data]', order_column)
+
+    consulta = dict(
+        scope=args.get('scope'),
+        categoria=args.get('categoria'),
+        tipo=args.get('tipo'),
+        mecanico=args.get('mecanico'),
+        search=args.get('search[value]', '').strip(),
+        order_column=order_column,
+        order_dir=args.get('order[0][dir]', 'desc'),
+        start=start,
+        length=length,
+    )
+    # Pages are cached per vehicle and query until the vehicle's history changes
+    total, filtrados, rows = history_page_cache.get(
+        get_db(), 'historial', (vehiculo_id,) + tuple(sorted(consulta.items())),
+        history_cache_tags(vehiculo_id),
+        lambda conn: query_history_page(conn, vehiculo_id, **consulta))
+    return jsonify({
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': filtrados,
+        'data': rows,
+    })
+
+# --- History export ---
+
+# Rows written per chunk of a streamed export response
+EXPORT_BATCH_ROWS = 500
+
+# (header, column written to CSV, column written to XLSX). CSV files keep the dd/mm/yyyy
+# text shown on the page; XLSX cells get real dates and numbers.
+EXPORT_COLUMNS = [
+    ('Date', 'fecha', 'fecha_iso'),
+    ('Mileage', 'mileage', 'mileage'),
+    ('Category', 'categoria', 'categoria'),
+    ('Maintenance Type', 'tipo_mantenimiento', 'tipo_mantenimiento'),
+    ('Mechanic', 'mecanico', 'mecanico'),
+    ('Price', 'precio', 'precio'),
+    ('Next Maintenance', 'fecha_proximo', 'fecha_proximo_iso'),
+    ('Next Mileage', 'proximo_mileage', 'proximo_mileage'),
+]
+EXPORT_VEHICLE_COLUMN = ('Vehicle', 'vehiculo', 'vehiculo')
+
+def iter_history_export(conn, vehiculo_id=None, categoria=None, tipo=None, mecanico=None, search=None):
+    """Yield the maintenance records of one vehicle (or the whole fleet) in date order.
+
+    The join is driven from Mileage in uq_mileage_lectura order (CROSS JOIN keeps it as
+    the outer loop and the ORDER BY names Mileage's own columns), so SQLite returns rows
+    straight off the index instead of sorting the full history first, and the cursor is
+    read one row at a time.
+    """
+    _, filter_sql, params = build_history_filters(None, categoria, tipo, mecanico, search)
+    vehiculo_sql = '1'
+    if vehiculo_id is not None:
+        vehiculo_sql = 'mil.vehiculo_id = ?'
+        params = [vehiculo_id] + params
+    cursor = conn.execute(f'''
+        SELECT * FROM (
+            SELECT v.alias as vehiculo, mil.vehiculo_id as lectura_vehiculo_id, mil.id as lectura_id,
+                   {HISTORY_COLUMNS_SQL}
+            FROM Mileage mil
+            CROSS JOIN Mantenimiento man ON man.mileage_id = mil.id
+            JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
+            JOIN Mecánico m ON man.mecanico_id = m.id
+            JOIN Vehiculo v ON v.id = mil.vehiculo_id
+            WHERE {vehiculo_sql}
+        )
+        WHERE {filter_sql}
+        ORDER BY lectura_vehiculo_id, fecha_iso, mileage, lectura_id
+    ''', params)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+def stream_history_csv(rows, columnas):
+    """CSV export as a stream of byte chunks (UTF-8 with BOM so Excel detects the encoding)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for header, _, _ in columnas])
+    for n, row in enumerate(rows, 1):
+        writer.writerow([row[columna] for _, columna, _ in columnas])
+        if n % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+class _ChunkSink:
+    """Write-only, unseekable file object whose contents are drained in chunks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+_XLSX_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_XLSX_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_XLSX_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        f'<Relationships xmlns="{_XLSX_PKG_REL_NS}">'
+        f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        f'<workbook xmlns="{_XLSX_MAIN_NS}" xmlns:r="{_XLSX_REL_NS}">'
+        '<sheets><sheet name="Maintenance" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        f'<Relationships xmlns="{_XLSX_PKG_REL_NS}">'
+        f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_XLSX_REL_NS}/styles" Target="styles.xml"/>'
+        '</Relationships>'),
+    # Cell styles: 0 default, 1 bold header, 2 dd/mm/yyyy date
+    'xl/styles.xml': (
+        f'<styleSheet xmlns="{_XLSX_MAIN_NS}">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'),
+}
+# Characters XML 1.0 does not allow in text
+_XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EXCEL_EPOCH = date(1899, 12, 30).toordinal()
+
+def _xlsx_cell(valor, fecha=False, estilo=0):
+    if valor is None or valor == '':
+        return '<c/>'
+    if fecha:
+        try:
+            serial = date.fromisoformat(str(valor)[:10]).toordinal() - _EXCEL_EPOCH
+            return f'<c s="2"><v>{serial}</v></c>'
+        except ValueError:
+            pass
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    texto = xml_escape(_XML_INVALID_CHARS.sub('', str(valor)))
+    estilo_sql = f' s="{estilo}"' if estilo else ''
+    return f'<c t="inlineStr"{estilo_sql}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+def stream_history_xlsx(rows, columnas):
+    """XLSX export as a stream of byte chunks.
+
+    The workbook is a zip written to an unseekable sink: the worksheet entry is deflated
+    row by row and its sizes go in a trailing data descriptor, so only the current batch
+    of compressed bytes is ever held in memory. Strings are written inline, which avoids
+    building a shared-strings table of the whole export.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _XLSX_STATIC_PARTS.items():
+            libro.writestr(nombre, '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + contenido)
+        yield sink.drain()
+
+        with libro.open('xl/worksheets/sheet1.xml', 'w') as hoja:
+            encabezados = ''.join(_xlsx_cell(header, estilo=1) for header, _, _ in columnas)
+            hoja.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<worksheet xmlns="{_XLSX_MAIN_NS}"><sheetData><row>{encabezados}</row>'
+            ).encode('utf-8'))
+            fechas = [columna.endswith('_iso') for _, _, columna in columnas]
+            lote = []
+            for row in rows:
+                celdas = ''.join(_xlsx_cell(row[columna], fecha)
+                                 for (_, _, columna), fecha in zip(columnas, fechas))
+                lote.append(f'<row>{celdas}</row>')
+                if len(lote) == EXPORT_BATCH_ROWS:
+                    hoja.write(''.join(lote).encode('utf-8'))
+                    lote.clear()
+                    yield sink.drain()
+            hoja.write((''.join(lote) + '</sheetData></worksheet>').encode('utf-8'))
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    'csv': (stream_history_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (stream_history_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/maintenance/<int:vehiculo_id>/export.<formato>')
+@app.route('/export/history.<formato>')
+@login_required
+def exportar_historial(formato, vehiculo_id=None):
+    """Download the maintenance history of a vehicle, or of the whole fleet, as CSV or XLSX.
+
+    Accepts the categoria, tipo, mecanico and search filters of the history page. The
+    file is streamed from a database cursor, so exports of any size use constant memory.
+    """
+    if formato not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unsupported export format'}), 404
+    escribir, mimetype = EXPORT_FORMATS[formato]
+
+    columnas = EXPORT_COLUMNS
+    nombre = 'maintenance_fleet'
+    if vehiculo_id is not None:
+        vehiculo = get_db().execute('SELECT alias FROM Vehiculo WHERE id = ?', (vehiculo_id,)).fetchone()
+        if vehiculo is None:
+            return jsonify({'error': 'Vehicle not found'}), 404
+        nombre = f"maintenance_{vehiculo['alias']}"
+    else:
+        columnas = [EXPORT_VEHICLE_COLUMN] + EXPORT_COLUMNS
+    filtros = {campo: request.args.get(campo) or None for campo in ('categoria', 'tipo', 'mecanico')}
+    filtros['search'] = request.args.get('search', '').strip() or None
+
+    def contenido():
+        # The body is produced after the request ends, so it borrows its own connection
+        with db_read_pool.connection() as conn:
+            yield from escribir(iter_history_export(conn, vehiculo_id, **filtros), columnas)
+
+    archivo = f'{nombre}.{formato}'
+    respaldo = secure_filename(archivo) or f'maintenance.{formato}'
+    return Response(contenido(), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename=\"{respaldo}\"; "
+                               f"filename*=UTF-8''{urllib.parse.quote(archivo)}",
+    })
+
+# Denormalized maintenance records for the columnar analytics export (export_analytics.py).
+# Rows come in id order, which is the order Mantenimiento's AUTOINCREMENT key assigns, so
+# an incremental export resumes right after the last id it wrote.
+ANALYTICS_EXPORT_SQL = f'''
+    SELECT
+        man.id as maintenance_id,
+        man.vehiculo_id as vehicle_id,
+        v.alias as vehicle,
+        d.marca as make,
+        d.modelo as model,
+        d.anio as year,
+        mil.fecha as service_date,
+        mil.mileage,
+        man.tipo_mantenimiento_id as maintenance_type_id,
+        {_translation_sql('t.nombre', MAINTENANCE_TYPE_TRANSLATIONS)} as maintenance_type,
+        {_translation_sql('t.categoria', CATEGORY_TRANSLATIONS)} as category,
+        man.mecanico_id as mechanic_id,
+        {_translation_sql('m.nombre_mecanico', MECHANIC_TRANSLATIONS)} as mechanic,
+        man.precio as price,
+        t.miles_next_maintenance,
+        t.meses_proximo_mantenimiento as months_next_maintenance,
+        man.fecha_proximo_mantenimiento as next_due_date,
+        mil.mileage + t.miles_next_maintenance as next_due_mileage
+    FROM Mantenimiento man
+    JOIN Mileage mil ON man.mileage_id = mil.id
+    JOIN Tipo_Mantenimiento t ON man.tipo_mantenimiento_id = t.id
+    JOIN Mecánico m ON man.mecanico_id = m.id
+    JOIN Vehiculo v ON man.vehiculo_id = v.id
+    JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
+    WHERE man.id > ?
+    ORDER BY man.id
+'''
+
+ANALYTICS_BATCH_ROWS = 50000
+
+def iter_analytics_batches(conn, desde_id=0, batch_size=ANALYTICS_BATCH_ROWS):
+    """Yield lists of analytics rows with maintenance_id > desde_id, in id order."""
+    cursor = conn.execute(ANALYTICS_EXPORT_SQL, (desde_id,))
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+# --- Fleet overview ---
+
+# Every vehicle with its latest odometer reading and the maintenance that is overdue or
+# due soon, by date or by mileage. One set-based query over the materialized
+# Ultimo_Mileage and Proximo_Mantenimiento rows, instead of running the history query
+# once per vehicle.
+FLEET_DUE_SQL = f'''
+    SELECT v.id as vehiculo_id, v.alias, a.mileage as mileage_actual, a.fecha as fecha_lectura,
+           p.tipo_mantenimiento_id,
+           {_translation_sql('t.nombre', MAINTENANCE_TYPE_TRANSLATIONS)} as tipo_mantenimiento,
+           {_translation_sql('t.categoria', CATEGORY_TRANSLATIONS)} as categoria,
+           p.fecha_ultimo, p.mileage_ultimo, p.fecha_proximo, p.mileage_proximo,
+           {_estimated_due_sql('p.mileage_proximo', 'a', 'pm')} as fecha_estimada,
+           CASE WHEN p.fecha_proximo < :hoy THEN 'overdue'
+                WHEN p.fecha_proximo <= :hasta THEN 'upcoming'
+           END as estado_fecha,
+           CASE WHEN p.mileage_proximo <= a.mileage THEN 'overdue'
+                WHEN p.mileage_proximo <= a.mileage + :millas THEN 'upcoming'
+           END as estado_mileage
+    FROM Vehiculo v
+    LEFT JOIN Ultimo_Mileage a ON a.vehiculo_id = v.id
+    LEFT JOIN Proximo_Mantenimiento p ON p.vehiculo_id = v.id
+        AND (p.fecha_proximo <= :hasta OR p.mileage_proximo <= a.mileage + :millas)
+    LEFT JOIN Tipo_Mantenimiento t ON p.tipo_mantenimiento_id = t.id
+    LEFT JOIN Proyeccion_Mileage pm ON pm.vehiculo_id = v.id
+    ORDER BY v.alias, v.id, COALESCE(p.fecha_proximo, '9999-12-31'), p.mileage_proximo
+'''
+
+def get_fleet_due(conn, dias=FLEET_DUE_SOON_DAYS, millas=FLEET_DUE_SOON_MILES, hoy=None):
+    """Per-vehicle list of overdue and upcoming maintenance, with counts by date and mileage.
+
+    Runs FLEET_DUE_SQL, which reads each vehicle's latest reading from Ultimo_Mileage and
+    its next due date and mileage per maintenance type from Proximo_Mantenimiento, both
+    kept up to date by triggers, so Mileage and Mantenimiento are not scanned. An item
+    due by both criteria is counted under each, and listed once.
+    """
+    hoy = hoy or get_cr_time().date()
+    vehiculos = []
+    for row in conn.execute(FLEET_DUE_SQL, {
+        'hoy': hoy.isoformat(),
+        'hasta': date.fromordinal(hoy.toordinal() + dias).isoformat(),
+        'millas': millas,
+    }):
+        if not vehiculos or vehiculos[-1]['id'] != row['vehiculo_id']:
+            vehiculos.append({
+                'id': row['vehiculo_id'],
+                'alias': row['alias'],
+                'mileage': row['mileage_actual'],
+                'fecha_lectura': row['fecha_lectura'],
+                'overdue': [],
+                'upcoming': [],
+                'conteos': {'overdue_fecha': 0, 'overdue_mileage': 0,
+                            'upcoming_fecha': 0, 'upcoming_mileage': 0},
+            })
+        if row['tipo_mantenimiento_id'] is None:
+            continue
+        vehiculo = vehiculos[-1]
+        for estado, criterio in ((row['estado_fecha'], 'fecha'), (row['estado_mileage'], 'mileage')):
+            if estado:
+                vehiculo['conteos'][f'{estado}_{criterio}'] += 1
+        item = {campo: row[campo] for campo in (
+            'tipo_mantenimiento_id', 'tipo_mantenimiento', 'categoria', 'fecha_ultimo', 'mileage_ultimo',
+            'fecha_proximo', 'mileage_proximo', 'fecha_estimada', 'estado_fecha', 'estado_mileage')}
+        # Listed once, as overdue if either its date or its mileage is past due
+        estado = 'overdue' if 'overdue' in (row['estado_fecha'], row['estado_mileage']) else 'upcoming'
+        vehiculo[estado].append(item)
+    return vehiculos
+
+@app.route('/fleet/due')
+@login_required
+def estado_flota():
+    """Fleet overview for the dashboard: every vehicle's latest mileage and the maintenance
+    overdue or due within `days` days or `miles` miles (defaults FLEET_DUE_SOON_DAYS and
+    FLEET_DUE_SOON_MILES)."""
+    try:
+        dias = int(request.args.get('days', FLEET_DUE_SOON_DAYS))
+        millas = int(request.args.get('miles', FLEET_DUE_SOON_MILES))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'days and miles must be integers'}), 400
+    if dias < 0 or millas < 0:
+        return jsonify({'success': False, 'error': 'days and miles must not be negative'}), 400
+    vehiculos = get_fleet_due(get_db(), dias, millas)
+    return jsonify({
+        'success': True,
+        'today': get_cr_time().strftime('%Y-%m-%d'),
+        'days': dias,
+        'miles': millas,
+        'vehiculos': vehiculos,
+    })
+
+# --- Odometer projections ---
+# Mileage-based intervals give the due odometer but not when the vehicle will reach it.
+# Each vehicle's daily mileage rate is fitted from its recent readings and stored in
+# Proyeccion_Mileage; the estimated due date of a mileage-based item is then the latest
+# reading's date plus the miles still to go divided by that rate.
+
+# Only readings from this many days before a vehicle's latest one are fitted, so the
+# rate follows its current use
+PROJECTION_WINDOW_DAYS = 365
+# Minimum daily readings and days covered for a vehicle's rate to be fitted
+PROJECTION_MIN_READINGS = 3
+PROJECTION_MIN_DAYS = 14
+# Huber tuning constant and reweighting passes of the robust fit
+PROJECTION_HUBER_K = 1.345
+PROJECTION_IRLS_ITERATIONS = 5
+
+def _group_medians(valores, inicios, conteos):
+    """Median of each contiguous group of valores (groups given by start index and size)."""
+    grupos = np.repeat(np.arange(len(inicios)), conteos)
+    # Shifting each group into its own unit interval sorts all groups with one float sort
+    minimo = valores.min() if len(valores) else 0.0
+    rango = (valores.max() - minimo if len(valores) else 0.0) + 1.0
+    ordenados = (np.sort((valores - minimo) / rango + grupos) - grupos) * rango + minimo
+    return (ordenados[inicios + (conteos - 1) // 2] + ordenados[inicios + conteos // 2]) / 2
+
+def fit_mileage_rates(dias, millas, conteos):
+    """Robust daily mileage rate of many vehicles in one vectorized pass.
+
+    dias and millas hold every vehicle's readings back to back (conteos readings each,
+    sorted by distinct day within a vehicle). Each vehicle gets a straight line
+    millas = a + b*dia, started from the median slope between consecutive readings and
+    refined by iteratively reweighted least squares with Huber weights (residual scale
+    from the vehicle's median absolute residual), so typos and odometer swaps barely move
+    the rate. Sums are per-vehicle np.bincount reductions and medians one lexsort; there
+    is no Python loop over vehicles.
+
+    Returns the rates (miles per day, never negative) and the days each vehicle's readings
+    span; the rate is NaN where there are too few readings or days to fit one.
+    """
+    conteos = np.asarray(conteos, dtype=np.int64)
+    n = len(conteos)
+    inicios = np.concatenate(([0], np.cumsum(conteos)[:-1])).astype(np.int64)
+    grupos = np.repeat(np.arange(n), conteos)
+    dias = np.asarray(dias, dtype=np.float64)
+    millas = np.asarray(millas, dtype=np.float64)
+
+    con_datos = conteos > 0
+    primeros = np.zeros(n)
+    ultimos = np.zeros(n)
+    primeros[con_datos] = dias[inicios[con_datos]]
+    ultimos[con_datos] = dias[inicios[con_datos] + conteos[con_datos] - 1]
+    spans = ultimos - primeros
+    # Centering each vehicle's days keeps the normal equations well conditioned
+    t = dias - primeros[grupos]
+
+    # Robust starting line: the median slope between consecutive readings, through the
+    # median of the residual intercepts. Reweighting then only has to refine it.
+    mismo = grupos[1:] == grupos[:-1]
+    pares = grupos[:-1][mismo]
+    conteo_pares = np.bincount(pares, minlength=n)
+    pendiente = np.full(n, np.nan)
+    ordenada = np.zeros(n)
+    con_pares = conteo_pares > 0
+    if con_pares.any():
+        # Pairs straddling two vehicles (possibly zero days apart) are masked out
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pendientes = (np.diff(millas) / np.diff(t))[mismo]
+        inicios_pares = np.concatenate(([0], np.cumsum(conteo_pares)[:-1]))
+        pendiente[con_pares] = _group_medians(pendientes, inicios_pares[con_pares], conteo_pares[con_pares])
+        ordenada[con_datos] = _group_medians(millas - np.nan_to_num(pendiente)[grupos] * t,
+                                             inicios[con_datos], conteos[con_datos])
+
+    for _ in range(PROJECTION_IRLS_ITERATIONS):
+        residuos = np.nan_to_num(np.abs(millas - (ordenada[grupos] + pendiente[grupos] * t)))
+        escala = 1.4826 * _group_medians(residuos, inicios[con_datos], conteos[con_datos])
+        limite = np.ones(n)
+        # A floor of one mile keeps perfectly linear histories from getting zero scale
+        limite[con_datos] = PROJECTION_HUBER_K * np.maximum(escala, 1.0)
+        limite = limite[grupos]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pesos = np.where(residuos <= limite, 1.0, limite / residuos)
+        sw = np.bincount(grupos, pesos, n)
+        st = np.bincount(grupos, pesos * t, n)
+        sy = np.bincount(grupos, pesos * millas, n)
+        stt = np.bincount(grupos, pesos * t * t, n)
+        sty = np.bincount(grupos, pesos * t * millas, n)
+        det = sw * stt - st * st
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pendiente = np.where(det > 0, (sw * sty - st * sy) / det, np.nan)
+            ordenada = (sy - pendiente * st) / sw
+
+    tasas = np.maximum(pendiente, 0.0)
+    tasas[(conteos < PROJECTION_MIN_READINGS) | (spans < PROJECTION_MIN_DAYS)] = np.nan
+    return tasas, spans
+
+def fit_pending_projections(conn, vehiculo_ids=None):
+    """Fit the rates of the vehicles whose history changed since their last fit and
+    return their Proyeccion_Mileage rows, for store_odometer_projections().
+
+    A fit records the vehicle's 'historial:<id>' Cache_Version, which the Mileage and
+    Mantenimiento triggers bump, so only vehicles with new, edited or deleted readings
+    are refitted; vehiculo_ids narrows the check further. Readings older than
+    PROJECTION_WINDOW_DAYS before the latest one are ignored, and several readings on
+    one day count as that day's highest odometer. Only reads, so it can run outside
+    a write transaction: a row fitted from a history that changes before it is stored
+    keeps the older version and is refitted next time.
+    """
+    filtro = ''
+    params = {'ventana': f'-{PROJECTION_WINDOW_DAYS} days'}
+    if vehiculo_ids is not None:
+        filtro = 'AND v.id IN (SELECT value FROM json_each(:ids))'
+        params['ids'] = json.dumps([int(v) for v in vehiculo_ids])
+    rows = conn.execute(f'''
+        WITH pendientes AS (
+            SELECT v.id as vehiculo_id, cv.version
+            FROM Vehiculo v
+            LEFT JOIN Cache_Version cv ON cv.etiqueta = 'historial:' || v.id
+            LEFT JOIN Proyeccion_Mileage p ON p.vehiculo_id = v.id
+            WHERE (p.vehiculo_id IS NULL OR p.version IS NOT cv.version) {filtro}
+        )
+        SELECT p.vehiculo_id, p.version, julianday(date(m.fecha)) as dia, MAX(m.mileage) as mileage
+        FROM pendientes p
+        LEFT JOIN Ultimo_Mileage u ON u.vehiculo_id = p.vehiculo_id
+        LEFT JOIN Mileage m ON m.vehiculo_id = p.vehiculo_id AND m.fecha >= date(u.fecha, :ventana)
+                           AND m.mileage IS NOT NULL
+        GROUP BY p.vehiculo_id, date(m.fecha)
+        ORDER BY p.vehiculo_id, dia
+    ''', params).fetchall()
+    if not rows:
+        return []
+
+    vehiculos, versiones, conteos, dias, millas = [], [], [], [], []
+    for row in rows:
+        if not vehiculos or vehiculos[-1] != row['vehiculo_id']:
+            vehiculos.append(row['vehiculo_id'])
+            versiones.append(row['version'])
+            conteos.append(0)
+        if row['dia'] is not None:
+            conteos[-1] += 1
+            dias.append(row['dia'])
+            millas.append(row['mileage'])
+    tasas, spans = fit_mileage_rates(dias, millas, conteos)
+
+    calculado_en = get_cr_time().isoformat()
+    return [
+        (vehiculo_id, None if math.isnan(tasa) else round(float(tasa), 4), conteo, int(span), version,
+         calculado_en)
+        for vehiculo_id, tasa, conteo, span, version in zip(vehiculos, tasas, conteos, spans, versiones)
+    ]
+
+def store_odometer_projections(conn, filas):
+    """Write the rows of fit_pending_projections() and return how many there were."""
+    conn.executemany('''
+        INSERT INTO Proyeccion_Mileage (vehiculo_id, millas_dia, lecturas, dias, version, calculado_en)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(vehiculo_id) DO UPDATE SET
+            millas_dia = excluded.millas_dia,
+            lecturas = excluded.lecturas,
+            dias = excluded.dias,
+            version = excluded.version,
+            calculado_en = excluded.calculado_en
+    ''', filas)
+    return len(filas)
+
+def refresh_odometer_projections(conn, vehiculo_ids=None):
+    """Refit and store the rates of the vehicles whose history changed since their last
+    fit (see fit_pending_projections). Call it inside a transaction() block. Returns the
+    number of vehicles refitted.
+    """
+    return store_odometer_projections(conn, fit_pending_projections(conn, vehiculo_ids))
+
+def refresh_projection_after_save(vehiculo_id):
+    """Refit a vehicle's rate once the save that changed its history has committed.
+
+    The fit reads and runs outside the save's write transaction; only storing its row
+    takes the write lock. A failure is logged and left to the next refresh, since the
+    save itself has succeeded.
+    """
+    try:
+        filas = fit_pending_projections(get_db(), [vehiculo_id])
+        if filas:
+            write_transaction(lambda conn: store_odometer_projections(conn, filas))
+    except Exception:
+        app.logger.exception('Could not refresh the odometer projection of vehicle %s', vehiculo_id)
+
+def insert_mecanico(conn, nombre, telefono):
+    """Insert a mechanic and return the new row, or None if the name and phone already exist."""
+    return conn.execute('''
+        INSERT INTO Mecánico (nombre_mecanico, telefono_mecanico)
+        VALUES (?, ?)
+        ON CONFLICT DO NOTHING
+        RETURNING id, nombre_mecanico, telefono_mecanico
+    ''', (nombre, telefono)).fetchone()
+
 @app.route('/add_mechanic', methods=['POST'])
 @login_required
 def agregar_mecanico():
     nombre = request.form.get('nombre')
     telefono = request.form.get('telefono')
 
-    conn = get_db_connection()
     try:
-        # Verificar si ya existe un mecánico con el mismo nombre y teléfono
-        mecanico_existente = conn.execute('''
-            SELECT id
-            FROM Mecánico
-            WHERE nombre_mecanico = ? AND telefono_mecanico = ?
-        ''', (nombre, telefono)).fetchone()
-
-        if mecanico_existente:
-            conn.close()
+        nuevo_mecanico = write_transaction(lambda conn: insert_mecanico(conn, nombre, telefono))
+
+        if nuevo_mecanico is None:
             return jsonify({
                 'success': False,
                 'error': 'A mechanic with this name and phone already exists'
             })
 
-        conn.execute('INSERT INTO Mecánico (nombre_mecanico, telefono_mecanico) VALUES (?, ?)',
-                    (nombre, telefono))
-        conn.commit()
-        nuevo_mecanico = conn.execute('SELECT * FROM Mecánico ORDER BY id DESC LIMIT 1').fetchone()
-        conn.close()
-
         return jsonify({
             'success': True,
             'message': 'Mechanic added successfully',
@@ -284,7 +2297,6 @@ def agregar_mecanico():
             }
         })
     except Exception as e:
-        conn.close()
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/add_maintenance_type', methods=['POST'])
@@ -297,110 +2309,31 @@ def agregar_tipo_mantenimiento():
         vehiculo_id = request.form.get('vehiculo_id')
         categoria = request.form.get('categoria')
 
-        conn = get_db_connection()
+        conn = get_db()
 
         # Obtener el detalle_id del vehículo
-        vehiculo = conn.execute('''
-            SELECT d.id as detalle_id
-            FROM Vehiculo v
-            JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-            WHERE v.id = ?
-        ''', (vehiculo_id,)).fetchone()
+        vehiculo = next((v for v in get_vehiculos(conn) if str(v['id']) == str(vehiculo_id)), None)
 
         if not vehiculo:
-            conn.close()
             return jsonify({'success': False, 'error': 'Vehicle not found'})
 
-        # Verificar si ya existe un tipo de mantenimiento igual
-        tipo_existente = conn.execute('''
-            SELECT id
-            FROM Tipo_Mantenimiento
-            WHERE vehiculo_detalle_id = ?
-            AND nombre = ?
-            AND categoria = ?
-            AND (
-                (miles_next_maintenance IS NULL AND ? IS NULL) OR
-                miles_next_maintenance = ?
-            )
-            AND (
-                (meses_proximo_mantenimiento IS NULL AND ? IS NULL) OR
-                meses_proximo_mantenimiento = ?
-            )
-        ''', (vehiculo['detalle_id'], nombre, categoria,
-              miles, miles, meses, meses)).fetchone()
-
-        if tipo_existente:
-            conn.close()
-            return jsonify({
-                'success': False,
-                'error': 'A maintenance type with these characteristics already exists for this vehicle'
-            })
-
-        # Fix for the ID issue - ensure we're using INTEGER PRIMARY KEY AUTOINCREMENT
-        # First, check if we need to fix the table structure
-        table_info = conn.execute("PRAGMA table_info(Tipo_Mantenimiento)").fetchall()
-        pk_column = next((col for col in table_info if col[5] == 1), None)
-
-        if not pk_column:
-            # Create a temporary table with proper structure
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS Tipo_Mantenimiento_temp (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    miles_next_maintenance INTEGER,
-                    meses_proximo_mantenimiento INTEGER,
-                    vehiculo_detalle_id INTEGER NOT NULL,
-                    categoria TEXT NOT NULL
-                )
-            ''')
-
-            # Copy data from old table to new table
-            conn.execute('''
-                INSERT INTO Tipo_Mantenimiento_temp (id, nombre, miles_next_maintenance,
-                                                   meses_proximo_mantenimiento, vehiculo_detalle_id, categoria)
-                SELECT id, nombre, miles_next_maintenance,
-                       meses_proximo_mantenimiento, vehiculo_detalle_id, categoria
-                FROM Tipo_Mantenimiento
-                WHERE id IS NOT NULL
-            ''')
-
-            # Insert rows with NULL id with new autoincremented ids
-            conn.execute('''
-                INSERT INTO Tipo_Mantenimiento_temp (nombre, miles_next_maintenance,
-                                                   meses_proximo_mantenimiento, vehiculo_detalle_id, categoria)
-                SELECT nombre, miles_next_maintenance,
-                       meses_proximo_mantenimiento, vehiculo_detalle_id, categoria
-                FROM Tipo_Mantenimiento
-                WHERE id IS NULL
-            ''')
-
-            # Drop old table and rename new one
-            conn.execute('DROP TABLE Tipo_Mantenimiento')
-            conn.execute('ALTER TABLE Tipo_Mantenimiento_temp RENAME TO Tipo_Mantenimiento')
-            conn.commit()
-
-        # Now insert the new maintenance type
-        conn.execute('''
+        nuevo_tipo = write_transaction(lambda conn: conn.execute('''
             INSERT INTO Tipo_Mantenimiento
             (nombre, miles_next_maintenance, meses_proximo_mantenimiento,
              vehiculo_detalle_id, categoria)
             VALUES (?, ?, ?, ?, ?)
-        ''', (nombre, miles, meses, vehiculo['detalle_id'], categoria))
-        conn.commit()
+            ON CONFLICT DO NOTHING
+            RETURNING *
+        ''', (nombre, miles, meses, vehiculo['detalle_id'], categoria)).fetchone())
 
-        nuevo_tipo = conn.execute('''
-            SELECT * FROM Tipo_Mantenimiento ORDER BY id DESC LIMIT 1
-        ''').fetchone()
+        if nuevo_tipo is None:
+            return jsonify({
+                'success': False,
+                'error': 'A maintenance type with these characteristics already exists for this vehicle'
+            })
 
         # Obtener los tipos de mantenimiento actualizados
-        tipos = conn.execute('''
-            SELECT id, nombre, categoria
-            FROM Tipo_Mantenimiento
-            WHERE vehiculo_detalle_id = ?
-            ORDER BY categoria, nombre
-        ''', (vehiculo['detalle_id'],)).fetchall()
-
-        conn.close()
+        tipos = get_tipos_vehiculo(conn, vehiculo['id'])
 
         return jsonify({
             'success': True,
@@ -412,48 +2345,28 @@ def agregar_tipo_mantenimiento():
                 'meses': nuevo_tipo['meses_proximo_mantenimiento'],
                 'categoria': nuevo_tipo['categoria']
             },
-            'tipos': [dict(tipo) for tipo in tipos]
+            'tipos': tipos
         })
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/get_maintenance_types/<int:vehiculo_id>')
 @login_required
 def get_tipos_mantenimiento(vehiculo_id):
-    conn = get_db_connection()
-    # Primero obtenemos el detalle_id del vehículo
-    vehiculo = conn.execute('''
-        SELECT d.id as detalle_id
-        FROM Vehiculo v
-        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-        WHERE v.id = ?
-    ''', (vehiculo_id,)).fetchone()
-
-    if vehiculo:
-        # Obtenemos los tipos de mantenimiento para ese detalle_id
-        tipos = conn.execute('''
-            SELECT id, nombre, categoria
-            FROM Tipo_Mantenimiento
-            WHERE vehiculo_detalle_id = ?
-            ORDER BY categoria, nombre
-        ''', (vehiculo['detalle_id'],)).fetchall()
-
-        conn.close()
+    conn = get_db()
+    if any(v['id'] == vehiculo_id for v in get_vehiculos(conn)):
         return jsonify({
             'success': True,
-            'tipos': [dict(tipo) for tipo in tipos],
+            'tipos': get_tipos_vehiculo(conn, vehiculo_id),
             'nuevo_tipo_id': request.args.get('nuevo_tipo_id')
         })
 
-    conn.close()
     return jsonify({'success': False})
 
 @app.route('/get_maintenance_type/<int:tipo_id>')
 @login_required
 def get_tipo_mantenimiento(tipo_id):
-    conn = get_db_connection()
+    conn = get_db()
     tipo = conn.execute('''
         SELECT id, nombre, categoria,
                miles_next_maintenance,
@@ -461,7 +2374,6 @@ def get_tipo_mantenimiento(tipo_id):
         FROM Tipo_Mantenimiento
         WHERE id = ?
     ''', (tipo_id,)).fetchone()
-    conn.close()
 
     if tipo:
         return jsonify({
@@ -470,6 +2382,53 @@ def get_tipo_mantenimiento(tipo_id):
         })
     return jsonify({'success': False})
 
+# --- Write path ---
+# Natural keys are enforced by unique indexes (migration 8); inserts use ON CONFLICT
+# DO NOTHING ... RETURNING, so a save needs no separate existence check and two
+# concurrent saves cannot both insert the same row.
+
+class DuplicateRecordError(Exception):
+    """Raised inside a transaction() block to roll back a save that would duplicate a row."""
+
+def upsert_mileage(conn, vehiculo_id, fecha, mileage):
+    """Id of the vehicle's odometer reading for fecha and mileage, inserting it if new."""
+    row = conn.execute('''
+        INSERT INTO Mileage (vehiculo_id, fecha, mileage)
+        VALUES (?, ?, ?)
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    ''', (vehiculo_id, fecha, mileage)).fetchone()
+    if row is None:
+        row = conn.execute('''
+            SELECT id FROM Mileage WHERE vehiculo_id = ? AND fecha = ? AND mileage = ?
+        ''', (vehiculo_id, fecha, mileage)).fetchone()
+    return row['id']
+
+# Inserts a maintenance record, taking fecha_proximo_mantenimiento from its type's interval in months
+INSERT_MANTENIMIENTO_SQL = '''
+    INSERT INTO Mantenimiento
+    (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, fecha_proximo_mantenimiento, precio)
+    SELECT :vehiculo_id, t.id, :mileage_id, :mecanico_id,
+           CASE WHEN t.meses_proximo_mantenimiento
+                THEN date(:fecha, '+' || t.meses_proximo_mantenimiento || ' months')
+           END,
+           :precio
+    FROM Tipo_Mantenimiento t
+    WHERE t.id = :tipo_mantenimiento_id
+    ON CONFLICT DO NOTHING
+'''
+
+def insert_mantenimiento(conn, vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, fecha, precio):
+    """Insert a maintenance record and return its id, or None if it already exists."""
+    row = conn.execute(INSERT_MANTENIMIENTO_SQL + ' RETURNING id', {
+        'vehiculo_id': vehiculo_id, 'tipo_mantenimiento_id': tipo_mantenimiento_id,
+        'mileage_id': mileage_id, 'mecanico_id': mecanico_id, 'fecha': fecha, 'precio': precio,
+    }).fetchone()
+    if row is None and conn.execute('SELECT 1 FROM Tipo_Mantenimiento WHERE id = ?',
+                                    (tipo_mantenimiento_id,)).fetchone() is None:
+        raise ValueError('Maintenance type not found')
+    return row['id'] if row else None
+
 @app.route('/save_maintenance', methods=['POST'])
 @login_required
 def guardar_mantenimiento():
@@ -506,74 +2465,98 @@ def guardar_mantenimiento():
                 'error': 'The price must be a valid number.'
              })
 
-        conn = get_db_connection()
+        def guardar(conn):
+            mileage_id = upsert_mileage(conn, vehiculo_id, fecha, mileage)
+            mantenimiento_id = insert_mantenimiento(conn, vehiculo_id, tipo_mantenimiento_id, mileage_id,
+                                                    mecanico_id, fecha, precio)
+            if mantenimiento_id is None:
+                # Roll back, so no orphan Mileage row is left behind
+                raise DuplicateRecordError('A maintenance record with these details already exists')
 
-        # Verificar si ya existe el mileage para esa combinación
-        mileage_existente = conn.execute('''
-            SELECT id
-            FROM Mileage
-            WHERE vehiculo_id = ? AND fecha = ? AND mileage = ?
-        ''', (vehiculo_id, fecha, mileage)).fetchone()
+        write_transaction(guardar)
+        refresh_projection_after_save(vehiculo_id)
 
-        if mileage_existente:
-            mileage_id = mileage_existente['id']
-        else:
-            # Si no existe, insertamos el nuevo mileage
-            conn.execute('''
-                INSERT INTO Mileage (vehiculo_id, fecha, mileage)
-                VALUES (?, ?, ?)
-            ''', (vehiculo_id, fecha, mileage))
-            conn.commit()
-            # Obtenemos el id del mileage recién insertado
-            mileage_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
-
-        # Calculamos la fecha del próximo mantenimiento
-        tipo_mant = conn.execute('''
-            SELECT miles_next_maintenance, meses_proximo_mantenimiento
-            FROM Tipo_Mantenimiento
-            WHERE id = ?
-        ''', (tipo_mantenimiento_id,)).fetchone()
-
-        # Verificar si ya existe un mantenimiento con esta combinación
-        mantenimiento_existente = conn.execute('''
-            SELECT id
-            FROM Mantenimiento
-            WHERE vehiculo_id = ? AND tipo_mantenimiento_id = ? AND mileage_id = ?
-        ''', (vehiculo_id, tipo_mantenimiento_id, mileage_id)).fetchone()
-
-        if mantenimiento_existente:
-            return jsonify({
-                'success': False,
-                'error': 'A maintenance record with these details already exists'
-            })
+        return jsonify({
+            'success': True,
+            'message': 'Maintenance recorded successfully'
+        })
 
-        # Calcular fecha_proximo_mantenimiento si hay meses especificados
-        if tipo_mant['meses_proximo_mantenimiento']:
-            conn.execute('''
-                INSERT INTO Mantenimiento
-                (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id,
-                 fecha_proximo_mantenimiento, precio)
-                VALUES (?, ?, ?, ?, date(?, '+' || ? || ' months'), ?)
-            ''', (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id,
-                  fecha, tipo_mant['meses_proximo_mantenimiento'], precio))
-        else:
-            conn.execute('''
-                INSERT INTO Mantenimiento
-                (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, precio)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, precio))
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
 
-        conn.commit()
+@app.route('/save_service_visit', methods=['POST'])
+@login_required
+def guardar_visita_servicio():
+    """Save several maintenance items done in one shop visit, in one transaction.
+
+    Expects JSON with vehiculo_id, fecha (YYYY-MM-DD), mileage, mecanico_id and items,
+    a list of {tipo_mantenimiento_id, precio}. Either every item is saved or none is.
+    """
+    try:
+        data = request.get_json()
+        vehiculo_id = data['vehiculo_id']
+        fecha = datetime.strptime(data['fecha'], '%Y-%m-%d').strftime('%Y-%m-%d')
+        mileage = data['mileage']
+        mecanico_id = data['mecanico_id']
+        items = data.get('items') or []
+        if not items:
+            return jsonify({'success': False, 'error': 'At least one maintenance item is required.'})
+
+        tipo_ids = [int(item['tipo_mantenimiento_id']) for item in items]
+        if len(set(tipo_ids)) != len(tipo_ids):
+            return jsonify({'success': False, 'error': 'Each maintenance type can only appear once per visit.'})
+        precios = []
+        for item in items:
+            try:
+                precio = float(item.get('precio'))
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'The price must be a valid number.'})
+            if precio <= 0:
+                return jsonify({'success': False, 'error': 'The price must be a positive number.'})
+            precios.append(precio)
+
+        conn = get_db()
+        placeholders = ', '.join('?' for _ in tipo_ids)
+        tipos = {row['id']: row['nombre'] for row in conn.execute(
+            f'SELECT id, nombre FROM Tipo_Mantenimiento WHERE id IN ({placeholders})', tipo_ids)}
+        faltantes = [tipo_id for tipo_id in tipo_ids if tipo_id not in tipos]
+        if faltantes:
+            return jsonify({'success': False, 'error': f'Maintenance type not found: {faltantes[0]}'})
+
+        def guardar(conn):
+            mileage_id = upsert_mileage(conn, vehiculo_id, fecha, mileage)
+            existentes = [tipos[row[0]] for row in conn.execute(f'''
+                SELECT tipo_mantenimiento_id FROM Mantenimiento
+                WHERE vehiculo_id = ? AND mileage_id = ? AND tipo_mantenimiento_id IN ({placeholders})
+            ''', [vehiculo_id, mileage_id] + tipo_ids)]
+            if existentes:
+                raise DuplicateRecordError(
+                    'Maintenance records with these details already exist: ' + ', '.join(existentes))
+
+            cursor = conn.executemany(INSERT_MANTENIMIENTO_SQL, [
+                {'vehiculo_id': vehiculo_id, 'tipo_mantenimiento_id': tipo_id, 'mileage_id': mileage_id,
+                 'mecanico_id': mecanico_id, 'fecha': fecha, 'precio': precio}
+                for tipo_id, precio in zip(tipo_ids, precios)
+            ])
+            # A concurrent save of the same items makes ON CONFLICT skip rows
+            if cursor.rowcount != len(tipo_ids):
+                raise DuplicateRecordError('A maintenance record with these details already exists')
+            return mileage_id
+
+        mileage_id = write_transaction(guardar)
+        refresh_projection_after_save(vehiculo_id)
 
-        conn.close()
         return jsonify({
             'success': True,
-            'message': 'Maintenance recorded successfully'
+            'message': f'{len(tipo_ids)} maintenance items recorded successfully',
+            'mileage_id': mileage_id,
+            'guardados': len(tipo_ids),
         })
 
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
         return jsonify({
             'success': False,
             'error': str(e)
@@ -592,67 +2575,808 @@ def agregar_vehiculo():
         tipo_motor = request.form['tipo_motor']
         tipo_transmision = request.form['tipo_transmision']
 
-        conn = get_db_connection()
+        def guardar(conn):
+            # Primero insertar en Detalle_Vehiculo
+            detalle_id = conn.execute('''
+                INSERT INTO Detalle_Vehiculo
+                (marca, modelo, anio, tipo, tipo_motor, tipo_transmision)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (marca, modelo, anio, tipo, tipo_motor, tipo_transmision)).lastrowid
 
-        # Primero insertar en Detalle_Vehiculo
-        conn.execute('''
-            INSERT INTO Detalle_Vehiculo
-            (marca, modelo, anio, tipo, tipo_motor, tipo_transmision)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (marca, modelo, anio, tipo, tipo_motor, tipo_transmision))
-
-        # Obtener el ID del detalle insertado
-        detalle_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            # Insertar en Vehiculo
+            conn.execute('''
+                INSERT INTO Vehiculo (alias, detalle_id)
+                VALUES (?, ?)
+            ''', (alias, detalle_id))
 
-        # Insertar en Vehiculo
-        conn.execute('''
-            INSERT INTO Vehiculo (alias, detalle_id)
-            VALUES (?, ?)
-        ''', (alias, detalle_id))
+        write_transaction(guardar)
 
-        conn.commit()
         flash('Vehicle added successfully', 'success')
     except Exception as e:
         flash(f'Error adding vehicle: {str(e)}', 'danger')
-    finally:
-        conn.close()
-        return redirect(url_for('index'))
+    return redirect(url_for('index'))
 
-@app.route('/suggest_maintenance', methods=['POST'])
+# --- Bulk import ---
+
+IMPORT_CHUNK_SIZE = 5000
+
+# Column names accepted besides the canonical ones (import columns are matched case-insensitively)
+IMPORT_COLUMN_ALIASES = {
+    'alias': 'vehiculo',
+    'vehicle': 'vehiculo',
+    'make': 'marca',
+    'model': 'modelo',
+    'year': 'anio',
+    'vehicle_type': 'tipo',
+    'engine_type': 'tipo_motor',
+    'transmission_type': 'tipo_transmision',
+    'date': 'fecha',
+    'maintenance_type': 'tipo_mantenimiento',
+    'category': 'categoria',
+    'next_miles': 'miles_next_maintenance',
+    'next_months': 'meses_proximo_mantenimiento',
+    'mechanic': 'mecanico',
+    'mechanic_phone': 'telefono_mecanico',
+    'price': 'precio',
+}
+
+# Mileage rows are inserted first; maintenance rows then find theirs through the unique
+# (vehiculo_id, fecha, mileage) index
+IMPORT_MILEAGE_SQL = '''
+    INSERT INTO Mileage (vehiculo_id, fecha, mileage)
+    VALUES (:vehiculo_id, :fecha, :mileage)
+    ON CONFLICT DO NOTHING
+'''
+IMPORT_MANTENIMIENTO_SQL = '''
+    INSERT INTO Mantenimiento
+    (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, fecha_proximo_mantenimiento, precio)
+    SELECT :vehiculo_id, t.id, mil.id, :mecanico_id,
+           CASE WHEN t.meses_proximo_mantenimiento
+                THEN date(:fecha, '+' || t.meses_proximo_mantenimiento || ' months')
+           END,
+           :precio
+    FROM Tipo_Mantenimiento t
+    JOIN Mileage mil ON mil.vehiculo_id = :vehiculo_id AND mil.fecha = :fecha AND mil.mileage = :mileage
+    WHERE t.id = :tipo_mantenimiento_id
+    ON CONFLICT DO NOTHING
+'''
+
+class ImportRowError(ValueError):
+    """A row of an import file that cannot be imported."""
+
+def iter_csv_records(stream):
+    """Rows of a CSV text stream as dictionaries, read one line at a time."""
+    yield from csv.DictReader(stream)
+
+def iter_json_records(stream, chunk_size=65536):
+    """Objects of a JSON array or of JSON Lines text, decoded incrementally.
+
+    Only the object being decoded is held in memory, so arbitrarily large files can be read.
+    Malformed JSON raises ValueError with its line and character position once the
+    error is read, without reading the rest of the file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    # Characters and lines of the stream before the buffer, for error positions
+    leidos, lineas = 0, 0
+    while True:
+        # Skip the separators between objects: whitespace, the array brackets and commas
+        resto = buffer.lstrip(' \t\r\n[,]')
+        leidos += len(buffer) - len(resto)
+        lineas += buffer.count('\n', 0, len(buffer) - len(resto))
+        buffer = resto
+        if not buffer:
+            if eof:
+                return
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            # An object cut off by the end of the buffer fails in its last token (a literal,
+            # number or escape is at most 6 characters) or in a string that runs to the end;
+            # any other error is in the file itself, so do not read on looking for the end
+            if eof or (len(buffer) - e.pos > 6 and not e.msg.startswith('Unterminated string')):
+                raise ValueError(f'Invalid JSON at line {lineas + e.lineno} '
+                                 f'(character {leidos + e.pos + 1}): {e.msg}') from None
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if not isinstance(record, dict):
+            raise ValueError('JSON import files must contain objects')
+        yield record
+        leidos += end
+        lineas += buffer.count('\n', 0, end)
+        buffer = buffer[end:]
+
+class MaintenanceImporter:
+    """Import maintenance history rows, creating the vehicles, mechanics and maintenance
+    types they reference.
+
+    Rows are dictionaries with the columns vehiculo (alias), fecha (YYYY-MM-DD or
+    DD/MM/YYYY), mileage, tipo_mantenimiento, mecanico and precio, plus marca, modelo
+    and anio for vehicles that do not exist yet, categoria for new maintenance types
+    and optionally tipo, tipo_motor, tipo_transmision, miles_next_maintenance,
+    meses_proximo_mantenimiento and telefono_mecanico. English names (as exported) of
+    categories and maintenance types are stored as their Spanish originals.
+
+    References are resolved through in-memory maps loaded once, and rows are written
+    ``chunk_size`` at a time with executemany, one write_transaction() per chunk, so
+    memory stays bounded by the chunk and the reference data. Rows already recorded are counted
+    as duplicates. With dry_run nothing is written: rows are validated and the references
+    that would be created are counted.
+
+    import_chunks() yields the running counters after every chunk; run() returns the summary.
+    """
+
+    # Row errors kept for the report (all are counted)
+    MAX_ERRORS = 100
+
+    def __init__(self, conn, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.stats = {
+            'rows': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0,
+            'vehicles_created': 0, 'mechanics_created': 0, 'types_created': 0,
+        }
+        self.errors = []
+        self._categorias = {_normalize_text(en): es for es, en in CATEGORY_TRANSLATIONS.items()}
+        self._tipos_nombre = {_normalize_text(en): es for es, en in MAINTENANCE_TYPE_TRANSLATIONS.items()}
+        self._mecanicos_nombre = {_normalize_text(en): es for es, en in MECHANIC_TRANSLATIONS.items()}
+        self._load_references()
+        # Placeholder ids (negative) of the references a dry run would create
+        self._ficticios = 0
+
+    def _load_references(self):
+        self._vehiculos = {}
+        for row in self.conn.execute('SELECT id, alias, detalle_id FROM Vehiculo ORDER BY id'):
+            self._vehiculos.setdefault(_normalize_text(row['alias']), (row['id'], row['detalle_id']))
+        self._mecanicos = {}
+        for row in self.conn.execute('SELECT id, nombre_mecanico, telefono_mecanico FROM Mecánico ORDER BY id'):
+            self._mecanicos.setdefault(
+                (_normalize_text(row['nombre_mecanico']), _normalize_text(row['telefono_mecanico'])), row['id'])
+        self._tipos = {}
+        for row in self.conn.execute('SELECT id, vehiculo_detalle_id, nombre FROM Tipo_Mantenimiento ORDER BY id'):
+            self._tipos.setdefault((row['vehiculo_detalle_id'], _normalize_text(row['nombre'])), row['id'])
+
+    def _insertar(self, conn, sql, params):
+        if self.dry_run:
+            self._ficticios += 1
+            return -self._ficticios
+        return conn.execute(sql, params).lastrowid
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _columna(nombre):
+        columna = _normalize_text(nombre).replace(' ', '_')
+        return IMPORT_COLUMN_ALIASES.get(columna, columna)
+
+    def normalize_record(self, record):
+        return {self._columna(columna): valor.strip() if isinstance(valor, str) else valor
+                for columna, valor in record.items() if columna is not None}
+
+    @staticmethod
+    def _requerido(fila, columna):
+        valor = fila.get(columna)
+        if valor is None or valor == '':
+            raise ImportRowError(f'Missing {columna}')
+        return valor
+
+    @staticmethod
+    def _entero(valor, columna):
+        if valor is None or valor == '':
+            return None
+        try:
+            return int(float(valor))
+        except (TypeError, ValueError):
+            raise ImportRowError(f'Invalid {columna}: {valor}')
+
+    @staticmethod
+    def _fecha(valor):
+        valor = str(valor)
+        try:
+            if '/' in valor:
+                return datetime.strptime(valor, '%d/%m/%Y').strftime('%Y-%m-%d')
+            return date.fromisoformat(valor).isoformat()
+        except ValueError:
+            raise ImportRowError(f'Invalid fecha: {valor}')
+
+    def _validar_referencias(self, fila):
+        """Check the columns of the vehicle, maintenance type and mechanic a row refers to,
+        so an invalid row is rejected before any of them is created."""
+        existente = self._vehiculos.get(_normalize_text(str(self._requerido(fila, 'vehiculo'))))
+        if not existente:
+            self._requerido(fila, 'marca')
+            self._requerido(fila, 'modelo')
+            self._entero(self._requerido(fila, 'anio'), 'anio')
+        nombre = str(self._requerido(fila, 'tipo_mantenimiento'))
+        nombre = self._tipos_nombre.get(_normalize_text(nombre), nombre)
+        if not existente or (existente[1], _normalize_text(nombre)) not in self._tipos:
+            self._requerido(fila, 'categoria')
+            self._entero(fila.get('miles_next_maintenance'), 'miles_next_maintenance')
+            self._entero(fila.get('meses_proximo_mantenimiento'), 'meses_proximo_mantenimiento')
+        self._requerido(fila, 'mecanico')
+
+    def _vehiculo(self, conn, fila):
+        alias = str(self._requerido(fila, 'vehiculo'))
+        existente = self._vehiculos.get(_normalize_text(alias))
+        if existente:
+            return existente
+        detalle = (self._requerido(fila, 'marca'), self._requerido(fila, 'modelo'),
+                   self._entero(self._requerido(fila, 'anio'), 'anio'),
+                   fila.get('tipo'), fila.get('tipo_motor'), fila.get('tipo_transmision'))
+        detalle_id = self._insertar(conn, '''
+            INSERT INTO Detalle_Vehiculo (marca, modelo, anio, tipo, tipo_motor, tipo_transmision)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', detalle)
+        vehiculo_id = self._insertar(conn, 'INSERT INTO Vehiculo (alias, detalle_id) VALUES (?, ?)', (alias, detalle_id))
+        self.stats['vehicles_created'] += 1
+        self._vehiculos[_normalize_text(alias)] = (vehiculo_id, detalle_id)
+        return vehiculo_id, detalle_id
+
+    def _mecanico(self, conn, fila):
+        nombre = str(self._requerido(fila, 'mecanico'))
+        nombre = self._mecanicos_nombre.get(_normalize_text(nombre), nombre)
+        telefono = fila.get('telefono_mecanico') or ''
+        clave = (_normalize_text(nombre), _normalize_text(telefono))
+        if clave not in self._mecanicos:
+            self._mecanicos[clave] = self._insertar(
+                conn, 'INSERT INTO Mecánico (nombre_mecanico, telefono_mecanico) VALUES (?, ?)', (nombre, str(telefono)))
+            self.stats['mechanics_created'] += 1
+        return self._mecanicos[clave]
+
+    def _tipo(self, conn, fila, detalle_id):
+        nombre = str(self._requerido(fila, 'tipo_mantenimiento'))
+        nombre = self._tipos_nombre.get(_normalize_text(nombre), nombre)
+        clave = (detalle_id, _normalize_text(nombre))
+        if clave not in self._tipos:
+            categoria = str(self._requerido(fila, 'categoria'))
+            categoria = self._categorias.get(_normalize_text(categoria), categoria)
+            self.stats['types_created'] += 1
+            self._tipos[clave] = self._insertar(conn, '''
+                INSERT INTO Tipo_Mantenimiento
+                (nombre, categoria, miles_next_maintenance, meses_proximo_mantenimiento, vehiculo_detalle_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (nombre, categoria,
+                  self._entero(fila.get('miles_next_maintenance'), 'miles_next_maintenance'),
+                  self._entero(fila.get('meses_proximo_mantenimiento'), 'meses_proximo_mantenimiento'),
+                  detalle_id))
+        return self._tipos[clave]
+
+    def _preparar(self, conn, fila):
+        fecha = self._fecha(self._requerido(fila, 'fecha'))
+        mileage = self._entero(self._requerido(fila, 'mileage'), 'mileage')
+        if mileage < 0:
+            raise ImportRowError(f'Invalid mileage: {mileage}')
+        try:
+            precio = float(self._requerido(fila, 'precio'))
+        except (TypeError, ValueError):
+            raise ImportRowError(f"Invalid precio: {fila.get('precio')}")
+        if precio <= 0:
+            raise ImportRowError(f'Invalid precio: {precio}')
+        self._validar_referencias(fila)
+        vehiculo_id, detalle_id = self._vehiculo(conn, fila)
+        return {
+            'vehiculo_id': vehiculo_id,
+            'fecha': fecha,
+            'mileage': mileage,
+            'tipo_mantenimiento_id': self._tipo(conn, fila, detalle_id),
+            'mecanico_id': self._mecanico(conn, fila),
+            'precio': precio,
+        }
+
+    def _escribir_lote(self, lote, conn):
+        """Resolve and write one chunk of (row number, record) pairs on ``conn``."""
+        filas = []
+        for numero, registro in lote:
+            try:
+                filas.append(self._preparar(conn, self.normalize_record(registro)))
+            except ImportRowError as e:
+                self.stats['invalid'] += 1
+                if len(self.errors) < self.MAX_ERRORS:
+                    self.errors.append({'row': numero, 'error': str(e)})
+        if self.dry_run or not filas:
+            return
+        conn.executemany(IMPORT_MILEAGE_SQL, filas)
+        insertadas = conn.executemany(IMPORT_MANTENIMIENTO_SQL, filas).rowcount
+        self.stats['imported'] += insertadas
+        self.stats['duplicates'] += len(filas) - insertadas
+
+    def _importar_lote(self, lote):
+        """Write one chunk as one write_transaction(), so with DB_WRITE_QUEUE=1 it is
+        group-committed by db_writer instead of taking the write lock from it."""
+        self.stats['rows'] += len(lote)
+        if self.dry_run:
+            self._escribir_lote(lote, self.conn)
+        else:
+            write_transaction(functools.partial(self._escribir_lote, lote), self.conn)
+
+    def import_chunks(self, records):
+        """Import an iterable of records, yielding the running counters after each chunk."""
+        lote = []
+        for numero, registro in enumerate(records, start=1):
+            lote.append((numero, registro))
+            if len(lote) >= self.chunk_size:
+                self._importar_lote(lote)
+                lote = []
+                yield dict(self.stats)
+        if lote:
+            self._importar_lote(lote)
+            yield dict(self.stats)
+        if not self.dry_run:
+            # One vectorized refit of every vehicle the import added readings to, fitted
+            # before taking the write lock
+            filas = fit_pending_projections(self.conn)
+            write_transaction(lambda conn: store_odometer_projections(conn, filas), self.conn)
+
+    def run(self, records):
+        """Import an iterable of records and return the summary."""
+        for _ in self.import_chunks(records):
+            pass
+        return self.summary()
+
+    def summary(self):
+        return dict(self.stats, dry_run=self.dry_run, errors=self.errors)
+
+def open_import_records(stream, nombre):
+    """Records of a CSV or JSON text stream, chosen by the file name's extension."""
+    extension = Path(nombre).suffix.lower()
+    if extension == '.csv':
+        return iter_csv_records(stream)
+    if extension in ('.json', '.jsonl', '.ndjson'):
+        return iter_json_records(stream)
+    raise ValueError(f'Unsupported import file type: {extension or nombre} (use .csv or .json)')
+
+@app.route('/import_history', methods=['POST'])
 @login_required
-def sugerir_mantenimiento():
+def importar_historial():
+    """Import an uploaded CSV or JSON maintenance history file.
+
+    The upload is spooled to a temporary file and imported while the response streams
+    one JSON line of progress counters per chunk, ending with the summary. Pass
+    dry_run=1 to only validate the file.
+    """
+    archivo = request.files.get('archivo')
+    if archivo is None or not archivo.filename:
+        return jsonify({'success': False, 'error': 'No file uploaded'}), 400
+    dry_run = request.form.get('dry_run', '0') in ('1', 'true', 'on')
+
+    temporal = tempfile.NamedTemporaryFile(suffix=Path(archivo.filename).suffix, delete=False)
     try:
-        # Check if Gemini API is configured
-        if not GEMINI_API_KEY:
-            return jsonify({
-                'success': False,
-                'error': 'AI suggestions are disabled. Gemini API key not configured.'
-            })
+        archivo.save(temporal)
+    finally:
+        temporal.close()
 
-        data = request.get_json()
-        tipo_mantenimiento = data['tipo_mantenimiento']
-        campo = data['campo']
-        vehiculo_id = data['vehiculo_id']
+    def progreso():
+        try:
+            with db_pool.connection() as conn, \
+                    open(temporal.name, encoding='utf-8-sig', newline='') as stream:
+                importer = MaintenanceImporter(conn, dry_run=dry_run)
+                for avance in importer.import_chunks(open_import_records(stream, archivo.filename)):
+                    yield json.dumps({'progress': avance}) + '\n'
+                yield json.dumps(dict(importer.summary(), success=True)) + '\n'
+        except Exception as e:
+            yield json.dumps({'success': False, 'error': str(e)}) + '\n'
+        finally:
+            os.unlink(temporal.name)
+
+    return Response(progreso(), mimetype='application/x-ndjson')
+
+# --- Odometer ingestion ---
+
+class OdometerIngestor:
+    """Group-committed writes of odometer readings sent by telematics units.
+
+    Request threads validate their batch and ingest() it as one WriteQueue operation, so
+    the readings of concurrent requests share a single commit. Each reading must fit
+    between the vehicle's stored readings: not lower than the highest one on the closest
+    earlier date, not higher than the lowest one on the closest later date (readings are
+    stored per day, so readings on the same date are not compared). One that does not
+    is an odometer rollback: rejected, or with on_rollback='flag' stored in
+    Mileage_Marcado instead of Mileage and reported as flagged. Readings already stored
+    as (vehiculo_id, fecha, mileage) in either table count as duplicates.
+    """
+
+    def __init__(self, writer, projection_interval):
+        self.writer = writer
+        self.projection_interval = projection_interval
+        self._proxima_proyeccion = time.monotonic() + projection_interval
+        self._lock = threading.Lock()
+        self.counts = {'received': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'flagged': 0}
+
+    def ingest(self, lecturas, on_rollback='reject', timeout=30):
+        """Write validated (vehiculo_id, fecha, mileage) readings and return their counts.
+        Raises queue.Full when the writer is too far behind, and FutureTimeoutError
+        (concurrent.futures.TimeoutError) when it did not get to them within ``timeout``
+        seconds (nothing is written then)."""
+        futuro = self.writer.submit(functools.partial(self._escribir, lecturas, on_rollback),
+                                    peso=len(lecturas), block=False)
+        resultado = self.writer.wait(futuro, timeout)
+        with self._lock:
+            self.counts['received'] += resultado['received']
+            self.counts['inserted'] += resultado['inserted']
+            self.counts['duplicates'] += resultado['duplicates']
+            self.counts['rejected'] += len(resultado['rejected'])
+            self.counts['flagged'] += len(resultado['flagged'])
+        return resultado
+
+    def _escribir(self, lecturas, on_rollback, conn):
+        insertadas, duplicadas, rollbacks = 0, 0, []
+        # In time order, so each reading is checked against the ones accepted before it
+        for lectura in sorted(lecturas):
+            vehiculo_id, fecha, mileage = lectura
+            if conn.execute('''
+                SELECT 1 FROM Mileage WHERE vehiculo_id = ? AND fecha = ? AND mileage = ?
+                UNION ALL
+                SELECT 1 FROM Mileage_Marcado WHERE vehiculo_id = ? AND fecha = ? AND mileage = ?
+            ''', lectura + lectura).fetchone():
+                duplicadas += 1
+                continue
+            anterior = conn.execute('''
+                SELECT fecha, mileage FROM Mileage WHERE vehiculo_id = ? AND fecha < ?
+                ORDER BY fecha DESC, mileage DESC LIMIT 1
+            ''', (vehiculo_id, fecha)).fetchone()
+            siguiente = conn.execute('''
+                SELECT fecha, mileage FROM Mileage WHERE vehiculo_id = ? AND fecha > ?
+                ORDER BY fecha, mileage LIMIT 1
+            ''', (vehiculo_id, fecha)).fetchone()
+            if (anterior and mileage < anterior['mileage']) or (siguiente and mileage > siguiente['mileage']):
+                rollbacks.append({'vehiculo_id': vehiculo_id, 'fecha': fecha, 'mileage': mileage,
+                                  'anterior': dict(anterior) if anterior else None,
+                                  'siguiente': dict(siguiente) if siguiente else None})
+                if on_rollback == 'flag':
+                    conn.execute('''
+                        INSERT INTO Mileage_Marcado
+                        (vehiculo_id, fecha, mileage, fecha_anterior, mileage_anterior,
+                         fecha_siguiente, mileage_siguiente, recibido_en)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (vehiculo_id, fecha, mileage,
+                          anterior['fecha'] if anterior else None, anterior['mileage'] if anterior else None,
+                          siguiente['fecha'] if siguiente else None, siguiente['mileage'] if siguiente else None,
+                          get_cr_time().isoformat()))
+                continue
+            conn.execute('INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (?, ?, ?)', lectura)
+            insertadas += 1
+        # Operations run one at a time on the writer thread, so no lock is needed here
+        if time.monotonic() >= self._proxima_proyeccion:
+            refresh_odometer_projections(conn)
+            self._proxima_proyeccion = time.monotonic() + self.projection_interval
+        return {
+            'received': len(lecturas),
+            'inserted': insertadas,
+            'duplicates': duplicadas,
+            'rejected': [] if on_rollback == 'flag' else rollbacks,
+            'flagged': rollbacks if on_rollback == 'flag' else [],
+        }
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, writer=self.writer.stats())
+
+odometer_ingestor = OdometerIngestor(
+    db_writer if DB_WRITE_QUEUE else WriteQueue('odometer-writer', ODOMETER_COMMIT_INTERVAL,
+                                                ODOMETER_BATCH_MAX_ROWS, ODOMETER_QUEUE_SIZE),
+    ODOMETER_PROJECTION_INTERVAL)
+
+# Highest odometer value accepted (seven-digit odometers); larger values are typos or garbage
+ODOMETER_MAX_MILEAGE = 9_999_999
+
+def parse_odometer_reading(lectura, vehiculos):
+    """(vehiculo_id, fecha, mileage) of one submitted reading; raises ValueError if invalid.
+
+    fecha may be a date or an ISO timestamp; timestamps with a time zone are converted to
+    Costa Rica time. Readings are stored per day, like the ones saved with a maintenance.
+    """
+    if not isinstance(lectura, dict):
+        raise ValueError('Reading must be an object')
+    try:
+        vehiculo_id = int(lectura['vehiculo_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Missing or invalid vehiculo_id')
+    if vehiculo_id not in vehiculos:
+        raise ValueError(f'Vehicle not found: {vehiculo_id}')
+    fecha = lectura.get('fecha')
+    try:
+        momento = datetime.fromisoformat(str(fecha))
+    except ValueError:
+        raise ValueError(f'Invalid fecha: {fecha}')
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(pytz.timezone('America/Costa_Rica'))
+    mileage = lectura.get('mileage')
+    if isinstance(mileage, bool) or not isinstance(mileage, (int, float)) or not math.isfinite(mileage) \
+            or not 0 <= mileage <= ODOMETER_MAX_MILEAGE:
+        raise ValueError(f'Invalid mileage: {mileage}')
+    return vehiculo_id, momento.date().isoformat(), int(mileage)
+
+@app.route('/odometer_readings', methods=['POST'])
+def ingresar_lecturas():
+    """Ingest a batch of odometer readings from telematics units.
+
+    Expects JSON {"readings": [{"vehiculo_id", "fecha", "mileage"}, ...]} and optionally
+    "on_rollback": "reject" (default ODOMETER_ROLLBACK_MODE) or "flag". Logged-in users
+    and clients sending "Authorization: Bearer <ODOMETER_API_TOKEN>" are accepted. Invalid
+    readings are reported by index and the rest are written; the response comes once the
+    group commit holding them is done.
+    """
+    autorizado = g.user is not None or (ODOMETER_API_TOKEN and secrets.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {ODOMETER_API_TOKEN}'))
+    if not autorizado:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('readings'), list):
+        return jsonify({'success': False, 'error': 'Expected JSON with a readings list'}), 400
+    if len(data['readings']) > ODOMETER_MAX_READINGS:
+        return jsonify({'success': False,
+                        'error': f'At most {ODOMETER_MAX_READINGS} readings per request'}), 413
+    on_rollback = data.get('on_rollback', ODOMETER_ROLLBACK_MODE)
+    if on_rollback not in ('reject', 'flag'):
+        return jsonify({'success': False, 'error': 'on_rollback must be reject or flag'}), 400
+
+    vehiculos = {v['id'] for v in get_vehiculos(get_db())}
+    lecturas, invalidas = [], []
+    for indice, lectura in enumerate(data['readings']):
+        try:
+            lecturas.append(parse_odometer_reading(lectura, vehiculos))
+        except ValueError as e:
+            invalidas.append({'index': indice, 'error': str(e)})
 
-        # Get vehicle details
-        conn = get_db_connection()
-        vehiculo = conn.execute('''
-            SELECT d.marca, d.modelo, d.anio, d.tipo, d.tipo_motor, d.tipo_transmision
-            FROM Vehiculo v
-            JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-            WHERE v.id = ?
-        ''', (vehiculo_id,)).fetchone()
-        conn.close()
+    resultado = {'received': 0, 'inserted': 0, 'duplicates': 0, 'rejected': [], 'flagged': []}
+    if lecturas:
+        try:
+            resultado = odometer_ingestor.ingest(lecturas, on_rollback)
+        except queue.Full:
+            return jsonify({'success': False, 'error': 'Ingestion queue is full, retry later'}), 503, \
+                {'Retry-After': '1'}
+        except FutureTimeoutError:
+            # The readings were withdrawn before the writer reached them: nothing was written
+            return jsonify({'success': False,
+                            'error': 'Timed out waiting for the ingestion writer, retry later'}), 503, \
+                {'Retry-After': '1'}
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify(dict(resultado, success=True, invalid=invalidas))
+
+# --- AI suggestions ---
+
+def _normalize_text(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+def suggestion_cache_key(vehiculo, tipo_mantenimiento, campo):
+    """Cache key for a suggestion: the vehicle fields the prompt uses plus the requested field."""
+    partes = [vehiculo['marca'], vehiculo['modelo'], vehiculo['anio'], vehiculo['tipo_motor'],
+              vehiculo['tipo_transmision'], tipo_mantenimiento, campo]
+    normalizado = json.dumps([_normalize_text(p) for p in partes], ensure_ascii=False)
+    return hashlib.sha256(normalizado.encode('utf-8')).hexdigest()
+
+class SuggestionCache:
+    """Gemini suggestions stored in the Sugerencia_Cache table.
+
+    Living in SQLite, the cache is shared by all worker processes. Entries older than
+    ``ttl`` are treated as misses; once more than ``max_entries`` are stored the least
+    recently used ones are evicted. Hit and miss counters are kept per process.
+    """
+
+    # Minimum seconds between two ultimo_uso updates of the same entry, so cache hits
+    # do not turn every read into a write
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
 
-        if not vehiculo:
-            return jsonify({'success': False, 'error': 'Vehicle not found'})
+    def get(self, conn, clave, stale=False):
+        """Cached answer for clave, or None.
+
+        With stale=True expired answers are returned too (counted as stale hits), for
+        when a fresh answer cannot be produced.
+        """
+        now = time.time()
+        row = conn.execute(
+            'SELECT respuesta, creado, ultimo_uso FROM Sugerencia_Cache WHERE clave = ?', (clave,)
+        ).fetchone()
+        if stale:
+            if row is None:
+                return None
+            with self._lock:
+                self.stale_hits += 1
+            return json.loads(row['respuesta'])
+        if row is None or now - row['creado'] > self.ttl:
+            self._count(False)
+            return None
+
+        self._count(True)
+        if now - row['ultimo_uso'] > self.TOUCH_INTERVAL:
+            write_transaction(lambda conn: conn.execute(
+                'UPDATE Sugerencia_Cache SET ultimo_uso = ? WHERE clave = ?',
+                (now, clave)
+            ), conn)
+        return json.loads(row['respuesta'])
+
+    def set(self, conn, clave, campo, respuesta):
+        write_transaction(functools.partial(self._guardar, clave, campo, respuesta), conn)
+
+    def _guardar(self, clave, campo, respuesta, conn):
+        now = time.time()
+        conn.execute('''
+            INSERT OR REPLACE INTO Sugerencia_Cache (clave, campo, respuesta, creado, ultimo_uso)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (clave, campo, json.dumps(respuesta, ensure_ascii=False), now, now))
+        conn.execute('''
+            DELETE FROM Sugerencia_Cache
+            WHERE clave IN (
+                SELECT clave FROM Sugerencia_Cache
+                ORDER BY ultimo_uso
+                LIMIT max(0, (SELECT COUNT(*) FROM Sugerencia_Cache) - ?)
+            )
+        ''', (self.max_entries,))
+
+    def stats(self, conn):
+        entries = conn.execute('SELECT COUNT(*) FROM Sugerencia_Cache').fetchone()[0]
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+            }
 
-        # Configure the Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
+suggestion_cache = SuggestionCache(SUGGESTION_CACHE_TTL, SUGGESTION_CACHE_MAX_ENTRIES)
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it is still
+    running wait for it and receive the same result (or exception). If the first caller
+    passes on_text, the function is called with a progress callback whose reports reach
+    the on_text of every caller sharing the execution (a caller that joins late first
+    receives the latest report); otherwise it is called with None.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _progress(call, texto):
+        # The call's own lock keeps reports in order and keeps late joiners from missing one
+        with call['lock']:
+            call['texto'] = texto
+            for on_text in call['listeners']:
+                try:
+                    on_text(texto)
+                except Exception as e:
+                    app.logger.warning('Progress callback failed: %s', e)
+
+    def do(self, key, fn, on_text=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None,
+                        'lock': threading.Lock(), 'listeners': [], 'texto': None}
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.coalesced += 1
 
-        # Expert-level prompts with mechanical considerations
-        if campo == 'miles':
-            prompt = f"""As an expert mechanic with 20 years of experience, considering:
+        if on_text is not None:
+            with call['lock']:
+                call['listeners'].append(on_text)
+                if call['texto'] is not None:
+                    on_text(call['texto'])
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(None if on_text is None else lambda texto: self._progress(call, texto))
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+        return call['result']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+            }
+
+suggestion_flight = SingleFlight()
+
+class SuggestionUnavailableError(Exception):
+    """Raised when the suggestion backend fails and nothing else can answer."""
+
+def obtener_sugerencia(conn, vehiculo, tipo_mantenimiento, campo, on_text=None):
+    """Suggestion for one field ('miles', 'meses', 'categoria') of a maintenance type, or all of them ('todo').
+
+    Answers come from the suggestion cache when possible; otherwise identical concurrent
+    requests share a single backend call whose successful result is cached. If the
+    backend fails (or its circuit breaker is open), an expired cached answer is served
+    if there is one, else the fallback backend answers (without caching its answer, and
+    naming itself in the answer's 'fuente'), else SuggestionUnavailableError is raised.
+    on_text, if given, receives the model's answer text as it is generated, also when
+    the call joined an identical one already in progress.
+    """
+    clave = suggestion_cache_key(vehiculo, tipo_mantenimiento, campo)
+    resultado = suggestion_cache.get(conn, clave)
+    if resultado is not None:
+        return resultado
+
+    def generar(progreso):
+        try:
+            nuevo = suggestion_backend.suggest(vehiculo, tipo_mantenimiento, campo, progreso)
+        except Exception as e:
+            anterior = suggestion_cache.get(conn, clave, stale=True)
+            if anterior is not None:
+                app.logger.warning("Suggestion backend '%s' failed (%s), serving an expired cached answer",
+                                   suggestion_backend.name, e)
+                return anterior
+            if suggestion_fallback is None:
+                raise SuggestionUnavailableError(f'Suggestion unavailable: {e}') from e
+            app.logger.warning("Suggestion backend '%s' failed (%s), answering with '%s'",
+                               suggestion_backend.name, e, suggestion_fallback.name)
+            return dict(suggestion_fallback.suggest(vehiculo, tipo_mantenimiento, campo),
+                        fuente=suggestion_fallback.name)
+        if nuevo['success']:
+            suggestion_cache.set(conn, clave, campo, nuevo)
+        return nuevo
+
+    return suggestion_flight.do(clave, generar, on_text)
+
+# Categories the AI may answer with (in English)
+AI_CATEGORIES = ["Engine", "Brakes", "Transmission", "Suspension", "Electrical", "Tires", "Body", "Cooling"]
+
+def normalizar_categoria_ia(texto):
+    """Map an AI answer to one of AI_CATEGORIES (exact or fuzzy match), or None."""
+    # Clean up the category response
+    categoria = texto.strip().title()  # Capitalize first letter
+    if not categoria:
+        return None
+    if categoria in AI_CATEGORIES:
+        return categoria
+
+    # Try fuzzy matching
+    categoria_lower = categoria.lower()
+    for valid_cat in AI_CATEGORIES:
+        if valid_cat.lower() in categoria_lower or categoria_lower in valid_cat.lower():
+            return valid_cat
+    return None
+
+def prompt_sugerencia_intervalo(vehiculo, tipo_mantenimiento, campo):
+    """Expert prompt asking for the miles or months interval of a maintenance type."""
+    # Expert-level prompts with mechanical considerations
+    if campo == 'miles':
+        prompt = f"""As an expert mechanic with 20 years of experience, considering:
 1. Vehicle: {vehiculo['marca']} {vehiculo['modelo']} {vehiculo['anio']}
 2. Engine type: {vehiculo['tipo_motor']}
 3. Transmission type: {vehiculo['tipo_transmision']}
@@ -677,8 +3401,8 @@ EXPLANATION: [2-3 sentences explaining why {tipo_mantenimiento} is needed for th
 Example response:
 MILES: 5000
 EXPLANATION: Oil changes are essential for engine lubrication and preventing wear. In tropical climates, the oil breaks down faster due to heat, requiring more frequent changes."""
-        else:
-            prompt = f"""As an expert mechanic with 20 years of experience, considering:
+    else:
+        prompt = f"""As an expert mechanic with 20 years of experience, considering:
 1. Vehicle: {vehiculo['marca']} {vehiculo['modelo']} {vehiculo['anio']}
 2. Engine type: {vehiculo['tipo_motor']}
 3. Transmission type: {vehiculo['tipo_transmision']}
@@ -704,143 +3428,111 @@ Example response:
 MONTHS: 12
 EXPLANATION: Delaying brake fluid changes can lead to moisture buildup causing brake failure. The fluid absorbs water over time which reduces braking efficiency and can damage internal components."""
 
-        response = model.generate_content(prompt)
-        sugerencia = response.text.strip()
+    return prompt
 
-        # Check if the maintenance is not applicable
-        if sugerencia.upper() == 'N/A' or 'N/A' in sugerencia.upper():
-            return jsonify({
-                'success': True,
-                'sugerencia': 'N/A',
-                'message': 'This maintenance type does not apply to this vehicle configuration'
-            })
-
-        # Parse the AI response with the new format
-        try:
-            # Clean the response - remove any extra text
-            import re
-
-            # Extract value and explanation from the response
-            if campo == 'miles':
-                miles_match = re.search(r'MILES:\s*(\d+)', sugerencia, re.IGNORECASE)
-                explanation_match = re.search(r'EXPLANATION:\s*(.+)', sugerencia, re.IGNORECASE | re.DOTALL)
-
-                if miles_match:
-                    value = miles_match.group(1)
-                    explanation = explanation_match.group(1).strip() if explanation_match else f"Regular {tipo_mantenimiento} is essential for vehicle longevity."
-                    return jsonify({
-                        'success': True,
-                        'sugerencia': value,
-                        'explanation': explanation,
-                        'question': f'Why do I need {tipo_mantenimiento}?'
-                    })
-            else:  # months
-                months_match = re.search(r'MONTHS:\s*(\d+)', sugerencia, re.IGNORECASE)
-                explanation_match = re.search(r'EXPLANATION:\s*(.+)', sugerencia, re.IGNORECASE | re.DOTALL)
-
-                if months_match:
-                    value = months_match.group(1)
-                    explanation = explanation_match.group(1).strip() if explanation_match else f"Delaying {tipo_mantenimiento} can lead to component failure."
-                    return jsonify({
-                        'success': True,
-                        'sugerencia': value,
-                        'explanation': explanation,
-                        'question': f'What happens if I delay {tipo_mantenimiento}?'
-                    })
-
-            # First, try to find a standalone number (not part of a year like "1987")
-            # Look for numbers that are clearly maintenance intervals
-            clean_text = sugerencia.replace(',', '').strip()
-
-            # If the response contains just a number, use it
-            if clean_text.isdigit():
-                numero = int(clean_text)
-            else:
-                # Extract numbers but filter out obvious years (1900-2099)
-                numbers = re.findall(r'\b\d+\b', clean_text)
-                valid_numbers = []
-
-                for num_str in numbers:
-                    num = int(num_str)
-                    # Filter out years (1900-2099) and the specific vehicle year
-                    if num < 1900 or num > 2099:
-                        valid_numbers.append(num)
-                    elif vehiculo and 'anio' in vehiculo and num != int(vehiculo['anio']):
-                        # If it's in year range but not the vehicle's year, it might be valid
-                        if campo == 'miles' and num >= 600:
-                            valid_numbers.append(num)
-                        elif campo == 'meses' and num <= 120:
-                            valid_numbers.append(num)
-
-                if not valid_numbers:
-                    return jsonify({
-                        'success': False,
-                        'error': f'Invalid recommendation: {sugerencia} - No valid interval found'
-                    })
-
-                # If it's a range, take the maximum
-                numero = max(valid_numbers) if len(valid_numbers) > 1 else valid_numbers[0]
-
-            # Validate the number is reasonable
-            if campo == 'miles':
-                # Reasonable range for miles: 600 to 125000
-                if numero < 600 or numero > 125000:
-                    return jsonify({
-                        'success': False,
-                        'error': f'Invalid mile value: {numero}. Must be between 600 and 125,000 mi'
-                    })
-            else:  # months
-                # Reasonable range for months: 1 to 120 (10 years)
-                if numero < 1 or numero > 120:
-                    return jsonify({
-                        'success': False,
-                        'error': f'Invalid month value: {numero}. Must be between 1 and 120 months'
-                    })
-
-            return jsonify({'success': True, 'sugerencia': numero})
+def parse_sugerencia_intervalo(texto, vehiculo, tipo_mantenimiento, campo):
+    """Parse an interval answer into the /suggest_maintenance response."""
+    sugerencia = texto.strip()
 
-        except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': f'Invalid recommendation: {sugerencia} - {str(e)}'
-            })
-
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+    # Check if the maintenance is not applicable
+    if sugerencia.upper() == 'N/A' or 'N/A' in sugerencia.upper():
+        return {
+            'success': True,
+            'sugerencia': 'N/A',
+            'message': 'This maintenance type does not apply to this vehicle configuration'
+        }
 
-@app.route('/suggest_category', methods=['POST'])
-@login_required
-def sugerir_categoria():
+    # Parse the AI response with the new format
     try:
-        # Check if Gemini API is configured
-        if not GEMINI_API_KEY:
-            return jsonify({
-                'success': False,
-                'error': 'AI suggestions are disabled. Gemini API key not configured.'
-            })
+        # Extract value and explanation from the response
+        if campo == 'miles':
+            miles_match = re.search(r'MILES:\s*(\d+)', sugerencia, re.IGNORECASE)
+            explanation_match = re.search(r'EXPLANATION:\s*(.+)', sugerencia, re.IGNORECASE | re.DOTALL)
+
+            if miles_match:
+                value = miles_match.group(1)
+                explanation = explanation_match.group(1).strip() if explanation_match else f"Regular {tipo_mantenimiento} is essential for vehicle longevity."
+                return {
+                    'success': True,
+                    'sugerencia': value,
+                    'explanation': explanation,
+                    'question': f'Why do I need {tipo_mantenimiento}?'
+                }
+        else:  # months
+            months_match = re.search(r'MONTHS:\s*(\d+)', sugerencia, re.IGNORECASE)
+            explanation_match = re.search(r'EXPLANATION:\s*(.+)', sugerencia, re.IGNORECASE | re.DOTALL)
+
+            if months_match:
+                value = months_match.group(1)
+                explanation = explanation_match.group(1).strip() if explanation_match else f"Delaying {tipo_mantenimiento} can lead to component failure."
+                return {
+                    'success': True,
+                    'sugerencia': value,
+                    'explanation': explanation,
+                    'question': f'What happens if I delay {tipo_mantenimiento}?'
+                }
+
+        # First, try to find a standalone number (not part of a year like "1987")
+        # Look for numbers that are clearly maintenance intervals
+        clean_text = sugerencia.replace(',', '').strip()
+
+        # If the response contains just a number, use it
+        if clean_text.isdigit():
+            numero = int(clean_text)
+        else:
+            # Extract numbers but filter out obvious years (1900-2099)
+            numbers = re.findall(r'\b\d+\b', clean_text)
+            valid_numbers = []
+
+            for num_str in numbers:
+                num = int(num_str)
+                # Filter out years (1900-2099) and the specific vehicle year
+                if num < 1900 or num > 2099:
+                    valid_numbers.append(num)
+                elif vehiculo and 'anio' in vehiculo and num != int(vehiculo['anio']):
+                    # If it's in year range but not the vehicle's year, it might be valid
+                    if campo == 'miles' and num >= 600:
+                        valid_numbers.append(num)
+                    elif campo == 'meses' and num <= 120:
+                        valid_numbers.append(num)
 
-        data = request.get_json()
-        tipo_mantenimiento = data['tipo_mantenimiento']
-        vehiculo_id = data['vehiculo_id']
+            if not valid_numbers:
+                return {
+                    'success': False,
+                    'error': f'Invalid recommendation: {sugerencia} - No valid interval found'
+                }
 
-        # Get vehicle details
-        conn = get_db_connection()
-        vehiculo = conn.execute('''
-            SELECT d.marca, d.modelo, d.anio, d.tipo, d.tipo_motor, d.tipo_transmision
-            FROM Vehiculo v
-            JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
-            WHERE v.id = ?
-        ''', (vehiculo_id,)).fetchone()
-        conn.close()
+            # If it's a range, take the maximum
+            numero = max(valid_numbers) if len(valid_numbers) > 1 else valid_numbers[0]
 
-        if not vehiculo:
-            return jsonify({'success': False, 'error': 'Vehicle not found'})
+        # Validate the number is reasonable
+        if campo == 'miles':
+            # Reasonable range for miles: 600 to 125000
+            if numero < 600 or numero > 125000:
+                return {
+                    'success': False,
+                    'error': f'Invalid mile value: {numero}. Must be between 600 and 125,000 mi'
+                }
+        else:  # months
+            # Reasonable range for months: 1 to 120 (10 years)
+            if numero < 1 or numero > 120:
+                return {
+                    'success': False,
+                    'error': f'Invalid month value: {numero}. Must be between 1 and 120 months'
+                }
 
-        # Configure the Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
+        return {'success': True, 'sugerencia': numero}
 
-        # Expert-level prompt for category suggestion
-        prompt = f"""As an expert mechanic with 20 years of experience, for a {vehiculo['marca']} {vehiculo['modelo']} {vehiculo['anio']} with engine type {vehiculo['tipo_motor']} and transmission type {vehiculo['tipo_transmision']},
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Invalid recommendation: {sugerencia} - {str(e)}'
+        }
+
+def prompt_sugerencia_categoria(vehiculo, tipo_mantenimiento):
+    """Expert prompt asking which category a maintenance type belongs to."""
+    # Expert-level prompt for category suggestion
+    prompt = f"""As an expert mechanic with 20 years of experience, for a {vehiculo['marca']} {vehiculo['modelo']} {vehiculo['anio']} with engine type {vehiculo['tipo_motor']} and transmission type {vehiculo['tipo_transmision']},
 
 CRITICAL: First determine if the maintenance task '{tipo_mantenimiento}' is applicable to this vehicle.
 
@@ -863,46 +3555,846 @@ Available categories (YOU MUST RETURN ONE OF THESE EXACT ENGLISH WORDS):
 - Cooling (for cooling system)
 
 Required answer: ONLY "N/A" if not applicable, OR one of the exact English category names listed above. Example: "N/A" or "Engine" or "Tires" """
-        response = model.generate_content(prompt)
-        categoria = response.text.strip()
+    return prompt
 
-        # Check if the maintenance is not applicable
-        if categoria.upper() == 'N/A' or 'N/A' in categoria.upper():
-            return jsonify({
+def parse_sugerencia_categoria(texto, tipo_mantenimiento):
+    """Validate a category answer into the /suggest_category response."""
+    categoria = texto.strip()
+
+    # Check if the maintenance is not applicable
+    if categoria.upper() == 'N/A' or 'N/A' in categoria.upper():
+        return {
+            'success': True,
+            'categoria': 'N/A',
+            'message': 'This maintenance type does not apply to this vehicle configuration'
+        }
+
+    categoria_valida = normalizar_categoria_ia(categoria)
+    if categoria_valida is None:
+        # Return an error instead of defaulting
+        return {
+            'success': False,
+            'error': f'Unable to determine category for: {tipo_mantenimiento}. AI returned: {categoria.strip().title()}'
+        }
+
+    return {'success': True, 'categoria': categoria_valida}
+
+def _parse_intervalo(texto, minimo, maximo):
+    """Interval number from a MILES/MONTHS field of a combined answer, 'N/A' or None if invalid."""
+    texto = (texto or '').strip()
+    if texto.upper().startswith('N/A'):
+        return 'N/A'
+    match = re.search(r'\d+', texto.replace(',', ''))
+    if not match:
+        return None
+    numero = int(match.group(0))
+    return numero if minimo <= numero <= maximo else None
+
+def prompt_sugerencias_combinadas(vehiculo, tipo_mantenimiento):
+    """One prompt asking for the miles, months and category of a maintenance type."""
+    return f"""As an expert mechanic with 20 years of experience, considering:
+1. Vehicle: {vehiculo['marca']} {vehiculo['modelo']} {vehiculo['anio']}
+2. Engine type: {vehiculo['tipo_motor']}
+3. Transmission type: {vehiculo['tipo_transmision']}
+4. Maintenance type: {tipo_mantenimiento}
+
+CRITICAL: First determine if the maintenance task '{tipo_mantenimiento}' is applicable to this vehicle.
+
+IMPORTANT RULES:
+- If the vehicle has an electric engine (Eléctrico/Electric) and the maintenance involves oil, engine oil filters, spark plugs, or other combustion engine components, it is NOT applicable
+- If the vehicle has a manual transmission and the maintenance is for automatic transmission fluid, it is NOT applicable
+- If the vehicle has an automatic transmission and the maintenance is for clutch replacement, it is NOT applicable
+- If the maintenance type doesn't apply to this specific vehicle configuration, it is NOT applicable
+
+If the maintenance IS applicable, provide:
+1. The optimal interval in MILES (between 600 and 125000), or N/A if it is not mileage based
+2. Why this maintenance is needed
+3. The optimal interval in MONTHS (between 1 and 120), or N/A if it is not time based
+4. What happens if this maintenance is delayed
+5. The category, ONE of these exact English words: {', '.join(AI_CATEGORIES)}
+
+Return your response in this EXACT format, one field per line:
+APPLICABLE: [YES or NO]
+MILES: [number only or N/A]
+MILES_EXPLANATION: [2-3 sentences explaining why {tipo_mantenimiento} is needed for this vehicle]
+MONTHS: [number only or N/A]
+MONTHS_EXPLANATION: [2-3 sentences explaining what happens if {tipo_mantenimiento} is delayed beyond the recommended interval]
+CATEGORY: [one category name]
+
+Example response:
+APPLICABLE: YES
+MILES: 5000
+MILES_EXPLANATION: Oil changes are essential for engine lubrication and preventing wear. In tropical climates, the oil breaks down faster due to heat, requiring more frequent changes.
+MONTHS: 6
+MONTHS_EXPLANATION: Delaying oil changes lets sludge build up and accelerates engine wear. Old oil loses its ability to protect moving parts.
+CATEGORY: Engine"""
+
+def parse_sugerencias_combinadas(texto, tipo_mantenimiento):
+    """Parse the structured answer to prompt_sugerencias_combinadas.
+
+    The result holds one entry per form field, each shaped like the response of the
+    single-field endpoints (/suggest_maintenance and /suggest_category).
+    """
+    campos = {}
+    for linea in texto.strip().splitlines():
+        clave, separador, valor = linea.partition(':')
+        if separador:
+            campos[clave.strip().upper().lstrip('*- ').rstrip('* ')] = valor.strip().strip('*').strip()
+
+    no_aplica = {
+        'success': True,
+        'aplica': False,
+        'message': 'This maintenance type does not apply to this vehicle configuration',
+    }
+    if campos.get('APPLICABLE', '').upper().startswith('NO') or (not campos and 'N/A' in texto.upper()):
+        no_aplica.update({
+            'miles': {'success': True, 'sugerencia': 'N/A', 'message': no_aplica['message']},
+            'meses': {'success': True, 'sugerencia': 'N/A', 'message': no_aplica['message']},
+            'categoria': {'success': True, 'categoria': 'N/A', 'message': no_aplica['message']},
+        })
+        return no_aplica
+
+    resultado = {'success': True, 'aplica': True}
+    for campo, etiqueta, minimo, maximo, pregunta, explicacion_defecto in (
+        ('miles', 'MILES', 600, 125000, f'Why do I need {tipo_mantenimiento}?',
+         f"Regular {tipo_mantenimiento} is essential for vehicle longevity."),
+        ('meses', 'MONTHS', 1, 120, f'What happens if I delay {tipo_mantenimiento}?',
+         f"Delaying {tipo_mantenimiento} can lead to component failure."),
+    ):
+        valor = _parse_intervalo(campos.get(etiqueta), minimo, maximo)
+        if valor is None:
+            resultado[campo] = {
+                'success': False,
+                'error': f'Invalid recommendation: {campos.get(etiqueta, "")} - No valid interval found'
+            }
+        elif valor == 'N/A':
+            resultado[campo] = {'success': True, 'sugerencia': 'N/A',
+                                'message': f'{tipo_mantenimiento} has no {etiqueta.lower()} based interval'}
+        else:
+            resultado[campo] = {
                 'success': True,
-                'categoria': 'N/A',
-                'message': 'This maintenance type does not apply to this vehicle configuration'
+                'sugerencia': str(valor),
+                'explanation': campos.get(f'{etiqueta}_EXPLANATION') or explicacion_defecto,
+                'question': pregunta,
+            }
+
+    categoria = normalizar_categoria_ia(campos.get('CATEGORY', ''))
+    if categoria is None:
+        resultado['categoria'] = {
+            'success': False,
+            'error': f'Unable to determine category for: {tipo_mantenimiento}. AI returned: {campos.get("CATEGORY", "")}'
+        }
+    else:
+        resultado['categoria'] = {'success': True, 'categoria': categoria}
+
+    # Nothing usable came back: report it as an error so it is not cached
+    if not any(resultado[campo]['success'] for campo in ('miles', 'meses', 'categoria')):
+        return {'success': False, 'error': f'Invalid recommendation: {texto.strip()}'}
+    return resultado
+
+# --- Suggestion backends ---
+
+class SuggestionBackend:
+    """Source of interval and category suggestions.
+
+    suggest() returns the same response dictionaries as the suggestion endpoints for
+    campo 'miles', 'meses', 'categoria' or 'todo' (all three fields). Backends that
+    generate text call on_text with the text received so far while it streams in.
+    """
+
+    name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def available(self):
+        return True
+
+    def suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        inicio = time.perf_counter()
+        try:
+            return self._suggest(vehiculo, tipo_mantenimiento, campo, on_text)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.calls += 1
+                self.seconds += time.perf_counter() - inicio
+
+    def _suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_ms': round(self.seconds / self.calls * 1000, 2) if self.calls else None,
+            }
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Stop calling a dependency that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and calls fail
+    immediately with CircuitOpenError. Once ``reset_timeout`` seconds have passed one
+    trial call is let through (half open): its success closes the breaker again, its
+    failure reopens it.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            now = time.monotonic()
+            if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.short_circuited += 1
+            retry_in = max(1, math.ceil(self.reset_timeout - (now - self.opened_at)))
+        raise CircuitOpenError(f'AI suggestions are temporarily unavailable, try again in {retry_in} seconds')
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'short_circuited': self.short_circuited,
+            }
+
+class PromptSuggestionBackend(SuggestionBackend):
+    """Backends that send the expert prompts to a language model and parse its text.
+
+    Backends are created once at startup and shared by all requests. generate_text()
+    bounds every model call: each request to the model gets at most ``timeout`` seconds
+    and the call as a whole, retries included, at most ``deadline`` seconds. Transient
+    failures are retried up to ``max_retries`` times with jittered exponential backoff,
+    and a circuit breaker fails calls fast while the model keeps failing, so a brownout
+    upstream cannot tie up every worker thread.
+    """
+
+    # HTTP status codes worth retrying
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+    # Latency samples kept for the percentiles reported by stats()
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, timeout=None, deadline=None, max_retries=None, backoff=None, breaker=None):
+        super().__init__()
+        self.timeout = GEMINI_TIMEOUT if timeout is None else timeout
+        self.deadline = GEMINI_DEADLINE if deadline is None else deadline
+        self.max_retries = GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = GEMINI_RETRY_BACKOFF if backoff is None else backoff
+        self.breaker = breaker or CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET)
+        self.parse_seconds = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.request_errors = 0
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+
+    def send(self, prompt, timeout, on_text=None):
+        """Ask the model once, giving up after ``timeout`` seconds; returns its text.
+
+        With on_text the answer is streamed, calling on_text with the text received so far.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _is_timeout(error):
+        if isinstance(error, urllib.error.URLError) and isinstance(error.reason, Exception):
+            error = error.reason
+        return isinstance(error, TimeoutError) or getattr(error, 'code', None) == 504
+
+    def is_retryable(self, error):
+        """Whether ``error`` is a transient upstream failure (vs. a bad request or answer)."""
+        # urllib's HTTPError and google.api_core's errors both carry the HTTP status as .code
+        code = getattr(error, 'code', None)
+        if isinstance(code, int):
+            return code in self.RETRYABLE_STATUS
+        return isinstance(error, (TimeoutError, ConnectionError, urllib.error.URLError))
+
+    def generate_text(self, prompt, on_text=None):
+        self.breaker.before_call()
+        limite = time.monotonic() + self.deadline
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                texto = self.send(prompt, min(self.timeout, limite - time.monotonic()), on_text)
+            except Exception as e:
+                transitorio = self.is_retryable(e)
+                with self._lock:
+                    self.requests += 1
+                    self.request_errors += 1
+                    self.timeouts += self._is_timeout(e)
+                    self._latencies.append(time.perf_counter() - inicio)
+                espera = random.uniform(0, self.backoff * 2 ** intento)
+                if not transitorio or intento >= self.max_retries or time.monotonic() + espera >= limite:
+                    # Non-transient errors mean the model is reachable, so they do not count
+                    # towards opening the breaker
+                    if transitorio:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    raise
+                app.logger.info('Model request failed (%s), retrying in %.2f s', e, espera)
+                time.sleep(espera)
+                intento += 1
+                with self._lock:
+                    self.retries += 1
+                continue
+            with self._lock:
+                self.requests += 1
+                self._latencies.append(time.perf_counter() - inicio)
+            self.breaker.record_success()
+            return texto
+
+    def _suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        if campo == 'todo':
+            prompt = prompt_sugerencias_combinadas(vehiculo, tipo_mantenimiento)
+        elif campo == 'categoria':
+            prompt = prompt_sugerencia_categoria(vehiculo, tipo_mantenimiento)
+        else:
+            prompt = prompt_sugerencia_intervalo(vehiculo, tipo_mantenimiento, campo)
+        texto = self.generate_text(prompt, on_text)
+
+        inicio = time.perf_counter()
+        try:
+            if campo == 'todo':
+                return parse_sugerencias_combinadas(texto, tipo_mantenimiento)
+            if campo == 'categoria':
+                return parse_sugerencia_categoria(texto, tipo_mantenimiento)
+            return parse_sugerencia_intervalo(texto, vehiculo, tipo_mantenimiento, campo)
+        finally:
+            with self._lock:
+                self.parse_seconds += time.perf_counter() - inicio
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            latencias = sorted(self._latencies)
+            stats.update({
+                'avg_parse_ms': round(self.parse_seconds / self.calls * 1000, 3) if self.calls else None,
+                'model_requests': self.requests,
+                'model_request_errors': self.request_errors,
+                'retries': self.retries,
+                'timeouts': self.timeouts,
+                'model_latency_ms': {
+                    'p50': round(latencias[len(latencias) // 2] * 1000, 1),
+                    'p95': round(latencias[int(len(latencias) * 0.95)] * 1000, 1),
+                    'max': round(latencias[-1] * 1000, 1),
+                } if latencias else None,
             })
+        stats['circuit_breaker'] = self.breaker.stats()
+        return stats
+
+class GeminiSuggestionBackend(PromptSuggestionBackend):
+    """Gemini through the google.generativeai SDK."""
+
+    name = 'gemini'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # One model object for the life of the process, instead of one per request
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+
+    def available(self):
+        return bool(GEMINI_API_KEY)
+
+    def send(self, prompt, timeout, on_text=None):
+        # Retries are done by generate_text(), not by the SDK
+        opciones = {'timeout': timeout, 'retry': None}
+        if on_text is None:
+            return self.model.generate_content(prompt, request_options=opciones).text
+
+        limite = time.monotonic() + timeout
+        texto = ''
+        for chunk in self.model.generate_content(prompt, stream=True, request_options=opciones):
+            texto += chunk.text
+            on_text(texto)
+            if time.monotonic() > limite:
+                raise TimeoutError('The model did not finish its answer in time')
+        return texto
+
+class HttpGeminiSuggestionBackend(PromptSuggestionBackend):
+    """Gemini's generateContent REST API called directly over HTTP.
+
+    Pointing GEMINI_API_BASE at fake_gemini_server.py gives a local stand-in with
+    Gemini-like latency and answers, for load tests that need no network or quota.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url, api_key=None, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+
+    @staticmethod
+    def _texto_candidato(data):
+        partes = data['candidates'][0]['content']['parts']
+        return ''.join(parte.get('text', '') for parte in partes)
+
+    def send(self, prompt, timeout, on_text=None):
+        # streamGenerateContent with alt=sse answers with Server-Sent Events, one chunk each
+        metodo = 'streamGenerateContent' if on_text else 'generateContent'
+        parametros = {'alt': 'sse'} if on_text else {}
+        if self.api_key:
+            parametros['key'] = self.api_key
+        url = f'{self.base_url}/v1beta/models/{GEMINI_MODEL}:{metodo}'
+        if parametros:
+            url += '?' + urllib.parse.urlencode(parametros)
+        body = json.dumps({'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]}).encode('utf-8')
+        http_request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+
+        limite = time.monotonic() + timeout
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            if on_text is None:
+                return self._texto_candidato(json.loads(response.read().decode('utf-8')))
+            texto = ''
+            for linea in response:
+                linea = linea.decode('utf-8').strip()
+                if linea.startswith('data:'):
+                    texto += self._texto_candidato(json.loads(linea[len('data:'):]))
+                    on_text(texto)
+                if time.monotonic() > limite:
+                    raise TimeoutError('The model did not finish its answer in time')
+            return texto
+
+# Offline suggestion rules keyed by the Spanish maintenance type names of
+# MAINTENANCE_TYPE_TRANSLATIONS, plus a few common types the dictionary lacks.
+# requiere: 'combustion' (not for electric engines), 'automatica' or 'manual' transmission.
+MAINTENANCE_RULES: Dict[str, Dict] = {
+    'Cambio de Aceite': {'miles': 5000, 'meses': 6, 'categoria': 'Engine', 'requiere': 'combustion'},
+    'Cambio de Filtro de Aceite': {'miles': 5000, 'meses': 6, 'categoria': 'Engine', 'requiere': 'combustion'},
+    'Cambio de Filtro de Aire': {'miles': 15000, 'meses': 12, 'categoria': 'Engine', 'requiere': 'combustion'},
+    'Cambio de Bujías': {'miles': 30000, 'meses': 36, 'categoria': 'Engine', 'requiere': 'combustion'},
+    'Cambio de Pastillas': {'miles': 25000, 'meses': 24, 'categoria': 'Brakes'},
+    'Cambio de Discos': {'miles': 50000, 'meses': 48, 'categoria': 'Brakes'},
+    'Alineamiento': {'miles': 12000, 'meses': 12, 'categoria': 'Suspension'},
+    'Balanceo': {'miles': 6000, 'meses': 6, 'categoria': 'Tires'},
+    'Rotación de Llantas': {'miles': 6000, 'meses': 6, 'categoria': 'Tires'},
+    'Cambio de Llantas': {'miles': 50000, 'meses': 60, 'categoria': 'Tires'},
+    'Cambio de Batería': {'miles': None, 'meses': 48, 'categoria': 'Electrical'},
+    'Revisión General': {'miles': 10000, 'meses': 12, 'categoria': 'Engine'},
+    'Cambio de Aceite de Transmisión': {'miles': 60000, 'meses': 48, 'categoria': 'Transmission',
+                                        'requiere': 'automatica'},
+    'Cambio de Embrague': {'miles': 80000, 'meses': 84, 'categoria': 'Transmission', 'requiere': 'manual'},
+    'Cambio de Líquido de Frenos': {'miles': 30000, 'meses': 24, 'categoria': 'Brakes'},
+    'Cambio de Refrigerante': {'miles': 50000, 'meses': 48, 'categoria': 'Cooling'},
+}
+
+# Keywords (Spanish and English, lower case) recognising free-text type names, checked in order
+MAINTENANCE_RULE_KEYWORDS = [
+    (('filtro de aceite', 'oil filter'), 'Cambio de Filtro de Aceite'),
+    (('aceite de transmisi', 'transmission fluid', 'transmission oil'), 'Cambio de Aceite de Transmisión'),
+    (('aceite', 'oil'), 'Cambio de Aceite'),
+    (('filtro de aire', 'air filter'), 'Cambio de Filtro de Aire'),
+    (('bujía', 'bujia', 'spark plug'), 'Cambio de Bujías'),
+    (('líquido de frenos', 'liquido de frenos', 'brake fluid'), 'Cambio de Líquido de Frenos'),
+    (('pastilla', 'brake pad'), 'Cambio de Pastillas'),
+    (('disco', 'rotor'), 'Cambio de Discos'),
+    (('alinea', 'alignment'), 'Alineamiento'),
+    (('balanc',), 'Balanceo'),
+    (('rotaci', 'rotation'), 'Rotación de Llantas'),
+    (('llanta', 'tire', 'tyre'), 'Cambio de Llantas'),
+    (('bater', 'battery'), 'Cambio de Batería'),
+    (('embrague', 'clutch'), 'Cambio de Embrague'),
+    (('refrigerante', 'coolant', 'anticongelante', 'antifreeze'), 'Cambio de Refrigerante'),
+    (('revisi', 'inspection', 'check-up', 'checkup'), 'Revisión General'),
+]
+
+class RuleBasedSuggestionBackend(SuggestionBackend):
+    """Deterministic, zero-latency suggestions from MAINTENANCE_RULES."""
+
+    name = 'rules'
+
+    def __init__(self):
+        super().__init__()
+        self._por_nombre = {}
+        for nombre in MAINTENANCE_RULES:
+            self._por_nombre[_normalize_text(nombre)] = nombre
+            if nombre in MAINTENANCE_TYPE_TRANSLATIONS:
+                self._por_nombre[_normalize_text(MAINTENANCE_TYPE_TRANSLATIONS[nombre])] = nombre
+
+    def find_rule(self, tipo_mantenimiento):
+        texto = _normalize_text(tipo_mantenimiento)
+        nombre = self._por_nombre.get(texto)
+        if nombre is None:
+            nombre = next((regla for palabras, regla in MAINTENANCE_RULE_KEYWORDS
+                           if any(palabra in texto for palabra in palabras)), None)
+        return nombre
+
+    @staticmethod
+    def _aplica(regla, vehiculo):
+        motor = _normalize_text(vehiculo['tipo_motor'])
+        transmision = _normalize_text(vehiculo['tipo_transmision'])
+        requiere = regla.get('requiere')
+        if requiere == 'combustion':
+            return 'eléctr' not in motor and 'electr' not in motor
+        if requiere == 'automatica':
+            return 'manual' not in transmision
+        if requiere == 'manual':
+            return 'autom' not in transmision and 'cvt' not in transmision
+        return True
+
+    def _suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        nombre = self.find_rule(tipo_mantenimiento)
+        if nombre is None:
+            return {'success': False, 'error': f'No maintenance rule for: {tipo_mantenimiento}'}
+        regla = MAINTENANCE_RULES[nombre]
+
+        mensaje = 'This maintenance type does not apply to this vehicle configuration'
+        if not self._aplica(regla, vehiculo):
+            if campo == 'categoria':
+                return {'success': True, 'categoria': 'N/A', 'message': mensaje}
+            if campo != 'todo':
+                return {'success': True, 'sugerencia': 'N/A', 'message': mensaje}
+            return {
+                'success': True, 'aplica': False, 'message': mensaje,
+                'miles': {'success': True, 'sugerencia': 'N/A', 'message': mensaje},
+                'meses': {'success': True, 'sugerencia': 'N/A', 'message': mensaje},
+                'categoria': {'success': True, 'categoria': 'N/A', 'message': mensaje},
+            }
+
+        sistema = regla['categoria'].lower()
+        respuestas = {'categoria': {'success': True, 'categoria': regla['categoria']}}
+        for campo_intervalo, pregunta, explicacion in (
+            ('miles', f'Why do I need {tipo_mantenimiento}?',
+             f"{tipo_mantenimiento} keeps the {sistema} system of the {vehiculo['marca']} {vehiculo['modelo']} "
+             f"working as designed. This interval follows typical manufacturer schedules."),
+            ('meses', f'What happens if I delay {tipo_mantenimiento}?',
+             f"Delaying {tipo_mantenimiento} accelerates wear of {sistema} components and can lead to "
+             f"costlier repairs. Parts and fluids degrade with time even when the vehicle is driven little."),
+        ):
+            valor = regla[campo_intervalo]
+            if valor is None:
+                respuestas[campo_intervalo] = {
+                    'success': True, 'sugerencia': 'N/A',
+                    'message': f'{tipo_mantenimiento} has no {"miles" if campo_intervalo == "miles" else "months"} based interval',
+                }
+            else:
+                respuestas[campo_intervalo] = {
+                    'success': True, 'sugerencia': str(valor),
+                    'explanation': explicacion, 'question': pregunta,
+                }
+
+        if campo == 'todo':
+            return dict(respuestas, success=True, aplica=True)
+        return respuestas[campo]
+
+SUGGESTION_BACKENDS = {
+    'gemini': GeminiSuggestionBackend,
+    'http': lambda: HttpGeminiSuggestionBackend(GEMINI_API_BASE, GEMINI_API_KEY),
+    'rules': RuleBasedSuggestionBackend,
+}
+
+def create_suggestion_backend(name):
+    if name not in SUGGESTION_BACKENDS:
+        raise ValueError(f"Unknown suggestion backend '{name}'. Valid backends: {', '.join(SUGGESTION_BACKENDS)}")
+    return SUGGESTION_BACKENDS[name]()
+
+suggestion_backend = create_suggestion_backend(SUGGESTION_BACKEND)
+suggestion_fallback = (create_suggestion_backend(SUGGESTION_FALLBACK_BACKEND)
+                       if SUGGESTION_FALLBACK_BACKEND and SUGGESTION_FALLBACK_BACKEND != SUGGESTION_BACKEND
+                       else None)
+
+# --- Suggestion jobs ---
+
+class SuggestionJobs:
+    """Suggestions computed on a dedicated thread pool instead of a request thread.
+
+    submit() returns a job id at once, so slow model calls do not hold the web server's
+    workers. A job goes from 'pending' to 'running' to 'done'; while it runs, 'parcial'
+    holds the model's answer text received so far and every change bumps 'version'.
+    Jobs live in the memory of the process that created them and are forgotten ``ttl``
+    seconds after finishing.
+    """
+
+    def __init__(self, workers, ttl):
+        self.workers = workers
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='suggestion-job')
+        self._changed = threading.Condition()
+        self._jobs = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _purge(self, now):
+        vencidos = [job_id for job_id, job in self._jobs.items()
+                    if job['terminado'] is not None and now - job['terminado'] > self.ttl]
+        for job_id in vencidos:
+            del self._jobs[job_id]
+
+    def submit(self, user_id, vehiculo, tipo_mantenimiento, campo):
+        job = {
+            'job_id': secrets.token_urlsafe(16),
+            'user_id': user_id,
+            'campo': campo,
+            'estado': 'pending',
+            'parcial': '',
+            'resultado': None,
+            'version': 0,
+            'terminado': None,
+        }
+        with self._changed:
+            self._purge(time.time())
+            self._jobs[job['job_id']] = job
+            self.submitted += 1
+        # Rows are tied to their connection's thread; the job gets a plain copy
+        self._executor.submit(self._run, job, dict(vehiculo), tipo_mantenimiento, campo)
+        return job['job_id']
+
+    def _update(self, job, **cambios):
+        with self._changed:
+            job.update(cambios)
+            job['version'] += 1
+            self._changed.notify_all()
+
+    def _run(self, job, vehiculo, tipo_mantenimiento, campo):
+        self._update(job, estado='running')
+        try:
+            with db_pool.connection() as conn:
+                resultado = obtener_sugerencia(conn, vehiculo, tipo_mantenimiento, campo,
+                                               on_text=lambda texto: self._update(job, parcial=texto))
+        except Exception as e:
+            app.logger.warning('Suggestion job %s failed: %s', job['job_id'], e)
+            resultado = {'success': False, 'error': str(e)}
+        with self._changed:
+            self.completed += 1
+            self.failed += not resultado.get('success')
+        self._update(job, estado='done', resultado=resultado, terminado=time.time())
+
+    @staticmethod
+    def _snapshot(job):
+        return {campo: job[campo] for campo in ('job_id', 'campo', 'estado', 'parcial', 'resultado', 'version')}
+
+    def get(self, job_id, user_id):
+        """Current state of a job of user_id, or None if there is no such job."""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None or job['user_id'] != user_id:
+                return None
+            return self._snapshot(job)
+
+    def wait(self, job_id, user_id, version, timeout):
+        """Like get(), but first wait up to ``timeout`` seconds for the job to pass ``version``."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._jobs.get(job_id, {'version': version + 1})['version'] > version,
+                timeout,
+            )
+        return self.get(job_id, user_id)
+
+    def stats(self):
+        with self._changed:
+            estados = [job['estado'] for job in self._jobs.values()]
+            return {
+                'workers': self.workers,
+                'pending': estados.count('pending'),
+                'running': estados.count('running'),
+                'stored': len(estados),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+suggestion_jobs = SuggestionJobs(SUGGESTION_JOB_WORKERS, SUGGESTION_JOB_TTL)
 
-        # Validate that the category is one of the allowed options (in English)
-        categorias_validas = ["Engine", "Brakes", "Transmission", "Suspension", "Electrical", "Tires", "Body", "Cooling"]
+def suggestions_required(view):
+    """Answer with an error instead of running view when the suggestion backend is not configured."""
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        # Gemini needs an API key
+        if not suggestion_backend.available():
+            return jsonify({
+                'success': False,
+                'error': 'AI suggestions are disabled. Gemini API key not configured.'
+            })
+        return view(**kwargs)
+    return wrapped_view
 
-        # Clean up the category response
-        categoria = categoria.strip().title()  # Capitalize first letter
+def cargar_vehiculo(conn, vehiculo_id):
+    """Details of a vehicle the suggestion prompts describe, or None if there is no such vehicle."""
+    return conn.execute('''
+        SELECT d.marca, d.modelo, d.anio, d.tipo, d.tipo_motor, d.tipo_transmision
+        FROM Vehiculo v
+        JOIN Detalle_Vehiculo d ON v.detalle_id = d.id
+        WHERE v.id = ?
+    ''', (vehiculo_id,)).fetchone()
 
-        if categoria not in categorias_validas:
-            # Try fuzzy matching
-            categoria_lower = categoria.lower()
-            mapped = False
+@app.route('/suggest_maintenance', methods=['POST'])
+@login_required
+@suggestions_required
+def sugerir_mantenimiento():
+    try:
+        data = request.get_json()
+        tipo_mantenimiento = data['tipo_mantenimiento']
+        campo = data['campo']
+        vehiculo_id = data['vehiculo_id']
 
-            for valid_cat in categorias_validas:
-                if valid_cat.lower() in categoria_lower or categoria_lower in valid_cat.lower():
-                    categoria = valid_cat
-                    mapped = True
-                    break
+        conn = get_db()
+        vehiculo = cargar_vehiculo(conn, vehiculo_id)
 
-            if not mapped:
-                # Return an error instead of defaulting
-                return jsonify({
-                    'success': False,
-                    'error': f'Unable to determine category for: {tipo_mantenimiento}. AI returned: {categoria}'
-                })
+        if not vehiculo:
+            return jsonify({'success': False, 'error': 'Vehicle not found'})
 
-        return jsonify({'success': True, 'categoria': categoria})
+        return jsonify(obtener_sugerencia(conn, vehiculo, tipo_mantenimiento, campo))
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/suggest_category', methods=['POST'])
+@login_required
+@suggestions_required
+def sugerir_categoria():
+    try:
+        data = request.get_json()
+        tipo_mantenimiento = data['tipo_mantenimiento']
+        vehiculo_id = data['vehiculo_id']
+
+        conn = get_db()
+        vehiculo = cargar_vehiculo(conn, vehiculo_id)
+
+        if not vehiculo:
+            return jsonify({'success': False, 'error': 'Vehicle not found'})
+
+        return jsonify(obtener_sugerencia(conn, vehiculo, tipo_mantenimiento, 'categoria'))
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/suggest_maintenance_all', methods=['POST'])
+@login_required
+@suggestions_required
+def sugerir_mantenimiento_completo():
+    """Miles, months and category suggestions for a maintenance type from one AI call."""
+    try:
+        data = request.get_json()
+        tipo_mantenimiento = data['tipo_mantenimiento']
+        vehiculo_id = data['vehiculo_id']
+
+        conn = get_db()
+        vehiculo = cargar_vehiculo(conn, vehiculo_id)
+
+        if not vehiculo:
+            return jsonify({'success': False, 'error': 'Vehicle not found'})
+
+        return jsonify(obtener_sugerencia(conn, vehiculo, tipo_mantenimiento, 'todo'))
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/suggest_jobs', methods=['POST'])
+@login_required
+@suggestions_required
+def crear_trabajo_sugerencia():
+    """Start a background suggestion job; answers 202 with the URLs to follow it."""
+    try:
+        data = request.get_json()
+        tipo_mantenimiento = data['tipo_mantenimiento']
+        vehiculo_id = data['vehiculo_id']
+        campo = data.get('campo', 'todo')
+        if campo not in ('miles', 'meses', 'categoria', 'todo'):
+            return jsonify({'success': False, 'error': f'Invalid field: {campo}'}), 400
+
+        conn = get_db()
+        vehiculo = cargar_vehiculo(conn, vehiculo_id)
+
+        if not vehiculo:
+            return jsonify({'success': False, 'error': 'Vehicle not found'})
+
+        job_id = suggestion_jobs.submit(g.user['id'], vehiculo, tipo_mantenimiento, campo)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('estado_trabajo_sugerencia', job_id=job_id),
+            'events_url': url_for('eventos_trabajo_sugerencia', job_id=job_id),
+        }), 202
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/suggest_jobs/<job_id>')
+@login_required
+def estado_trabajo_sugerencia(job_id):
+    """Poll a suggestion job: its state, partial answer text and, once done, its result."""
+    job = suggestion_jobs.get(job_id, g.user['id'])
+    if job is None:
+        return jsonify({'success': False, 'error': 'Suggestion job not found'}), 404
+    return jsonify(dict(job, success=True))
+
+@app.route('/suggest_jobs/<job_id>/events')
+@login_required
+def eventos_trabajo_sugerencia(job_id):
+    """Follow a suggestion job as Server-Sent Events.
+
+    A 'progress' event is sent whenever the job's state or partial text changes and a
+    final 'done' event carries the result; comments keep idle connections alive. The
+    stream holds a worker until the job is done, which is why the page polls instead.
+    """
+    user_id = g.user['id']
+    if suggestion_jobs.get(job_id, user_id) is None:
+        return jsonify({'success': False, 'error': 'Suggestion job not found'}), 404
+
+    def eventos():
+        version = -1
+        while True:
+            job = suggestion_jobs.wait(job_id, user_id, version, timeout=15)
+            if job is None:
+                return
+            if job['version'] == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = job['version']
+            evento = 'done' if job['estado'] == 'done' else 'progress'
+            yield f"event: {evento}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if evento == 'done':
+                return
+
+    return Response(eventos(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Add a new route to handle the direct mechanic addition from the index page
 @app.route('/add_mechanic_direct', methods=['POST'])
 @login_required
@@ -911,64 +4403,64 @@ def agregar_mecanico_directo():
         nombre = request.form['nombre']
         telefono = request.form['telefono']
 
-        conn = get_db_connection()
-
-        # Check if mechanic already exists
-        mecanico_existente = conn.execute('''
-            SELECT id FROM Mecánico
-            WHERE nombre_mecanico = ? AND telefono_mecanico = ?
-        ''', (nombre, telefono)).fetchone()
+        nuevo_mecanico = write_transaction(lambda conn: insert_mecanico(conn, nombre, telefono))
 
-        if mecanico_existente:
+        if nuevo_mecanico is None:
             flash('A mechanic with this name and phone already exists', 'warning')
         else:
-            conn.execute('INSERT INTO Mecánico (nombre_mecanico, telefono_mecanico) VALUES (?, ?)',
-                        (nombre, telefono))
-            conn.commit()
             flash('Mechanic added successfully', 'success')
 
-        conn.close()
     except Exception as e:
         flash(f'Error adding mechanic: {str(e)}', 'danger')
 
     return redirect(url_for('index'))
 
+@app.route('/stats')
+@login_required
+def estadisticas():
+    """Cache counters of this worker process, as JSON."""
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'reference_cache': reference_cache.stats(),
+        'history_page_cache': history_page_cache.stats(),
+        'suggestion_cache': suggestion_cache.stats(get_db()),
+        'suggestion_single_flight': suggestion_flight.stats(),
+        'suggestion_backend': suggestion_backend.stats(),
+        'suggestion_fallback': suggestion_fallback.stats() if suggestion_fallback else None,
+        'suggestion_jobs': suggestion_jobs.stats(),
+        'odometer_ingestion': odometer_ingestor.stats(),
+        'write_queue': db_writer.stats() if DB_WRITE_QUEUE else None,
+    })
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         error = None
-        conn = None  # Initialize conn to None
 
         if not username:
             error = 'Se requiere nombre de usuario.'
         elif not password:
             error = 'Se requiere contraseña.'
         else:
-            conn = get_db_connection()
+            password_hash = generate_password_hash(password)
             try:
-                existing_user = conn.execute(
-                    'SELECT id FROM Usuario WHERE username = ?',
-                    (username,)
-                ).fetchone()
+                nuevo_usuario = write_transaction(lambda conn: conn.execute(
+                    'INSERT INTO Usuario (username, password_hash) VALUES (?, ?) '
+                    'ON CONFLICT(username) DO NOTHING RETURNING id',
+                    (username, password_hash)
+                ).fetchone())
 
-                if existing_user:
+                if nuevo_usuario is None:
                     error = f"La cuenta: {username}, ya está registrada."
                 else:
-                    conn.execute(
-                        'INSERT INTO Usuario (username, password_hash) VALUES (?, ?)',
-                        (username, generate_password_hash(password))
-                    )
-                    conn.commit()
+                    user_cache.invalidate(nuevo_usuario['id'])
                     flash('Registration successful! Please login.', 'success')
                     # Redirect to a login page
                     return redirect(url_for('login'))
             except sqlite3.Error as e:
                  error = f"Error de base de datos: {e}"
-            finally:
-                if conn:
-                    conn.close()
 
         if error:
             flash(error, 'danger')
@@ -980,12 +4472,11 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        conn = get_db_connection()
+        conn = get_db()
         error = None
         user = conn.execute(
             'SELECT * FROM Usuario WHERE username = ?', (username,)
         ).fetchone()
-        conn.close()
 
         if user is None:
             error = 'Incorrect username.'
@@ -995,6 +4486,7 @@ def login():
         if error is None:
             session.clear()
             session['user_id'] = user['id']
+            user_cache.invalidate(user['id'])
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard')) # Redirect to dashboard after login
 
@@ -1012,5 +4504,12 @@ def logout():
     flash('You have been logged out.', 'info')
     return redirect(url_for('login'))
 
+if DB_AUTO_MIGRATE and __name__ != '__main__':
+    migrate_db()
+    # Report the effective SQLite settings once per process
+    check_db_settings()
+
 if __name__ == '__main__':
+    migrate_db()
+    check_db_settings()
     app.run()  # Remove debug=True for production
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Import historical maintenance records from a CSV or JSON file.
+
+Files are read incrementally and written in chunks, so large fleet histories can be
+imported with bounded memory. See MaintenanceImporter in flask_app.py for the columns.
+
+Usage:
+    python import_history.py history.csv --dry-run   # validate only, write nothing
+    python import_history.py history.csv
+    python import_history.py history.json --chunk-size 10000
+"""
+
+import argparse
+import sys
+import time
+
+from flask_app import (DB_PATH, IMPORT_CHUNK_SIZE, MaintenanceImporter, get_db_connection,
+                       migrate_db, open_import_records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import maintenance history from CSV or JSON')
+    parser.add_argument('path', help='.csv, .json (array) or .jsonl file')
+    parser.add_argument('--dry-run', action='store_true', help='validate the file without writing')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='rows per transaction')
+    args = parser.parse_args()
+
+    print(f"Database: {DB_PATH}")
+    migrate_db()
+    conn = get_db_connection()
+    inicio = time.perf_counter()
+    try:
+        with open(args.path, encoding='utf-8-sig', newline='') as stream:
+            importer = MaintenanceImporter(conn, chunk_size=args.chunk_size, dry_run=args.dry_run)
+            for avance in importer.import_chunks(open_import_records(stream, args.path)):
+                segundos = time.perf_counter() - inicio
+                print(f"\r{avance['rows']:,} rows  {avance['imported']:,} imported  "
+                      f"{avance['duplicates']:,} duplicates  {avance['invalid']:,} invalid  "
+                      f"({avance['rows'] / segundos:,.0f} rows/s)", end='', file=sys.stderr, flush=True)
+            print(file=sys.stderr)
+    finally:
+        conn.close()
+
+    resumen = importer.summary()
+    print(f"{'Dry run: ' if args.dry_run else ''}{resumen['rows']:,} rows read in "
+          f"{time.perf_counter() - inicio:.1f} s")
+    print(f"  imported: {resumen['imported']:,}  duplicates: {resumen['duplicates']:,}  "
+          f"invalid: {resumen['invalid']:,}")
+    print(f"  created: {resumen['vehicles_created']} vehicles, {resumen['mechanics_created']} mechanics, "
+          f"{resumen['types_created']} maintenance types")
+    for error in resumen['errors']:
+        print(f"  row {error['row']}: {error['error']}")
+    if resumen['invalid'] > len(resumen['errors']):
+        print(f"  ... and {resumen['invalid'] - len(resumen['errors'])} more invalid rows")
+    return 1 if resumen['invalid'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,66 +1,36 @@
-from flask_app import get_db_connection
+#!/usr/bin/env python3
+"""
+Create or upgrade the database schema by applying pending migrations.
 
-with get_db_connection() as conn:
-    conn.executescript('''
-        CREATE TABLE IF NOT EXISTS Detalle_Vehiculo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            marca TEXT NOT NULL,
-            modelo TEXT NOT NULL,
-            anio INTEGER NOT NULL,
-            tipo TEXT,
-            tipo_motor TEXT,
-            tipo_transmision TEXT
-        );
-        
-        CREATE TABLE IF NOT EXISTS Vehiculo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            alias TEXT NOT NULL,
-            detalle_id INTEGER,
-            FOREIGN KEY (detalle_id) REFERENCES Detalle_Vehiculo(id)
-        );
-        
-        CREATE TABLE IF NOT EXISTS Mecánico (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre_mecanico TEXT NOT NULL,
-            telefono_mecanico TEXT
-        );
-        
-        CREATE TABLE IF NOT EXISTS Tipo_Mantenimiento (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            categoria TEXT NOT NULL,
-            meses_proximo_mantenimiento INTEGER,
-            miles_next_maintenance INTEGER,
-            vehiculo_detalle_id INTEGER NOT NULL,
-            FOREIGN KEY (vehiculo_detalle_id) REFERENCES Detalle_Vehiculo(id)
-        );
+Usage:
+    python initialize_db.py           # apply pending migrations
+    python initialize_db.py --status  # show applied and pending migrations
+"""
 
-        CREATE TABLE IF NOT EXISTS Mileage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vehiculo_id INTEGER,
-            fecha DATE NOT NULL,
-            mileage INTEGER NOT NULL,
-            FOREIGN KEY (vehiculo_id) REFERENCES Vehiculo(id)
-        );
+import sys
 
-        CREATE TABLE IF NOT EXISTS Mantenimiento (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vehiculo_id INTEGER,
-            tipo_mantenimiento_id INTEGER,
-            mileage_id INTEGER,
-            mecanico_id INTEGER,
-            fecha_proximo_mantenimiento DATE,
-            precio REAL,
-            FOREIGN KEY (vehiculo_id) REFERENCES Vehiculo(id),
-            FOREIGN KEY (tipo_mantenimiento_id) REFERENCES Tipo_Mantenimiento(id),
-            FOREIGN KEY (mileage_id) REFERENCES Mileage(id),
-            FOREIGN KEY (mecanico_id) REFERENCES Mecánico(id)
-        );
+from flask_app import DB_PATH, SCHEMA_MIGRATIONS, get_db_connection, get_schema_version, migrate_db
 
-        CREATE TABLE IF NOT EXISTS Usuario (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        );
-    ''')
-    conn.commit() 
+
+def show_status():
+    conn = get_db_connection()
+    try:
+        current = get_schema_version(conn)
+    finally:
+        conn.close()
+
+    print(f"Database: {DB_PATH}")
+    print(f"Schema version: {current}")
+    for version, description, _ in SCHEMA_MIGRATIONS:
+        state = 'applied' if version <= current else 'pending'
+        print(f"  {version:>3}  {description:<45} {state}")
+
+
+if __name__ == "__main__":
+    if '--status' not in sys.argv[1:]:
+        applied = migrate_db()
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Database schema is up to date.")
+    show_status()
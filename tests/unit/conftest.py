@@ -0,0 +1,59 @@
+"""
+Pytest fixtures for unit tests that run against a temporary SQLite database.
+"""
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the app at a new database with every migration applied."""
+    path = tmp_path / "mantenimiento.db"
+    monkeypatch.setattr(flask_app, "DB_PATH", path)
+    # Cache_Version numbers start over in every database, so entries cannot carry over
+    monkeypatch.setattr(flask_app, "reference_cache", flask_app.ReferenceCache())
+    monkeypatch.setattr(flask_app, "history_page_cache", flask_app.ReferenceCache(max_entries=8))
+    monkeypatch.setattr(flask_app, "user_cache", flask_app.UserCache(flask_app.USER_CACHE_TTL))
+    flask_app.migrate_db()
+    yield path
+    # Pooled connections still point at this test's database
+    flask_app.db_pool.close_all()
+    flask_app.db_read_pool.close_all()
+
+
+@pytest.fixture
+def conn(db_path):
+    """A read-write connection to the test database."""
+    conn = flask_app.get_db_connection()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def add_vehicle(conn):
+    """Factory inserting a vehicle with its details; returns (vehiculo_id, detalle_id)."""
+
+    def add(alias, marca="Toyota", modelo="Corolla", anio=2020):
+        with flask_app.transaction(conn):
+            detalle_id = conn.execute(
+                "INSERT INTO Detalle_Vehiculo (marca, modelo, anio) VALUES (?, ?, ?)",
+                (marca, modelo, anio),
+            ).lastrowid
+            vehiculo_id = conn.execute(
+                "INSERT INTO Vehiculo (alias, detalle_id) VALUES (?, ?)", (alias, detalle_id)
+            ).lastrowid
+        return vehiculo_id, detalle_id
+
+    return add
+
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    """A test client logged in as a newly registered user."""
+    monkeypatch.setattr(flask_app.app, "secret_key", "test")
+    client = flask_app.app.test_client()
+    client.post("/register", data={"username": "tester", "password": "secret"})
+    response = client.post("/login", data={"username": "tester", "password": "secret"})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,120 @@
+"""
+Unit tests for the columnar analytics export: iter_analytics_batches and export_analytics.py.
+"""
+import json
+
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def servicios(conn, add_vehicle):
+    """Function recording n more oil changes of one vehicle; returns their ids."""
+    vehiculo_id, detalle_id = add_vehicle("Corolla")
+    with flask_app.transaction(conn):
+        mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+        tipo_id = conn.execute("""
+            INSERT INTO Tipo_Mantenimiento (nombre, categoria, miles_next_maintenance, vehiculo_detalle_id)
+            VALUES ('Cambio de Aceite', 'Motor', 5000, ?)
+        """, (detalle_id,)).lastrowid
+    registrados = []
+
+    def registrar(n):
+        with flask_app.transaction(conn):
+            for _ in range(n):
+                i = len(registrados) + 1
+                fecha = f"2024-01-{i:02d}"
+                mileage_id = flask_app.upsert_mileage(conn, vehiculo_id, fecha, 1000 * i)
+                registrados.append(flask_app.insert_mantenimiento(
+                    conn, vehiculo_id, tipo_id, mileage_id, mecanico_id, fecha, 50))
+        return registrados[-n:]
+
+    return registrar
+
+
+class TestIterAnalyticsBatches:
+    """Tests for iter_analytics_batches."""
+
+    def test_batches_in_id_order(self, conn, servicios):
+        servicios(5)
+
+        lotes = list(flask_app.iter_analytics_batches(conn, batch_size=2))
+
+        assert [len(lote) for lote in lotes] == [2, 2, 1]
+        ids = [row["maintenance_id"] for lote in lotes for row in lote]
+        assert ids == sorted(ids)
+
+    def test_rows_after_the_watermark(self, conn, servicios):
+        servicios(3)
+
+        (lote,) = flask_app.iter_analytics_batches(conn, desde_id=2)
+
+        assert [row["maintenance_id"] for row in lote] == [3]
+        assert lote[0]["mileage"] == 3000
+        assert lote[0]["next_due_mileage"] == 8000
+        assert lote[0]["maintenance_type"] == flask_app.MAINTENANCE_TYPE_TRANSLATIONS["Cambio de Aceite"]
+
+
+class TestExportAnalytics:
+    """Tests for the export_analytics.py command."""
+
+    @pytest.fixture
+    def exportar(self, db_path, tmp_path, monkeypatch):
+        pytest.importorskip("pyarrow")
+        import export_analytics
+        directorio = tmp_path / "analytics"
+
+        def exportar(*args):
+            monkeypatch.setattr("sys.argv", ["export_analytics.py", str(directorio), *args])
+            assert export_analytics.main() == 0
+            return json.loads((directorio / export_analytics.STATE_FILE).read_text())
+
+        exportar.directorio = directorio
+        return exportar
+
+    def leer(self, directorio):
+        import pyarrow.dataset as ds
+        return ds.dataset(directorio, format="parquet").to_table().sort_by("maintenance_id")
+
+    def test_incremental_export_appends_new_records(self, exportar, servicios):
+        servicios(3)
+        estado = exportar("--incremental")
+        assert (estado["watermark"], estado["rows"], len(estado["files"])) == (3, 3, 1)
+
+        nuevos = servicios(2)
+        estado = exportar("--incremental")
+
+        assert (estado["watermark"], estado["rows"], len(estado["files"])) == (nuevos[-1], 5, 2)
+        assert estado["files"][1]["first_id"] == 4
+        assert self.leer(exportar.directorio).column("maintenance_id").to_pylist() == [1, 2, 3, 4, 5]
+
+    def test_nothing_new_writes_no_file(self, exportar, servicios):
+        servicios(1)
+        exportar("--incremental")
+
+        estado = exportar("--incremental")
+
+        assert len(estado["files"]) == 1
+        assert len(list(exportar.directorio.glob("*.parquet"))) == 1
+
+    def test_full_export_replaces_the_dataset(self, exportar, servicios):
+        servicios(2)
+        exportar("--incremental")
+        servicios(1)
+        exportar("--incremental")
+
+        estado = exportar()
+
+        assert (estado["watermark"], estado["rows"], len(estado["files"])) == (3, 3, 1)
+        assert [p.name for p in exportar.directorio.glob("*.parquet")] == [estado["files"][0]["file"]]
+        tabla = self.leer(exportar.directorio)
+        assert str(tabla.schema.field("service_date").type) == "date32[day]"
+
+    def test_incremental_export_keeps_the_format(self, exportar, servicios, monkeypatch):
+        import export_analytics
+        servicios(1)
+        exportar("--format", "arrow")
+
+        monkeypatch.setattr("sys.argv", ["export_analytics.py", str(exportar.directorio), "--incremental"])
+        assert export_analytics.main() == 2
@@ -0,0 +1,115 @@
+"""
+Unit tests for the connection pools: ConnectionPool reuse and release, and the routing
+of requests to the read-only or the read-write pool.
+"""
+import sqlite3
+
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def pool(db_path):
+    pool = flask_app.ConnectionPool(2)
+    yield pool
+    pool.close_all()
+
+
+class TestConnectionPool:
+    """Tests for ConnectionPool."""
+
+    def test_released_connection_is_reused(self, pool):
+        conn = pool.acquire()
+        pool.release(conn)
+
+        assert pool.acquire() is conn
+
+    def test_connections_beyond_the_size_are_closed(self, pool):
+        conns = [pool.acquire() for _ in range(3)]
+        for conn in conns:
+            pool.release(conn)
+
+        with pytest.raises(sqlite3.ProgrammingError):
+            conns[2].execute("SELECT 1")
+        assert {pool.acquire(), pool.acquire()} == set(conns[:2])
+
+    def test_open_transaction_is_rolled_back_on_release(self, pool, conn):
+        prestada = pool.acquire()
+        prestada.execute("INSERT INTO Mecánico (nombre_mecanico) VALUES ('a medias')")
+        assert prestada.in_transaction
+
+        pool.release(prestada)
+
+        assert not prestada.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM Mecánico").fetchone()[0] == 0
+
+    def test_connection_context_returns_it_to_the_pool(self, pool):
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+
+        assert pool.acquire() is conn
+
+    def test_request_connection_is_released_at_teardown(self, db_path):
+        with flask_app.app.test_request_context("/", method="POST"):
+            conn = flask_app.get_db()
+            assert flask_app.get_db() is conn
+
+        assert flask_app.db_pool.acquire() is conn
+
+
+def query_only(conn):
+    return conn.execute("PRAGMA query_only").fetchone()[0]
+
+
+class TestReadOnlyRouting:
+    """get_db() serves GET, HEAD and OPTIONS requests from the read-only pool."""
+
+    @pytest.mark.parametrize("metodo", flask_app.READ_ONLY_METHODS)
+    def test_reads_get_a_read_only_connection(self, db_path, metodo):
+        with flask_app.app.test_request_context("/", method=metodo):
+            conn = flask_app.get_db()
+            assert query_only(conn) == 1
+            with pytest.raises(sqlite3.OperationalError, match="readonly"):
+                conn.execute("INSERT INTO Mecánico (nombre_mecanico) VALUES ('Taller')")
+
+        assert flask_app.db_read_pool.acquire() is conn
+
+    @pytest.mark.parametrize("metodo", ["POST", "PUT", "DELETE"])
+    def test_writes_get_a_read_write_connection(self, db_path, metodo):
+        with flask_app.app.test_request_context("/", method=metodo):
+            conn = flask_app.get_db()
+            assert query_only(conn) == 0
+            conn.execute("INSERT INTO Mecánico (nombre_mecanico) VALUES ('Taller')")
+            conn.rollback()
+
+    def test_get_request_can_ask_for_a_write_connection(self, db_path):
+        with flask_app.app.test_request_context("/"):
+            lectura, escritura = flask_app.get_read_db(), flask_app.get_write_db()
+
+            assert lectura is not escritura
+            assert query_only(escritura) == 0
+
+        assert flask_app.db_pool.acquire() is escritura
+        assert flask_app.db_read_pool.acquire() is lectura
+
+    def test_read_connection_sees_later_commits(self, db_path, conn):
+        with flask_app.app.test_request_context("/"):
+            assert flask_app.get_db().execute("SELECT COUNT(*) FROM Mecánico").fetchone()[0] == 0
+
+        with flask_app.transaction(conn):
+            conn.execute("INSERT INTO Mecánico (nombre_mecanico) VALUES ('Taller')")
+
+        with flask_app.app.test_request_context("/"):
+            assert flask_app.get_db().execute("SELECT COUNT(*) FROM Mecánico").fetchone()[0] == 1
+
+    def test_pages_are_served_without_a_write_connection(self, client, add_vehicle, monkeypatch):
+        vehiculo_id, _ = add_vehicle("Corolla")
+
+        def acquire():
+            raise AssertionError("GET request borrowed a read-write connection")
+
+        monkeypatch.setattr(flask_app.db_pool, "acquire", acquire)
+        for url in ("/dashboard", f"/maintenance/{vehiculo_id}", f"/maintenance/{vehiculo_id}/history",
+                    "/fleet/due"):
+            assert client.get(url).status_code == 200, url
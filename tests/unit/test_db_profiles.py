@@ -0,0 +1,53 @@
+"""
+Unit tests for the SQLite performance profiles applied to every connection.
+"""
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def profile(tmp_path, monkeypatch):
+    """Function selecting a profile for connections to a new database."""
+    monkeypatch.setattr(flask_app, "DB_PATH", tmp_path / "mantenimiento.db")
+
+    def select(nombre):
+        monkeypatch.setattr(flask_app, "DB_PROFILE", nombre)
+        return flask_app.DB_PROFILES[nombre]
+
+    return select
+
+
+def pragma(conn, nombre):
+    return conn.execute(f"PRAGMA {nombre}").fetchone()[0]
+
+
+class TestDbProfiles:
+    """Tests for apply_db_profile, get_db_profile and check_db_settings."""
+
+    @pytest.mark.parametrize("nombre", ["safe", "balanced", "fast"])
+    def test_connection_gets_the_profile_settings(self, profile, nombre):
+        settings = profile(nombre)
+        conn = flask_app.get_db_connection()
+        try:
+            assert pragma(conn, "journal_mode") == settings["journal_mode"]
+            assert pragma(conn, "synchronous") == flask_app._SYNCHRONOUS_VALUES[settings["synchronous"]]
+            assert pragma(conn, "busy_timeout") == settings["busy_timeout"]
+            assert pragma(conn, "cache_size") == settings["cache_size"]
+            assert pragma(conn, "temp_store") == flask_app._TEMP_STORE_VALUES[settings["temp_store"]]
+        finally:
+            conn.close()
+
+    @pytest.mark.parametrize("nombre", ["safe", "balanced", "fast"])
+    def test_startup_check_finds_no_mismatches(self, profile, nombre):
+        profile(nombre)
+
+        resultado = flask_app.check_db_settings()
+
+        assert resultado["profile"] == nombre
+        assert resultado["mismatches"] == []
+
+    def test_unknown_profile_is_rejected(self, profile):
+        profile("balanced")
+        with pytest.raises(ValueError, match="Unknown DB_PROFILE 'turbo'. Valid profiles: safe, balanced, fast"):
+            flask_app.get_db_profile("turbo")
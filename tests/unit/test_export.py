@@ -0,0 +1,137 @@
+"""
+Unit tests for the streamed CSV and XLSX history exports.
+"""
+import csv
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import flask_app
+
+NS = {"x": flask_app._XLSX_MAIN_NS}
+
+
+@pytest.fixture
+def flota(conn, add_vehicle):
+    """Two vehicles with two services each, recorded out of date order."""
+    corolla, detalle_corolla = add_vehicle("Corolla")
+    hilux, detalle_hilux = add_vehicle("Camión ñ", modelo="Hilux")
+    with flask_app.transaction(conn):
+        mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+        for vehiculo_id, detalle_id, servicios in (
+            (corolla, detalle_corolla, [("2024-03-01", 3000, 45.5), ("2024-01-01", 1000, 40)]),
+            (hilux, detalle_hilux, [("2024-02-01", 2000, 80), ("2024-04-01", 4000, 90)]),
+        ):
+            tipo_id = conn.execute("""
+                INSERT INTO Tipo_Mantenimiento (nombre, categoria, miles_next_maintenance, vehiculo_detalle_id)
+                VALUES ('Cambio de Aceite', 'Motor', 5000, ?)
+            """, (detalle_id,)).lastrowid
+            for fecha, mileage, precio in servicios:
+                mileage_id = flask_app.upsert_mileage(conn, vehiculo_id, fecha, mileage)
+                flask_app.insert_mantenimiento(conn, vehiculo_id, tipo_id, mileage_id, mecanico_id, fecha, precio)
+    return corolla, hilux
+
+
+def leer_csv(datos):
+    assert datos.startswith("﻿".encode("utf-8"))
+    return list(csv.reader(io.StringIO(datos.decode("utf-8-sig"))))
+
+
+def leer_xlsx(datos):
+    """Rows of the worksheet as lists of (type, value) cells."""
+    with zipfile.ZipFile(io.BytesIO(datos)) as libro:
+        assert libro.testzip() is None
+        hoja = ET.fromstring(libro.read("xl/worksheets/sheet1.xml"))
+    filas = []
+    for fila in hoja.iterfind("x:sheetData/x:row", NS):
+        celdas = []
+        for celda in fila:
+            texto = celda.find("x:is/x:t", NS)
+            valor = celda.find("x:v", NS)
+            celdas.append(texto.text if texto is not None else valor.text if valor is not None else None)
+        filas.append(celdas)
+    return filas
+
+
+class TestStreamHistoryCsv:
+    """Tests for stream_history_csv."""
+
+    def test_rows_are_written_in_batches(self, monkeypatch):
+        monkeypatch.setattr(flask_app, "EXPORT_BATCH_ROWS", 2)
+        columnas = [("Mileage", "mileage", "mileage")]
+
+        chunks = list(flask_app.stream_history_csv(({"mileage": n} for n in range(5)), columnas))
+
+        assert len(chunks) == 3
+        assert leer_csv(b"".join(chunks)) == [["Mileage"], ["0"], ["1"], ["2"], ["3"], ["4"]]
+
+
+class TestStreamHistoryXlsx:
+    """Tests for stream_history_xlsx."""
+
+    COLUMNAS = [("Date", "fecha", "fecha_iso"), ("Price", "precio", "precio"), ("Note", "nota", "nota")]
+
+    def test_cells_get_dates_numbers_and_text(self):
+        filas = [{"fecha_iso": "2024-01-01", "precio": 45.5, "nota": "a < b\x01"},
+                 {"fecha_iso": None, "precio": 10, "nota": ""}]
+
+        datos = b"".join(flask_app.stream_history_xlsx(iter(filas), self.COLUMNAS))
+
+        assert leer_xlsx(datos) == [["Date", "Price", "Note"], ["45292", "45.5", "a < b"], [None, "10", None]]
+
+    def test_rows_are_written_in_batches(self, monkeypatch):
+        monkeypatch.setattr(flask_app, "EXPORT_BATCH_ROWS", 2)
+        filas = [{"fecha_iso": "2024-01-01", "precio": n, "nota": "x"} for n in range(5)]
+
+        chunks = list(flask_app.stream_history_xlsx(iter(filas), self.COLUMNAS))
+
+        # Static parts, two full batches, then the rest and the zip directory
+        assert len(chunks) == 4
+        assert [fila[1] for fila in leer_xlsx(b"".join(chunks))[1:]] == ["0", "1", "2", "3", "4"]
+
+
+class TestExportRoutes:
+    """Tests for /maintenance/<id>/export.<formato> and /export/history.<formato>."""
+
+    def test_vehicle_csv(self, client, flota):
+        corolla, _ = flota
+
+        respuesta = client.get(f"/maintenance/{corolla}/export.csv")
+
+        assert respuesta.mimetype == "text/csv"
+        assert 'filename="maintenance_Corolla.csv"' in respuesta.headers["Content-Disposition"]
+        filas = leer_csv(respuesta.data)
+        assert filas[0] == [header for header, _, _ in flask_app.EXPORT_COLUMNS]
+        assert [(fila[0], fila[1], fila[5]) for fila in filas[1:]] == [
+            ("01/01/2024", "1000", "40.0"), ("01/03/2024", "3000", "45.5")]
+
+    def test_fleet_xlsx_names_the_vehicles(self, client, flota):
+        filas = leer_xlsx(client.get("/export/history.xlsx").data)
+
+        assert filas[0][:2] == ["Vehicle", "Date"]
+        assert [(fila[0], fila[2]) for fila in filas[1:]] == [
+            ("Corolla", "1000"), ("Corolla", "3000"), ("Camión ñ", "2000"), ("Camión ñ", "4000")]
+
+    def test_filters(self, client, flota):
+        filas = leer_csv(client.get("/export/history.csv", query_string={"search": "4000"}).data)
+
+        assert [fila[2] for fila in filas[1:]] == ["4000"]
+
+    def test_non_ascii_file_name(self, client, flota):
+        _, hilux = flota
+
+        disposicion = client.get(f"/maintenance/{hilux}/export.xlsx").headers["Content-Disposition"]
+
+        assert "filename*=UTF-8''maintenance_Cami%C3%B3n%20%C3%B1.xlsx" in disposicion
+
+    @pytest.mark.parametrize("url, error", [
+        ("/export/history.pdf", "Unsupported export format"),
+        ("/maintenance/999/export.csv", "Vehicle not found"),
+    ])
+    def test_not_found(self, client, url, error):
+        respuesta = client.get(url)
+
+        assert respuesta.status_code == 404
+        assert respuesta.get_json() == {"error": error}
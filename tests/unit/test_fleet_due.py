@@ -0,0 +1,92 @@
+"""
+Unit tests for the fleet overview: get_fleet_due over Ultimo_Mileage and Proximo_Mantenimiento.
+"""
+from datetime import date
+
+import pytest
+
+import flask_app
+
+HOY = date(2024, 6, 1)
+
+
+def add_service(conn, vehiculo_id, detalle_id, nombre, fecha, mileage, meses=None, millas=None):
+    """Record a service of a new maintenance type with the given intervals."""
+    with flask_app.transaction(conn):
+        tipo_id = conn.execute("""
+            INSERT INTO Tipo_Mantenimiento
+            (nombre, categoria, miles_next_maintenance, meses_proximo_mantenimiento, vehiculo_detalle_id)
+            VALUES (?, 'Motor', ?, ?, ?)
+        """, (nombre, millas, meses, detalle_id)).lastrowid
+        mecanico = flask_app.insert_mecanico(conn, "Taller", "")
+        mecanico_id = mecanico["id"] if mecanico else conn.execute("SELECT id FROM Mecánico").fetchone()[0]
+        mileage_id = flask_app.upsert_mileage(conn, vehiculo_id, fecha, mileage)
+        flask_app.insert_mantenimiento(conn, vehiculo_id, tipo_id, mileage_id, mecanico_id, fecha, 50)
+
+
+@pytest.fixture
+def flota(conn, add_vehicle):
+    """A vehicle at 20000 miles with one item in each state, and one without services.
+
+    Due soon means within 30 days of HOY or 1000 miles of the latest reading.
+    """
+    vehiculo_id, detalle_id = add_vehicle("Hilux")
+    add_service(conn, vehiculo_id, detalle_id, "Aceite", "2024-01-15", 10000, meses=3)
+    add_service(conn, vehiculo_id, detalle_id, "Frenos", "2023-12-10", 9000, meses=6)
+    add_service(conn, vehiculo_id, detalle_id, "Filtro", "2024-02-01", 14000, millas=5000)
+    add_service(conn, vehiculo_id, detalle_id, "Llantas", "2024-02-02", 14500, millas=6000)
+    add_service(conn, vehiculo_id, detalle_id, "Bujias", "2024-02-03", 15000, meses=24, millas=50000)
+    with flask_app.transaction(conn):
+        flask_app.upsert_mileage(conn, vehiculo_id, "2024-05-01", 20000)
+    add_vehicle("Nuevo")
+    return vehiculo_id
+
+
+def fleet_due(conn):
+    return flask_app.get_fleet_due(conn, dias=30, millas=1000, hoy=HOY)
+
+
+class TestFleetDue:
+    """Tests for get_fleet_due."""
+
+    def test_counts_by_date_and_mileage(self, conn, flota):
+        hilux, nuevo = fleet_due(conn)
+
+        assert (hilux["alias"], hilux["mileage"], hilux["fecha_lectura"]) == ("Hilux", 20000, "2024-05-01")
+        assert hilux["conteos"] == {"overdue_fecha": 1, "overdue_mileage": 1,
+                                    "upcoming_fecha": 1, "upcoming_mileage": 1}
+        assert nuevo["conteos"] == {"overdue_fecha": 0, "overdue_mileage": 0,
+                                    "upcoming_fecha": 0, "upcoming_mileage": 0}
+        assert (nuevo["overdue"], nuevo["upcoming"], nuevo["mileage"]) == ([], [], None)
+
+    def test_items_are_listed_by_state(self, conn, flota):
+        hilux = fleet_due(conn)[0]
+
+        overdue = {item["tipo_mantenimiento"]: (item["estado_fecha"], item["estado_mileage"])
+                   for item in hilux["overdue"]}
+        upcoming = {item["tipo_mantenimiento"]: (item["estado_fecha"], item["estado_mileage"])
+                    for item in hilux["upcoming"]}
+        assert overdue == {"Aceite": ("overdue", None), "Filtro": (None, "overdue")}
+        assert upcoming == {"Frenos": ("upcoming", None), "Llantas": (None, "upcoming")}
+
+    def test_item_due_by_both_criteria_counts_once_per_criterion(self, conn, flota):
+        with flask_app.transaction(conn):
+            conn.execute("""
+                UPDATE Tipo_Mantenimiento SET meses_proximo_mantenimiento = 3 WHERE nombre = 'Filtro'
+            """)
+
+        hilux = fleet_due(conn)[0]
+
+        assert hilux["conteos"]["overdue_fecha"] == 2
+        assert hilux["conteos"]["overdue_mileage"] == 1
+        assert [item["tipo_mantenimiento"] for item in hilux["overdue"]].count("Filtro") == 1
+
+    def test_endpoint(self, client, flota):
+        respuesta = client.get("/fleet/due", query_string={"days": 30, "miles": 1000}).get_json()
+
+        assert respuesta["success"]
+        assert [v["alias"] for v in respuesta["vehiculos"]] == ["Hilux", "Nuevo"]
+
+    @pytest.mark.parametrize("params", [{"days": "x"}, {"miles": -1}])
+    def test_invalid_window_is_rejected(self, client, params):
+        assert client.get("/fleet/due", query_string=params).status_code == 400
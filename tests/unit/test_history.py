@@ -0,0 +1,143 @@
+"""
+Unit tests for the maintenance history endpoint and its page cache.
+"""
+import pytest
+
+import flask_app
+
+
+def add_services(conn, vehiculo_id, detalle_id, n):
+    """Record n oil changes of a vehicle, 1000 miles apart."""
+    with flask_app.transaction(conn):
+        mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+        tipo_id = conn.execute("""
+            INSERT INTO Tipo_Mantenimiento (nombre, categoria, miles_next_maintenance, vehiculo_detalle_id)
+            VALUES ('Cambio de Aceite', 'Motor', 5000, ?)
+        """, (detalle_id,)).lastrowid
+        for i in range(n):
+            fecha = f"2024-{i % 12 + 1:02d}-{i // 12 + 1:02d}"
+            mileage_id = flask_app.upsert_mileage(conn, vehiculo_id, fecha, 1000 * (i + 1))
+            flask_app.insert_mantenimiento(conn, vehiculo_id, tipo_id, mileage_id, mecanico_id, fecha, 50)
+
+
+def page(client, vehiculo_id, **params):
+    return client.get(f"/maintenance/{vehiculo_id}/history", query_string=params).get_json()
+
+
+class TestHistoryPageCache:
+    """History pages are cached apart from the reference lists."""
+
+    def test_pages_do_not_evict_reference_lists(self, client, conn, add_vehicle):
+        vehiculo_id, detalle_id = add_vehicle("Corolla")
+        add_services(conn, vehiculo_id, detalle_id, 3)
+        client.get(f"/maintenance/{vehiculo_id}")
+
+        # More distinct searches than the page cache holds
+        for i in range(20):
+            page(client, vehiculo_id, **{"search[value]": f"busqueda {i}"})
+
+        assert flask_app.history_page_cache.stats()["entries"] == 8
+        client.get(f"/maintenance/{vehiculo_id}")
+        stats = flask_app.reference_cache.stats()
+        assert stats["historial_filtros"]["hits"] == 1
+        assert "historial" not in stats
+
+    def test_cached_page_is_reloaded_after_a_save(self, client, conn, add_vehicle):
+        vehiculo_id, detalle_id = add_vehicle("Corolla")
+        add_services(conn, vehiculo_id, detalle_id, 2)
+        assert page(client, vehiculo_id, length=10)["recordsTotal"] == 2
+        assert page(client, vehiculo_id, length=10)["recordsTotal"] == 2
+
+        with flask_app.transaction(conn):
+            tipo_id = conn.execute("SELECT id FROM Tipo_Mantenimiento").fetchone()[0]
+            mileage_id = flask_app.upsert_mileage(conn, vehiculo_id, "2024-12-01", 9000)
+            flask_app.insert_mantenimiento(conn, vehiculo_id, tipo_id, mileage_id, 1, "2024-12-01", 60)
+
+        assert page(client, vehiculo_id, length=10)["recordsTotal"] == 3
+        assert flask_app.history_page_cache.stats()["historial"] == {"hits": 1, "misses": 2, "hit_ratio": 0.333}
+
+
+class TestHistoryEndpoint:
+    """Tests for the DataTables paging, filters and sorting of /maintenance/<id>/history."""
+
+    @pytest.fixture
+    def vehiculo_id(self, conn, add_vehicle):
+        vehiculo_id, detalle_id = add_vehicle("Corolla")
+        add_services(conn, vehiculo_id, detalle_id, 5)
+        return vehiculo_id
+
+    def test_pages_are_newest_first(self, client, vehiculo_id):
+        respuesta = page(client, vehiculo_id, draw=3, start=2, length=2)
+
+        assert respuesta["draw"] == 3
+        assert respuesta["recordsTotal"] == respuesta["recordsFiltered"] == 5
+        assert [row["mileage"] for row in respuesta["data"]] == [3000, 2000]
+
+    def test_order_column(self, client, vehiculo_id):
+        respuesta = page(client, vehiculo_id, length=5, **{
+            "order[0][column]": "1", "columns[1][data]": "mileage", "order[0][dir]": "asc"})
+
+        assert [row["mileage"] for row in respuesta["data"]] == [1000, 2000, 3000, 4000, 5000]
+
+    def test_unknown_order_column_sorts_by_date(self, client, vehiculo_id):
+        respuesta = page(client, vehiculo_id, length=5, **{
+            "order[0][column]": "0", "columns[0][data]": "id; DROP TABLE Mantenimiento", "order[0][dir]": "asc"})
+
+        assert respuesta["data"][0]["fecha_iso"] == "2024-01-01"
+
+    @pytest.mark.parametrize("scope, mileages", [("latest", [5000]), ("repeated", [4000, 3000, 2000, 1000])])
+    def test_scope(self, client, vehiculo_id, scope, mileages):
+        respuesta = page(client, vehiculo_id, scope=scope)
+
+        assert respuesta["recordsTotal"] == len(mileages)
+        assert [row["mileage"] for row in respuesta["data"]] == mileages
+
+    def test_search_counts_filtered_rows(self, client, vehiculo_id):
+        respuesta = page(client, vehiculo_id, **{"search[value]": " 4000 "})
+
+        assert respuesta["recordsTotal"] == 5
+        assert respuesta["recordsFiltered"] == 1
+        assert respuesta["data"][0]["mileage"] == 4000
+
+    def test_search_wildcards_are_literal(self, client, vehiculo_id):
+        assert page(client, vehiculo_id, **{"search[value]": "%"})["recordsFiltered"] == 0
+
+    def test_filters_use_the_translated_values(self, client, vehiculo_id):
+        tipo = page(client, vehiculo_id)["data"][0]["tipo_mantenimiento"]
+
+        assert page(client, vehiculo_id, tipo=tipo)["recordsFiltered"] == 5
+        assert page(client, vehiculo_id, tipo="Frenos")["recordsFiltered"] == 0
+
+    def test_invalid_paging_parameters(self, client, vehiculo_id):
+        respuesta = client.get(f"/maintenance/{vehiculo_id}/history", query_string={"start": "uno"})
+
+        assert respuesta.status_code == 400
+        assert respuesta.get_json() == {"error": "Invalid paging parameters"}
+
+
+class TestHistoryFilterCache:
+    """The filter dropdowns of the history page are cached until the history changes."""
+
+    def test_filters_reload_after_a_mechanic_is_renamed(self, client, conn, add_vehicle):
+        vehiculo_id, detalle_id = add_vehicle("Corolla")
+        add_services(conn, vehiculo_id, detalle_id, 1)
+        assert "Workshop" in client.get(f"/maintenance/{vehiculo_id}").get_data(as_text=True)
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mecánico SET nombre_mecanico = 'Lubricentro'")
+
+        pagina = client.get(f"/maintenance/{vehiculo_id}").get_data(as_text=True)
+        assert "Lubricentro" in pagina and "Workshop" not in pagina
+        assert flask_app.reference_cache.stats()["historial_filtros"]["misses"] == 2
+
+    def test_other_vehicles_keep_their_filters(self, client, conn, add_vehicle):
+        corolla, detalle_id = add_vehicle("Corolla")
+        hilux, _ = add_vehicle("Hilux", modelo="Hilux")
+        add_services(conn, corolla, detalle_id, 1)
+        client.get(f"/maintenance/{hilux}")
+
+        with flask_app.transaction(conn):
+            flask_app.upsert_mileage(conn, corolla, "2024-06-01", 8000)
+        client.get(f"/maintenance/{hilux}")
+
+        assert flask_app.reference_cache.stats()["historial_filtros"] == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
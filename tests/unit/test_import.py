@@ -0,0 +1,150 @@
+"""
+Unit tests for the maintenance history import: MaintenanceImporter and the record readers.
+"""
+import io
+import json
+
+import pytest
+
+import flask_app
+
+
+def fila(**cambios):
+    """A valid import row for a new vehicle, with the given columns changed."""
+    fila = {
+        "vehiculo": "Hilux", "marca": "Toyota", "modelo": "Hilux", "anio": "2018",
+        "fecha": "2024-01-15", "mileage": "12000", "tipo_mantenimiento": "Cambio de Aceite",
+        "categoria": "Motor", "miles_next_maintenance": "5000", "mecanico": "Taller Central",
+        "precio": "45.5",
+    }
+    fila.update(cambios)
+    return fila
+
+
+def contar(conn, tabla):
+    return conn.execute(f'SELECT COUNT(*) FROM "{tabla}"').fetchone()[0]
+
+
+class TestMaintenanceImporter:
+    """Tests for MaintenanceImporter."""
+
+    def test_creates_references_once(self, conn):
+        filas = [fila(), fila(fecha="2024-06-15", mileage="17000"), fila(fecha="20/12/2024", mileage="22000")]
+
+        resumen = flask_app.MaintenanceImporter(conn, chunk_size=2).run(filas)
+
+        assert (resumen["imported"], resumen["duplicates"], resumen["invalid"]) == (3, 0, 0)
+        assert (resumen["vehicles_created"], resumen["mechanics_created"], resumen["types_created"]) == (1, 1, 1)
+        assert contar(conn, "Mantenimiento") == 3
+        assert conn.execute("SELECT MAX(fecha) FROM Mileage").fetchone()[0] == "2024-12-20"
+
+    def test_rows_already_recorded_are_duplicates(self, conn):
+        flask_app.MaintenanceImporter(conn).run([fila()])
+
+        # Again, and twice within one chunk
+        resumen = flask_app.MaintenanceImporter(conn).run([fila(), fila(mileage="13000"), fila(mileage="13000")])
+
+        assert (resumen["imported"], resumen["duplicates"], resumen["invalid"]) == (1, 2, 0)
+        assert resumen["vehicles_created"] == 0
+        assert contar(conn, "Mantenimiento") == 2
+        assert contar(conn, "Mileage") == 2
+
+    @pytest.mark.parametrize("cambios, error", [
+        ({"fecha": "2024-13-01"}, "Invalid fecha: 2024-13-01"),
+        ({"mileage": "-5"}, "Invalid mileage: -5"),
+        ({"precio": "gratis"}, "Invalid precio: gratis"),
+        ({"precio": "0"}, "Invalid precio: 0.0"),
+        ({"anio": ""}, "Missing anio"),
+        ({"categoria": None}, "Missing categoria"),
+        ({"miles_next_maintenance": "cada 5000"}, "Invalid miles_next_maintenance: cada 5000"),
+        ({"mecanico": ""}, "Missing mecanico"),
+    ])
+    def test_invalid_rows_are_reported_and_leave_nothing_behind(self, conn, cambios, error):
+        resumen = flask_app.MaintenanceImporter(conn).run([fila(**cambios)])
+
+        assert (resumen["imported"], resumen["invalid"]) == (0, 1)
+        assert resumen["errors"] == [{"row": 1, "error": error}]
+        assert (resumen["vehicles_created"], resumen["mechanics_created"], resumen["types_created"]) == (0, 0, 0)
+        for tabla in ("Vehiculo", "Detalle_Vehiculo", "Mecánico", "Tipo_Mantenimiento", "Mileage"):
+            assert contar(conn, tabla) == 0, tabla
+
+    def test_invalid_rows_do_not_stop_the_chunk(self, conn):
+        filas = [fila(), fila(mileage="abc"), fila(fecha="2024-02-01", mileage="13000")]
+
+        resumen = flask_app.MaintenanceImporter(conn, chunk_size=10).run(filas)
+
+        assert (resumen["imported"], resumen["invalid"]) == (2, 1)
+        assert resumen["errors"] == [{"row": 2, "error": "Invalid mileage: abc"}]
+
+    def test_existing_references_need_no_details(self, conn):
+        flask_app.MaintenanceImporter(conn).run([fila()])
+
+        resumen = flask_app.MaintenanceImporter(conn).run([{
+            "Vehicle": "hilux", "Date": "2024-02-01", "Mileage": "13000",
+            "Maintenance Type": "Oil Change", "Mechanic": "taller central", "Price": "30",
+        }])
+
+        assert (resumen["imported"], resumen["invalid"]) == (1, 0), resumen["errors"]
+        assert (resumen["vehicles_created"], resumen["mechanics_created"], resumen["types_created"]) == (0, 0, 0)
+
+    def test_dry_run_writes_nothing(self, conn):
+        resumen = flask_app.MaintenanceImporter(conn, dry_run=True).run([fila(), fila(mileage="x")])
+
+        assert resumen["dry_run"]
+        assert (resumen["invalid"], resumen["vehicles_created"], resumen["types_created"]) == (1, 1, 1)
+        assert contar(conn, "Vehiculo") == 0
+        assert contar(conn, "Mantenimiento") == 0
+
+    def test_chunks_are_written_by_the_write_queue(self, conn, monkeypatch):
+        writer = flask_app.WriteQueue("test-writer", commit_interval=0, max_batch=100, queue_size=10)
+        monkeypatch.setattr(flask_app, "DB_WRITE_QUEUE", True)
+        monkeypatch.setattr(flask_app, "db_writer", writer)
+        filas = [fila(), fila(mileage="x"), fila(fecha="2024-06-15", mileage="17000")]
+
+        resumen = flask_app.MaintenanceImporter(conn, chunk_size=2).run(filas)
+
+        assert (resumen["imported"], resumen["invalid"], resumen["vehicles_created"]) == (2, 1, 1)
+        assert contar(conn, "Mantenimiento") == 2
+        assert contar(conn, "Proyeccion_Mileage") == 1
+        # Two chunks and the projection refit
+        assert writer.stats()["operations"] == 3
+
+
+class TestJsonRecords:
+    """Tests for iter_json_records."""
+
+    REGISTROS = [{"vehiculo": f"Auto {i}", "nota": 'con "comillas" y \\u00e9', "mileage": 1.5e3 * i,
+                  "extra": [True, False, None]} for i in range(50)]
+
+    @pytest.mark.parametrize("chunk_size", [1, 3, 64, 65536])
+    @pytest.mark.parametrize("formato", ["array", "lines"])
+    def test_reads_arrays_and_json_lines(self, chunk_size, formato):
+        if formato == "array":
+            texto = json.dumps(self.REGISTROS, indent=2)
+        else:
+            texto = "\n".join(json.dumps(registro) for registro in self.REGISTROS)
+
+        assert list(flask_app.iter_json_records(io.StringIO(texto), chunk_size)) == self.REGISTROS
+
+    def test_malformed_json_fails_at_its_position(self):
+        texto = '{"a": 1}\n{"a": 2}\n{"a": tru}\n' + '{"a": 3}\n' * 10000
+        leido = []
+
+        class Stream(io.StringIO):
+            def read(self, size=-1):
+                chunk = super().read(size)
+                leido.append(len(chunk))
+                return chunk
+
+        with pytest.raises(ValueError, match=r"line 3 \(character 25\): Expecting value"):
+            list(flask_app.iter_json_records(Stream(texto), chunk_size=16))
+        # The rest of the file is not read looking for the end of the object
+        assert sum(leido) < 64
+
+    def test_truncated_file_fails(self):
+        with pytest.raises(ValueError, match="Invalid JSON at line 1"):
+            list(flask_app.iter_json_records(io.StringIO('[{"a": 1}, {"a": "sin cerrar'), chunk_size=4))
+
+    def test_non_objects_are_rejected(self):
+        with pytest.raises(ValueError, match="must contain objects"):
+            list(flask_app.iter_json_records(io.StringIO("[1, 2]")))
@@ -0,0 +1,106 @@
+"""
+Unit tests for the Ultimo_Mileage rows kept current by the latest-odometer triggers.
+"""
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def vehiculos(add_vehicle):
+    return add_vehicle("Corolla")[0], add_vehicle("Hilux")[0]
+
+
+def lectura(conn, vehiculo_id, fecha, mileage):
+    with flask_app.transaction(conn):
+        return flask_app.upsert_mileage(conn, vehiculo_id, fecha, mileage)
+
+
+def ultimos(conn):
+    """Ultimo_Mileage as {vehiculo_id: (fecha, mileage)}, checked against a full recomputation."""
+    filas = conn.execute("SELECT vehiculo_id, mileage_id, fecha, mileage FROM Ultimo_Mileage ORDER BY vehiculo_id")
+    recalculadas = conn.execute("""
+        SELECT vehiculo_id, id, fecha, mileage FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY vehiculo_id ORDER BY fecha DESC, id DESC) as orden
+            FROM Mileage WHERE vehiculo_id IS NOT NULL
+        )
+        WHERE orden = 1 ORDER BY vehiculo_id
+    """)
+    filas = [tuple(f) for f in filas]
+    assert filas == [tuple(f) for f in recalculadas]
+    return {vehiculo_id: (fecha, mileage) for vehiculo_id, _, fecha, mileage in filas}
+
+
+class TestLatestOdometerTriggers:
+    """Tests for the triggers behind Ultimo_Mileage."""
+
+    def test_newer_reading_replaces_the_row(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-01-01", 1000)
+        lectura(conn, corolla, "2024-02-01", 2000)
+
+        assert ultimos(conn) == {corolla: ("2024-02-01", 2000)}
+
+    def test_backdated_reading_keeps_the_row(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-02-01", 2000)
+        lectura(conn, corolla, "2024-01-01", 1000)
+
+        assert ultimos(conn) == {corolla: ("2024-02-01", 2000)}
+
+    def test_same_day_readings_keep_the_last_one(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-02-01", 2000)
+        lectura(conn, corolla, "2024-02-01", 2100)
+
+        assert ultimos(conn) == {corolla: ("2024-02-01", 2100)}
+
+    def test_deleted_reading_falls_back_to_the_previous_one(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-01-01", 1000)
+        ultimo = lectura(conn, corolla, "2024-02-01", 2000)
+
+        with flask_app.transaction(conn):
+            conn.execute("DELETE FROM Mileage WHERE id = ?", (ultimo,))
+        assert ultimos(conn) == {corolla: ("2024-01-01", 1000)}
+
+        with flask_app.transaction(conn):
+            conn.execute("DELETE FROM Mileage")
+        assert ultimos(conn) == {}
+
+    def test_corrected_reading(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-01-01", 1000)
+        ultimo = lectura(conn, corolla, "2024-02-01", 2000)
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mileage SET fecha = '2023-12-01', mileage = 500 WHERE id = ?", (ultimo,))
+
+        assert ultimos(conn) == {corolla: ("2024-01-01", 1000)}
+
+    def test_reading_moved_to_another_vehicle(self, conn, vehiculos):
+        corolla, hilux = vehiculos
+        lectura(conn, corolla, "2024-01-01", 1000)
+        ultimo = lectura(conn, corolla, "2024-02-01", 2000)
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mileage SET vehiculo_id = ? WHERE id = ?", (hilux, ultimo))
+
+        assert ultimos(conn) == {corolla: ("2024-01-01", 1000), hilux: ("2024-02-01", 2000)}
+
+    def test_reading_without_a_vehicle_is_ignored(self, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-01-01", 1000)
+
+        with flask_app.transaction(conn):
+            conn.execute("INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (NULL, '2024-05-01', 9000)")
+
+        assert ultimos(conn) == {corolla: ("2024-01-01", 1000)}
+        assert conn.execute("SELECT COUNT(*) FROM Vehiculo").fetchone()[0] == 2
+
+    def test_vehicle_page_shows_the_latest_reading(self, client, conn, vehiculos):
+        corolla, _ = vehiculos
+        lectura(conn, corolla, "2024-02-01", 23456)
+        lectura(conn, corolla, "2024-01-01", 1000)
+
+        assert "23.456 mi" in client.get(f"/maintenance/{corolla}").get_data(as_text=True)
@@ -0,0 +1,164 @@
+"""
+Unit tests for the schema migrations and the startup schema check.
+"""
+import sqlite3
+
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def migrate_to(tmp_path, monkeypatch):
+    """Function migrating a new database up to (and including) a given version."""
+    monkeypatch.setattr(flask_app, "DB_PATH", tmp_path / "mantenimiento.db")
+    todas = flask_app.SCHEMA_MIGRATIONS
+
+    def migrate(version):
+        monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", [m for m in todas if m[0] <= version])
+        flask_app.migrate_db()
+        monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", todas)
+
+    yield migrate
+    flask_app.db_pool.close_all()
+    flask_app.db_read_pool.close_all()
+
+
+class TestSchemaCheck:
+    """Requests are refused with a 503 until every migration is applied."""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        monkeypatch.setattr(flask_app, "_schema_checked", False)
+        return flask_app.app.test_client()
+
+    def test_missing_database(self, client, migrate_to):
+        respuesta = client.get("/login")
+
+        assert respuesta.status_code == 503
+        assert b"schema version 0" in respuesta.data
+        assert b"python initialize_db.py" in respuesta.data
+
+    def test_pending_migrations_then_migrated(self, client, migrate_to):
+        migrate_to(7)
+        ultima = flask_app.SCHEMA_MIGRATIONS[-1][0]
+
+        respuesta = client.get("/login")
+        assert respuesta.status_code == 503
+        assert f"schema version 7, this app needs version {ultima}".encode() in respuesta.data
+
+        flask_app.migrate_db()
+        assert client.get("/login").status_code == 200
+        assert flask_app._schema_checked
+
+
+def indexes(conn, tabla):
+    return {row[1] for row in conn.execute(f'PRAGMA index_list("{tabla}")')}
+
+
+class TestMigrateDb:
+    """Tests for migrate_db applying SCHEMA_MIGRATIONS."""
+
+    def test_new_database_records_every_version(self, migrate_to):
+        migrate_to(flask_app.SCHEMA_MIGRATIONS[-1][0])
+
+        conn = flask_app.get_db_connection()
+        try:
+            registradas = conn.execute("SELECT version, description FROM schema_version ORDER BY version").fetchall()
+            assert [tuple(row) for row in registradas] == [m[:2] for m in flask_app.SCHEMA_MIGRATIONS]
+            assert flask_app.get_schema_version(conn) == flask_app.SCHEMA_MIGRATIONS[-1][0]
+        finally:
+            conn.close()
+
+    def test_applied_migrations_are_not_run_again(self, migrate_to):
+        migrate_to(7)
+
+        assert flask_app.migrate_db() == [m[0] for m in flask_app.SCHEMA_MIGRATIONS if m[0] > 7]
+        assert flask_app.migrate_db() == []
+
+    def test_lookup_indexes_exist(self, migrate_to):
+        migrate_to(4)
+
+        conn = flask_app.get_db_connection()
+        try:
+            assert "idx_mileage_vehiculo_fecha" in indexes(conn, "Mileage")
+            assert {"idx_mantenimiento_vehiculo", "idx_mantenimiento_mileage"} <= indexes(conn, "Mantenimiento")
+            assert "idx_tipo_mantenimiento_detalle" in indexes(conn, "Tipo_Mantenimiento")
+        finally:
+            conn.close()
+
+    def test_failing_migration_is_rolled_back(self, migrate_to, monkeypatch):
+        migrate_to(4)
+
+        def falla(conn):
+            conn.execute("CREATE TABLE a_medias (id INTEGER)")
+            raise RuntimeError("migration failed")
+
+        monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS",
+                            [m for m in flask_app.SCHEMA_MIGRATIONS if m[0] <= 5] + [(6, "Failing", falla)])
+        with pytest.raises(RuntimeError, match="migration failed"):
+            flask_app.migrate_db()
+
+        conn = flask_app.get_db_connection()
+        try:
+            # Migration 5 was committed before the failure; 6 left nothing behind
+            assert flask_app.get_schema_version(conn) == 5
+            assert not flask_app._table_exists(conn, "a_medias")
+        finally:
+            conn.close()
+
+
+class TestOdometerTriggerFixes:
+    """Migration 12 repairs the triggers that failed on readings without a vehicle."""
+
+    @pytest.fixture
+    def schema_11(self, migrate_to):
+        migrate_to(11)
+        conn = flask_app.get_db_connection()
+        with flask_app.transaction(conn):
+            conn.execute("INSERT INTO Detalle_Vehiculo (id, marca, modelo, anio) VALUES (1, 'Toyota', 'Corolla', 2020)")
+            conn.execute("INSERT INTO Vehiculo (id, alias, detalle_id) VALUES (1, 'Corolla', 1)")
+            conn.execute("INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (1, '2024-01-01', 1000)")
+        yield conn
+        conn.close()
+
+    def insert_without_vehicle(self, conn):
+        with flask_app.transaction(conn):
+            conn.execute("INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (NULL, '2024-02-01', 2000)")
+
+    def test_reading_without_a_vehicle_failed_before(self, schema_11):
+        # Migration 7's trigger inserted 'historial:' || NULL as a Cache_Version key
+        with pytest.raises(sqlite3.IntegrityError, match="Cache_Version.etiqueta"):
+            self.insert_without_vehicle(schema_11)
+
+    def test_reading_without_a_vehicle_is_accepted(self, schema_11):
+        flask_app.migrate_db()
+
+        self.insert_without_vehicle(schema_11)
+
+        assert schema_11.execute("SELECT COUNT(*) FROM Mileage WHERE vehiculo_id IS NULL").fetchone()[0] == 1
+        ultimos = schema_11.execute("SELECT vehiculo_id, mileage FROM Ultimo_Mileage").fetchall()
+        assert [tuple(row) for row in ultimos] == [(1, 1000)]
+        etiquetas = [row[0] for row in schema_11.execute("SELECT etiqueta FROM Cache_Version")]
+        assert None not in etiquetas
+
+    def test_history_versions_still_bump(self, schema_11):
+        flask_app.migrate_db()
+        antes = schema_11.execute("SELECT version FROM Cache_Version WHERE etiqueta = 'historial:1'").fetchone()[0]
+
+        with flask_app.transaction(schema_11):
+            schema_11.execute("INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (1, '2024-03-01', 3000)")
+
+        assert schema_11.execute(
+            "SELECT version FROM Cache_Version WHERE etiqueta = 'historial:1'").fetchone()[0] == antes + 1
+
+    def test_phantom_latest_readings_are_removed(self, schema_11):
+        # A row the old latest-reading trigger created for a vehicle that does not exist
+        with flask_app.transaction(schema_11):
+            schema_11.execute("""
+                INSERT INTO Ultimo_Mileage (vehiculo_id, mileage_id, fecha, mileage) VALUES (99, 1, '2024-01-01', 1000)
+            """)
+
+        flask_app.migrate_db()
+
+        assert [row[0] for row in schema_11.execute("SELECT vehiculo_id FROM Ultimo_Mileage")] == [1]
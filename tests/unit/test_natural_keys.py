@@ -0,0 +1,195 @@
+"""
+Unit tests for the natural key constraints: migration 8's merge of existing duplicates,
+its unique indexes, and the duplicate checks of the batch service visit save.
+"""
+import sqlite3
+
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def schema_7(tmp_path, monkeypatch):
+    """A database migrated up to the version before the natural key constraints."""
+    monkeypatch.setattr(flask_app, "DB_PATH", tmp_path / "mantenimiento.db")
+    todas = flask_app.SCHEMA_MIGRATIONS
+    monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", [m for m in todas if m[0] < 8])
+    flask_app.migrate_db()
+    monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", todas)
+    conn = flask_app.get_db_connection()
+    yield conn
+    conn.close()
+
+
+def ids(conn, tabla):
+    return [row[0] for row in conn.execute(f'SELECT id FROM "{tabla}" ORDER BY id')]
+
+
+class TestNaturalKeyMigration:
+    """Tests for migration 8 on a database holding duplicates."""
+
+    @pytest.fixture
+    def migrated(self, schema_7, caplog):
+        conn = schema_7
+        caplog.set_level("WARNING", logger=flask_app.app.logger.name)
+        with flask_app.transaction(conn):
+            conn.execute("INSERT INTO Detalle_Vehiculo (id, marca, modelo, anio) VALUES (1, 'Toyota', 'Hilux', 2018)")
+            conn.execute("INSERT INTO Vehiculo (id, alias, detalle_id) VALUES (1, 'Hilux', 1)")
+            # A NULL phone and an empty one are the same mechanic
+            conn.executemany("INSERT INTO Mecánico (id, nombre_mecanico, telefono_mecanico) VALUES (?, ?, ?)",
+                             [(1, "Taller", None), (2, "Taller", ""), (3, "Otro", "8888")])
+            conn.executemany("""
+                INSERT INTO Tipo_Mantenimiento
+                (id, nombre, categoria, miles_next_maintenance, meses_proximo_mantenimiento, vehiculo_detalle_id)
+                VALUES (?, ?, ?, ?, ?, 1)
+            """, [(1, "Aceite", "Motor", 5000, 6), (2, "Aceite", "Motor", 5000, 6),
+                  (3, "Frenos", "Frenos", None, None), (4, "Frenos", "Frenos", None, None)])
+            conn.executemany("INSERT INTO Mileage (id, vehiculo_id, fecha, mileage) VALUES (?, 1, ?, ?)",
+                             [(1, "2024-01-01", 1000), (2, "2024-01-01", 1000), (3, "2024-02-01", 2000)])
+            # The first two become the same service once their references are merged
+            conn.executemany("""
+                INSERT INTO Mantenimiento (id, vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, precio)
+                VALUES (?, 1, ?, ?, ?, 50)
+            """, [(1, 1, 1, 1), (2, 2, 2, 2), (3, 4, 3, 3)])
+        flask_app.migrate_db()
+        return conn
+
+    def test_duplicates_are_merged_into_the_lowest_id(self, migrated):
+        assert ids(migrated, "Mileage") == [1, 3]
+        assert ids(migrated, "Mecánico") == [1, 3]
+        assert ids(migrated, "Tipo_Mantenimiento") == [1, 3]
+
+    def test_merged_rows_are_logged(self, migrated, caplog):
+        mensajes = [r.getMessage() for r in caplog.get_records("setup")]
+
+        assert "Merging 1 duplicate rows of Mecánico" in mensajes
+        # The empty phone was merged into the NULL one
+        assert ("  Mecánico row merged: {'merged_into': 1, 'id': 2, 'nombre_mecanico': 'Taller', "
+                "'telefono_mecanico': ''}") in mensajes
+        assert "Merging 1 duplicate rows of Mantenimiento" in mensajes
+
+    def test_references_point_at_the_kept_rows(self, migrated):
+        servicios = migrated.execute("""
+            SELECT id, tipo_mantenimiento_id, mileage_id, mecanico_id FROM Mantenimiento ORDER BY id
+        """).fetchall()
+        assert [tuple(row) for row in servicios] == [(1, 1, 1, 1), (3, 3, 3, 3)]
+
+    @pytest.mark.parametrize("sql", [
+        "INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (1, '2024-01-01', 1000)",
+        "INSERT INTO Mecánico (nombre_mecanico, telefono_mecanico) VALUES ('Taller', '')",
+        "INSERT INTO Mecánico (nombre_mecanico) VALUES ('Taller')",
+        "INSERT INTO Tipo_Mantenimiento (nombre, categoria, vehiculo_detalle_id) VALUES ('Frenos', 'Frenos', 1)",
+        "INSERT INTO Mantenimiento (vehiculo_id, tipo_mantenimiento_id, mileage_id, mecanico_id, precio) "
+        "VALUES (1, 3, 3, 1, 10)",
+    ])
+    def test_unique_indexes_reject_duplicates(self, migrated, sql):
+        with pytest.raises(sqlite3.IntegrityError):
+            migrated.execute(sql)
+        migrated.rollback()
+
+    def test_other_intervals_are_a_different_type(self, migrated):
+        nuevo = migrated.execute("""
+            INSERT INTO Tipo_Mantenimiento (nombre, categoria, miles_next_maintenance, vehiculo_detalle_id)
+            VALUES ('Frenos', 'Frenos', 20000, 1)
+        """).lastrowid
+        assert nuevo not in (1, 3)
+        migrated.rollback()
+
+
+class TestServiceVisitSave:
+    """Tests for the duplicate checks of /save_service_visit."""
+
+    @pytest.fixture
+    def visita(self, conn, add_vehicle):
+        vehiculo_id, detalle_id = add_vehicle("Corolla")
+        with flask_app.transaction(conn):
+            mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+            tipos = [conn.execute("""
+                INSERT INTO Tipo_Mantenimiento (nombre, categoria, miles_next_maintenance, vehiculo_detalle_id)
+                VALUES (?, 'Motor', 5000, ?)
+            """, (nombre, detalle_id)).lastrowid for nombre in ("Aceite", "Filtro")]
+        return {
+            "vehiculo_id": vehiculo_id,
+            "fecha": "2024-03-01",
+            "mileage": 15000,
+            "mecanico_id": mecanico_id,
+            "items": [{"tipo_mantenimiento_id": tipo, "precio": 40} for tipo in tipos],
+        }
+
+    def servicios(self, conn):
+        return conn.execute("SELECT COUNT(*) FROM Mantenimiento").fetchone()[0]
+
+    def test_saves_every_item_in_one_visit(self, client, conn, visita):
+        respuesta = client.post("/save_service_visit", json=visita).get_json()
+
+        assert respuesta["success"], respuesta
+        assert respuesta["guardados"] == 2
+        assert self.servicios(conn) == 2
+        assert conn.execute("SELECT COUNT(*) FROM Mileage").fetchone()[0] == 1
+
+    def test_repeated_visit_is_rejected(self, client, conn, visita):
+        client.post("/save_service_visit", json=visita)
+
+        respuesta = client.post("/save_service_visit", json=visita).get_json()
+
+        assert not respuesta["success"]
+        assert "already exist" in respuesta["error"]
+        assert self.servicios(conn) == 2
+
+    def test_item_already_recorded_rolls_back_the_visit(self, client, conn, visita):
+        aceite, filtro = visita["items"]
+        client.post("/save_service_visit", json=dict(visita, items=[filtro]))
+
+        respuesta = client.post("/save_service_visit", json=visita).get_json()
+
+        assert not respuesta["success"]
+        assert respuesta["error"] == "Maintenance records with these details already exist: Filtro"
+        assert self.servicios(conn) == 1
+
+    @pytest.mark.parametrize("items, error", [
+        (lambda aceite, filtro: [aceite, {"tipo_mantenimiento_id": 9999, "precio": 10}],
+         "Maintenance type not found: 9999"),
+        (lambda aceite, filtro: [aceite, filtro, dict(aceite, precio=20)],
+         "Each maintenance type can only appear once per visit."),
+        (lambda aceite, filtro: [aceite, dict(filtro, precio=0)],
+         "The price must be a positive number."),
+    ])
+    def test_invalid_item_saves_nothing(self, client, conn, visita, items, error):
+        respuesta = client.post("/save_service_visit", json=dict(visita, items=items(*visita["items"]))).get_json()
+
+        assert respuesta == {"success": False, "error": error}
+        assert self.servicios(conn) == 0
+        assert conn.execute("SELECT COUNT(*) FROM Mileage").fetchone()[0] == 0
+
+    def test_registration_form_saves_visits(self, client):
+        pagina = client.get("/registration").get_data(as_text=True)
+
+        assert "url: '/save_service_visit'" in pagina
+        assert "/save_maintenance" not in pagina
+
+    def test_concurrent_save_of_an_item_rolls_back_the_visit(self, client, conn, visita, monkeypatch):
+        """An item another save inserts after the duplicate check is skipped by ON CONFLICT;
+        the rowcount check turns that into a duplicate error and nothing is kept."""
+
+        class ConcurrentSave:
+            def __init__(self, conn):
+                self._conn = conn
+
+            def __getattr__(self, nombre):
+                return getattr(self._conn, nombre)
+
+            def executemany(self, sql, filas):
+                self._conn.execute(sql, filas[0])
+                return self._conn.executemany(sql, filas)
+
+        write_transaction = flask_app.write_transaction
+        monkeypatch.setattr(flask_app, "write_transaction",
+                            lambda fn, conn=None: write_transaction(lambda c: fn(ConcurrentSave(c)), conn))
+
+        respuesta = client.post("/save_service_visit", json=visita).get_json()
+
+        assert not respuesta["success"]
+        assert "already exists" in respuesta["error"]
+        assert self.servicios(conn) == 0
+        assert conn.execute("SELECT COUNT(*) FROM Mileage").fetchone()[0] == 0
@@ -0,0 +1,114 @@
+"""
+Unit tests for the Proximo_Mantenimiento rows kept current by the next-due triggers.
+"""
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def taller(conn, add_vehicle):
+    """Two vehicles, a mechanic and an oil change type due every 6 months or 5000 miles."""
+    corolla, detalle_id = add_vehicle("Corolla")
+    hilux, _ = add_vehicle("Hilux")
+    with flask_app.transaction(conn):
+        mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+        tipo_id = conn.execute("""
+            INSERT INTO Tipo_Mantenimiento
+            (nombre, categoria, miles_next_maintenance, meses_proximo_mantenimiento, vehiculo_detalle_id)
+            VALUES ('Cambio de Aceite', 'Motor', 5000, 6, ?)
+        """, (detalle_id,)).lastrowid
+    return {"corolla": corolla, "hilux": hilux, "mecanico_id": mecanico_id, "tipo_id": tipo_id}
+
+
+@pytest.fixture
+def servicio(conn, taller):
+    """Function recording an oil change; returns its id."""
+
+    def registrar(fecha, mileage, vehiculo="corolla"):
+        with flask_app.transaction(conn):
+            mileage_id = flask_app.upsert_mileage(conn, taller[vehiculo], fecha, mileage)
+            return flask_app.insert_mantenimiento(
+                conn, taller[vehiculo], taller["tipo_id"], mileage_id, taller["mecanico_id"], fecha, 50)
+
+    return registrar
+
+
+def proximos(conn):
+    """Proximo_Mantenimiento as {vehiculo_id: (mantenimiento_id, fecha_proximo, mileage_proximo)},
+    checked against a full recomputation."""
+    filas = conn.execute("""
+        SELECT vehiculo_id, tipo_mantenimiento_id, mantenimiento_id, fecha_ultimo, mileage_ultimo,
+               fecha_proximo, mileage_proximo
+        FROM Proximo_Mantenimiento ORDER BY vehiculo_id, tipo_mantenimiento_id
+    """).fetchall()
+    recalculadas = conn.execute(
+        f"SELECT * FROM ({flask_app._next_due_rows_sql()}) ORDER BY vehiculo_id, tipo_mantenimiento_id").fetchall()
+    assert [tuple(f) for f in filas] == [tuple(f) for f in recalculadas]
+    return {f["vehiculo_id"]: (f["mantenimiento_id"], f["fecha_proximo"], f["mileage_proximo"]) for f in filas}
+
+
+class TestNextDueTriggers:
+    """Tests for the triggers behind Proximo_Mantenimiento."""
+
+    def test_newer_service_replaces_the_row(self, conn, taller, servicio):
+        servicio("2024-01-10", 10000)
+        nuevo = servicio("2024-03-10", 14000)
+
+        assert proximos(conn) == {taller["corolla"]: (nuevo, "2024-09-10", 19000)}
+
+    def test_backdated_service_keeps_the_row(self, conn, taller, servicio):
+        ultimo = servicio("2024-03-10", 14000)
+        servicio("2024-01-10", 10000)
+
+        assert proximos(conn) == {taller["corolla"]: (ultimo, "2024-09-10", 19000)}
+
+    def test_deleted_service_falls_back_to_the_previous_one(self, conn, taller, servicio):
+        anterior = servicio("2024-01-10", 10000)
+        ultimo = servicio("2024-03-10", 14000)
+
+        with flask_app.transaction(conn):
+            conn.execute("DELETE FROM Mantenimiento WHERE id = ?", (ultimo,))
+        assert proximos(conn) == {taller["corolla"]: (anterior, "2024-07-10", 15000)}
+
+        with flask_app.transaction(conn):
+            conn.execute("DELETE FROM Mantenimiento WHERE id = ?", (anterior,))
+        assert proximos(conn) == {}
+
+    def test_service_moved_to_another_vehicle(self, conn, taller, servicio):
+        anterior = servicio("2024-01-10", 10000)
+        ultimo = servicio("2024-03-10", 14000)
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mantenimiento SET vehiculo_id = ? WHERE id = ?", (taller["hilux"], ultimo))
+
+        assert proximos(conn) == {taller["corolla"]: (anterior, "2024-07-10", 15000),
+                                  taller["hilux"]: (ultimo, "2024-09-10", 19000)}
+
+    def test_corrected_reading(self, conn, taller, servicio):
+        anterior = servicio("2024-01-10", 10000)
+        servicio("2024-03-10", 14000)
+
+        # The later service's reading was really from before the other one
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mileage SET fecha = '2023-12-01', mileage = 9000 WHERE mileage = 14000")
+
+        assert proximos(conn) == {taller["corolla"]: (anterior, "2024-07-10", 15000)}
+
+    def test_reading_moved_to_another_vehicle(self, conn, taller, servicio):
+        servicio("2024-01-10", 10000)
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Mileage SET vehiculo_id = ?, mileage = 11000", (taller["hilux"],))
+
+        assert proximos(conn)[taller["corolla"]][2] == 16000
+
+    def test_interval_change(self, conn, taller, servicio):
+        ultimo = servicio("2024-01-31", 10000)
+
+        with flask_app.transaction(conn):
+            conn.execute("""
+                UPDATE Tipo_Mantenimiento SET meses_proximo_mantenimiento = 1, miles_next_maintenance = NULL
+            """)
+
+        assert proximos(conn) == {taller["corolla"]: (ultimo, "2024-03-02", None)}
@@ -0,0 +1,149 @@
+"""
+Unit tests for the odometer readings ingestion: reading validation, rollback detection,
+duplicates and the /odometer_readings endpoint.
+"""
+import pytest
+
+import flask_app
+
+
+@pytest.fixture
+def ingestor(db_path, monkeypatch):
+    writer = flask_app.WriteQueue("test-odometer", commit_interval=0, max_batch=100, queue_size=10)
+    ingestor = flask_app.OdometerIngestor(writer, projection_interval=3600)
+    monkeypatch.setattr(flask_app, "odometer_ingestor", ingestor)
+    return ingestor
+
+
+@pytest.fixture
+def corolla(add_vehicle):
+    return add_vehicle("Corolla")[0]
+
+
+def lecturas(conn, tabla="Mileage"):
+    return [tuple(row) for row in conn.execute(f"SELECT fecha, mileage FROM {tabla} ORDER BY fecha, mileage")]
+
+
+def ultimo_mileage(conn, vehiculo_id):
+    return conn.execute("SELECT mileage FROM Ultimo_Mileage WHERE vehiculo_id = ?", (vehiculo_id,)).fetchone()[0]
+
+
+class TestParseOdometerReading:
+    """Tests for parse_odometer_reading."""
+
+    def test_timestamp_is_stored_as_a_costa_rica_date(self):
+        lectura = {"vehiculo_id": "1", "fecha": "2024-03-01T03:00:00+00:00", "mileage": 1500.7}
+
+        assert flask_app.parse_odometer_reading(lectura, {1}) == (1, "2024-02-29", 1500)
+
+    @pytest.mark.parametrize("lectura, error", [
+        ({"vehiculo_id": 2, "fecha": "2024-03-01", "mileage": 1}, "Vehicle not found: 2"),
+        ({"fecha": "2024-03-01", "mileage": 1}, "Missing or invalid vehiculo_id"),
+        ({"vehiculo_id": 1, "fecha": "ayer", "mileage": 1}, "Invalid fecha: ayer"),
+        ({"vehiculo_id": 1, "fecha": "2024-03-01", "mileage": True}, "Invalid mileage: True"),
+        ({"vehiculo_id": 1, "fecha": "2024-03-01", "mileage": -1}, "Invalid mileage: -1"),
+        ({"vehiculo_id": 1, "fecha": "2024-03-01", "mileage": 10_000_000}, "Invalid mileage: 10000000"),
+        ([1, "2024-03-01", 1], "Reading must be an object"),
+    ])
+    def test_invalid_reading(self, lectura, error):
+        with pytest.raises(ValueError, match=error):
+            flask_app.parse_odometer_reading(lectura, {1})
+
+
+class TestOdometerIngestor:
+    """Tests for OdometerIngestor's monotonicity checks."""
+
+    def test_readings_are_inserted_and_duplicates_counted(self, conn, ingestor, corolla):
+        ingestor.ingest([(corolla, "2024-01-01", 1000), (corolla, "2024-02-01", 2000)])
+
+        resultado = ingestor.ingest([(corolla, "2024-02-01", 2000), (corolla, "2024-03-01", 3000)])
+
+        assert (resultado["inserted"], resultado["duplicates"]) == (1, 1)
+        assert lecturas(conn) == [("2024-01-01", 1000), ("2024-02-01", 2000), ("2024-03-01", 3000)]
+        assert ingestor.stats()["received"] == 4
+
+    def test_batch_is_checked_in_time_order(self, conn, ingestor, corolla):
+        resultado = ingestor.ingest([(corolla, "2024-03-01", 3000), (corolla, "2024-01-01", 1000),
+                                     (corolla, "2024-02-01", 500)])
+
+        assert resultado["inserted"] == 2
+        assert resultado["rejected"] == [{
+            "vehiculo_id": corolla, "fecha": "2024-02-01", "mileage": 500,
+            "anterior": {"fecha": "2024-01-01", "mileage": 1000},
+            # Later readings of the batch are not stored yet when it is checked
+            "siguiente": None,
+        }]
+
+    @pytest.mark.parametrize("lectura", [("2024-01-15", 900), ("2024-01-15", 2100), ("2023-12-01", 1500)])
+    def test_rollback_against_either_neighbour_is_rejected(self, conn, ingestor, corolla, lectura):
+        ingestor.ingest([(corolla, "2024-01-01", 1000), (corolla, "2024-02-01", 2000)])
+
+        resultado = ingestor.ingest([(corolla,) + lectura])
+
+        assert resultado["inserted"] == 0
+        assert len(resultado["rejected"]) == 1
+        assert len(lecturas(conn)) == 2
+
+    def test_same_day_readings_are_not_compared(self, conn, ingestor, corolla):
+        ingestor.ingest([(corolla, "2024-01-01", 1000)])
+
+        assert ingestor.ingest([(corolla, "2024-01-01", 900)])["inserted"] == 1
+
+    def test_flagged_rollbacks_are_kept_apart(self, conn, ingestor, corolla):
+        ingestor.ingest([(corolla, "2024-01-01", 1000)])
+
+        resultado = ingestor.ingest([(corolla, "2024-02-01", 10)], on_rollback="flag")
+        repetido = ingestor.ingest([(corolla, "2024-02-01", 10)], on_rollback="flag")
+
+        assert (resultado["rejected"], len(resultado["flagged"])) == ([], 1)
+        assert repetido["duplicates"] == 1
+        assert lecturas(conn) == [("2024-01-01", 1000)]
+        assert lecturas(conn, "Mileage_Marcado") == [("2024-02-01", 10)]
+        marcada = conn.execute("SELECT fecha_anterior, mileage_anterior, fecha_siguiente FROM Mileage_Marcado")
+        assert tuple(marcada.fetchone()) == ("2024-01-01", 1000, None)
+        assert ultimo_mileage(conn, corolla) == 1000
+
+
+class TestOdometerReadingsEndpoint:
+    """Tests for /odometer_readings."""
+
+    @pytest.fixture
+    def anonimo(self, db_path):
+        return flask_app.app.test_client()
+
+    def test_authentication_is_required(self, anonimo, ingestor):
+        assert anonimo.post("/odometer_readings", json={"readings": []}).status_code == 401
+
+    def test_api_token(self, anonimo, ingestor, corolla, monkeypatch):
+        monkeypatch.setattr(flask_app, "ODOMETER_API_TOKEN", "secreto")
+        lectura = {"vehiculo_id": corolla, "fecha": "2024-01-01", "mileage": 1000}
+
+        respuesta = anonimo.post("/odometer_readings", json={"readings": [lectura]},
+                                 headers={"Authorization": "Bearer secreto"})
+
+        assert respuesta.get_json()["inserted"] == 1
+        assert anonimo.post("/odometer_readings", json={"readings": [lectura]},
+                            headers={"Authorization": "Bearer otro"}).status_code == 401
+
+    def test_invalid_readings_are_reported_by_index(self, client, ingestor, corolla):
+        respuesta = client.post("/odometer_readings", json={"readings": [
+            {"vehiculo_id": corolla, "fecha": "2024-01-01", "mileage": 1000},
+            {"vehiculo_id": 999, "fecha": "2024-01-02", "mileage": 1100},
+        ]}).get_json()
+
+        assert respuesta["success"]
+        assert respuesta["inserted"] == 1
+        assert respuesta["invalid"] == [{"index": 1, "error": "Vehicle not found: 999"}]
+
+    @pytest.mark.parametrize("datos, estado", [
+        ({"lecturas": []}, 400),
+        ({"readings": [], "on_rollback": "ignore"}, 400),
+        ({"readings": [{}] * 10}, 413),
+    ])
+    def test_bad_requests(self, client, ingestor, monkeypatch, datos, estado):
+        monkeypatch.setattr(flask_app, "ODOMETER_MAX_READINGS", 5)
+
+        respuesta = client.post("/odometer_readings", json=datos)
+
+        assert respuesta.status_code == estado
+        assert not respuesta.get_json()["success"]
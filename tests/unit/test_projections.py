@@ -0,0 +1,260 @@
+"""
+Unit tests for the odometer projections: the vectorized rate fit and its refresh.
+"""
+import math
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import flask_app
+
+
+def add_readings(conn, vehiculo_id, lecturas):
+    """Insert (fecha, mileage) readings for a vehicle in one transaction."""
+    with flask_app.transaction(conn):
+        conn.executemany(
+            "INSERT INTO Mileage (vehiculo_id, fecha, mileage) VALUES (?, ?, ?)",
+            [(vehiculo_id, fecha, mileage) for fecha, mileage in lecturas],
+        )
+
+
+def daily_readings(inicio, dias, millas_dia, desde=0):
+    """Weekly readings over ``dias`` days from ``inicio`` at a constant daily rate."""
+    return [
+        ((inicio + timedelta(days=d)).isoformat(), desde + round(millas_dia * d))
+        for d in range(0, dias + 1, 7)
+    ]
+
+
+def projection(conn, vehiculo_id):
+    return conn.execute(
+        "SELECT millas_dia, lecturas, dias FROM Proyeccion_Mileage WHERE vehiculo_id = ?",
+        (vehiculo_id,),
+    ).fetchone()
+
+
+class TestGroupMedians:
+    """Tests for the per-group median used by the fit."""
+
+    def test_odd_and_even_groups(self):
+        valores = np.array([3.0, 1.0, 2.0, 10.0, 40.0, 20.0, 30.0])
+        medianas = flask_app._group_medians(valores, np.array([0, 3]), np.array([3, 4]))
+        assert medianas.tolist() == pytest.approx([2.0, 25.0])
+
+    def test_groups_do_not_mix(self):
+        """Values of one group never land in another group's sorted slice."""
+        valores = np.array([-5.0, 100.0, 0.5, 0.25])
+        medianas = flask_app._group_medians(valores, np.array([0, 1, 2]), np.array([1, 1, 2]))
+        assert medianas.tolist() == pytest.approx([-5.0, 100.0, 0.375])
+
+
+class TestFitMileageRates:
+    """Tests for fit_mileage_rates."""
+
+    def test_single_reading_has_no_rate(self):
+        tasas, spans = flask_app.fit_mileage_rates([100.0], [5000.0], [1])
+        assert math.isnan(tasas[0])
+        assert spans[0] == 0
+
+    def test_vehicle_without_readings_has_no_rate(self):
+        tasas, spans = flask_app.fit_mileage_rates([], [], [0])
+        assert math.isnan(tasas[0])
+        assert spans[0] == 0
+
+    def test_too_short_a_span_has_no_rate(self):
+        dias = [0.0, 5.0, 10.0]
+        tasas, spans = flask_app.fit_mileage_rates(dias, [0.0, 50.0, 100.0], [3])
+        assert math.isnan(tasas[0])
+        assert spans[0] == 10
+
+    def test_linear_history(self):
+        dias = np.arange(0.0, 100.0, 10.0)
+        tasas, spans = flask_app.fit_mileage_rates(dias, 1000 + 30 * dias, [len(dias)])
+        assert tasas[0] == pytest.approx(30.0)
+        assert spans[0] == 90
+
+    def test_flat_mileage_has_zero_rate(self):
+        dias = np.arange(0.0, 60.0, 10.0)
+        tasas, _ = flask_app.fit_mileage_rates(dias, np.full(len(dias), 42000.0), [len(dias)])
+        assert tasas[0] == 0.0
+
+    def test_decreasing_mileage_is_clamped_to_zero(self):
+        dias = np.arange(0.0, 60.0, 10.0)
+        tasas, _ = flask_app.fit_mileage_rates(dias, 5000 - 10 * dias, [len(dias)])
+        assert tasas[0] == 0.0
+
+    def test_outlier_barely_moves_the_rate(self):
+        dias = np.arange(0.0, 200.0, 10.0)
+        millas = 1000 + 30 * dias
+        # A typo with an extra digit
+        millas[10] *= 10
+        tasas, _ = flask_app.fit_mileage_rates(dias, millas, [len(dias)])
+        assert tasas[0] == pytest.approx(30.0, rel=0.02)
+
+    def test_several_vehicles_in_one_call(self):
+        """Each vehicle's rate matches the rate of fitting it alone."""
+        vehiculos = [
+            (np.arange(0.0, 100.0, 10.0), 20.0),
+            (np.array([3.0]), 0.0),
+            (np.arange(50.0, 400.0, 25.0), 55.0),
+            (np.arange(0.0, 40.0, 7.0), 0.0),
+        ]
+        dias = np.concatenate([d for d, _ in vehiculos])
+        millas = np.concatenate([100 + tasa * d for d, tasa in vehiculos])
+        conteos = [len(d) for d, _ in vehiculos]
+
+        tasas, spans = flask_app.fit_mileage_rates(dias, millas, conteos)
+
+        for i, (d, tasa) in enumerate(vehiculos):
+            sola, span = flask_app.fit_mileage_rates(d, 100 + tasa * d, [len(d)])
+            np.testing.assert_allclose(tasas[i], sola[0], equal_nan=True)
+            assert spans[i] == span[0]
+        assert tasas[0] == pytest.approx(20.0)
+        assert math.isnan(tasas[1])
+        assert tasas[2] == pytest.approx(55.0)
+        assert tasas[3] == 0.0
+
+
+class TestRefreshOdometerProjections:
+    """Tests for refresh_odometer_projections against the database."""
+
+    def refresh(self, conn, vehiculo_ids=None):
+        with flask_app.transaction(conn):
+            return flask_app.refresh_odometer_projections(conn, vehiculo_ids)
+
+    def test_single_reading(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Solo")
+        add_readings(conn, vehiculo_id, [("2024-03-01", 12000)])
+
+        self.refresh(conn)
+
+        assert tuple(projection(conn, vehiculo_id)) == (None, 1, 0)
+
+    def test_readings_on_one_day_count_once(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Mismo dia")
+        add_readings(conn, vehiculo_id, [("2024-03-01", 12000), ("2024-03-01", 12040), ("2024-03-01", 12080)])
+
+        self.refresh(conn)
+
+        assert tuple(projection(conn, vehiculo_id)) == (None, 1, 0)
+
+    def test_flat_mileage(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Parado")
+        add_readings(conn, vehiculo_id, daily_readings(date(2024, 1, 1), 70, 0, desde=8000))
+
+        self.refresh(conn)
+
+        assert tuple(projection(conn, vehiculo_id)) == (0.0, 11, 70)
+
+    def test_outlier(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Typo")
+        lecturas = daily_readings(date(2024, 1, 1), 140, 40, desde=1000)
+        fecha, mileage = lecturas[10]
+        lecturas[10] = (fecha, mileage * 10)
+        add_readings(conn, vehiculo_id, lecturas)
+
+        self.refresh(conn)
+
+        assert projection(conn, vehiculo_id)["millas_dia"] == pytest.approx(40.0, rel=0.02)
+
+    def test_several_vehicles_in_one_call(self, conn, add_vehicle):
+        rapido, _ = add_vehicle("Rapido")
+        lento, _ = add_vehicle("Lento")
+        sin_lecturas, _ = add_vehicle("Nuevo")
+        add_readings(conn, rapido, daily_readings(date(2024, 1, 1), 91, 60))
+        add_readings(conn, lento, daily_readings(date(2024, 2, 1), 91, 5, desde=70000))
+
+        assert self.refresh(conn) == 3
+
+        assert projection(conn, rapido)["millas_dia"] == pytest.approx(60.0, abs=0.1)
+        assert projection(conn, lento)["millas_dia"] == pytest.approx(5.0, abs=0.1)
+        assert tuple(projection(conn, sin_lecturas)) == (None, 0, 0)
+
+    def test_only_changed_vehicles_are_refitted(self, conn, add_vehicle):
+        uno, _ = add_vehicle("Uno")
+        dos, _ = add_vehicle("Dos")
+        add_readings(conn, uno, daily_readings(date(2024, 1, 1), 91, 20))
+        add_readings(conn, dos, daily_readings(date(2024, 1, 1), 91, 30))
+        assert self.refresh(conn) == 2
+        assert self.refresh(conn) == 0
+
+        add_readings(conn, dos, [("2024-05-01", 30 * 121)])
+
+        assert self.refresh(conn, [uno]) == 0
+        assert self.refresh(conn) == 1
+        assert projection(conn, dos)["lecturas"] == 15
+
+    def test_readings_outside_the_window_are_ignored(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Viejo")
+        viejas = daily_readings(date(2020, 1, 1), 91, 100)
+        recientes = daily_readings(date(2024, 1, 1), 91, 10, desde=200000)
+        add_readings(conn, vehiculo_id, viejas + recientes)
+
+        self.refresh(conn)
+
+        fila = projection(conn, vehiculo_id)
+        assert fila["lecturas"] == len(recientes)
+        assert fila["millas_dia"] == pytest.approx(10.0, abs=0.1)
+
+
+class TestProjectionMigration:
+    """The history recorded before migration 11 is fitted once migrate_db() finishes."""
+
+    def test_existing_history_is_fitted_after_the_migrations(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(flask_app, "DB_PATH", tmp_path / "mantenimiento.db")
+        todas = flask_app.SCHEMA_MIGRATIONS
+        monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", [m for m in todas if m[0] < 11])
+        flask_app.migrate_db()
+        conn = flask_app.get_db_connection()
+        try:
+            with flask_app.transaction(conn):
+                conn.execute("INSERT INTO Detalle_Vehiculo (id, marca, modelo, anio) VALUES (1, 'Toyota', 'Hilux', 2018)")
+                conn.execute("INSERT INTO Vehiculo (id, alias, detalle_id) VALUES (1, 'Hilux', 1)")
+            add_readings(conn, 1, daily_readings(date(2024, 1, 1), 91, 25))
+            monkeypatch.setattr(flask_app, "SCHEMA_MIGRATIONS", todas)
+
+            assert flask_app.migrate_db() == [m[0] for m in todas if m[0] >= 11]
+
+            assert projection(conn, 1)["millas_dia"] == pytest.approx(25.0, abs=0.1)
+        finally:
+            conn.close()
+
+    def test_the_migration_only_creates_the_table(self, conn, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Sin ajustar")
+        add_readings(conn, vehiculo_id, daily_readings(date(2024, 1, 1), 91, 25))
+
+        with flask_app.transaction(conn):
+            flask_app._migration_odometer_projections(conn)
+
+        assert conn.execute("SELECT COUNT(*) FROM Proyeccion_Mileage").fetchone()[0] == 0
+
+
+class TestRefitAfterSave:
+    """The saves refit the vehicle's rate after their transaction, not inside it."""
+
+    def test_visit_save_refits_outside_the_write(self, client, conn, add_vehicle, monkeypatch):
+        vehiculo_id, detalle_id = add_vehicle("Visita")
+        add_readings(conn, vehiculo_id, daily_readings(date(2024, 1, 1), 91, 20))
+        with flask_app.transaction(conn):
+            mecanico_id = flask_app.insert_mecanico(conn, "Taller", "")["id"]
+            tipo_id = conn.execute("""
+                INSERT INTO Tipo_Mantenimiento (nombre, categoria, vehiculo_detalle_id) VALUES ('Aceite', 'Motor', ?)
+            """, (detalle_id,)).lastrowid
+        en_escritura = []
+        write_transaction = flask_app.write_transaction
+        monkeypatch.setattr(flask_app, "write_transaction", lambda fn, conn=None: write_transaction(
+            lambda c: en_escritura.append(True) or fn(c), conn))
+        fit = flask_app.fit_pending_projections
+        monkeypatch.setattr(flask_app, "fit_pending_projections", lambda *args: (
+            en_escritura.append(False), fit(*args))[1])
+
+        respuesta = client.post("/save_service_visit", json={
+            "vehiculo_id": vehiculo_id, "fecha": "2024-04-10", "mileage": 20 * 100, "mecanico_id": mecanico_id,
+            "items": [{"tipo_mantenimiento_id": tipo_id, "precio": 40}],
+        }).get_json()
+
+        assert respuesta["success"], respuesta
+        # The save, then the fit, then storing its row
+        assert en_escritura == [True, False, True]
+        assert projection(conn, vehiculo_id)["lecturas"] == 15
@@ -0,0 +1,95 @@
+"""
+Unit tests for the reference list cache and the Cache_Version triggers that invalidate it.
+"""
+import pytest
+
+import flask_app
+
+
+def version(conn, etiqueta):
+    row = conn.execute("SELECT version FROM Cache_Version WHERE etiqueta = ?", (etiqueta,)).fetchone()
+    return row[0] if row else 0
+
+
+class TestCacheVersionTriggers:
+    """Every write to a reference table bumps its tag."""
+
+    @pytest.mark.parametrize("sql, etiqueta", [
+        ("INSERT INTO Detalle_Vehiculo (marca, modelo, anio) VALUES ('Nissan', 'Frontier', 2019)", "vehiculos"),
+        ("UPDATE Vehiculo SET alias = 'Blanco'", "vehiculos"),
+        ("UPDATE Detalle_Vehiculo SET anio = 2021", "vehiculos"),
+        ("INSERT INTO Mecánico (nombre_mecanico) VALUES ('Taller')", "mecanicos"),
+        ("INSERT INTO Tipo_Mantenimiento (nombre, categoria, vehiculo_detalle_id) VALUES ('Frenos', 'Frenos', 1)",
+         "tipos"),
+        ("DELETE FROM Vehiculo", "vehiculos"),
+    ])
+    def test_write_bumps_the_tag(self, conn, add_vehicle, sql, etiqueta):
+        add_vehicle("Corolla")
+        antes = version(conn, etiqueta)
+
+        with flask_app.transaction(conn):
+            conn.execute(sql)
+
+        assert version(conn, etiqueta) == antes + 1
+
+    def test_other_tags_are_untouched(self, conn, add_vehicle):
+        add_vehicle("Corolla")
+        mecanicos = version(conn, "mecanicos")
+
+        with flask_app.transaction(conn):
+            conn.execute("UPDATE Vehiculo SET alias = 'Blanco'")
+
+        assert version(conn, "mecanicos") == mecanicos
+
+
+class TestReferenceCache:
+    """Tests for ReferenceCache and the cached reference lists."""
+
+    def test_list_is_loaded_once_until_it_changes(self, conn, add_vehicle):
+        add_vehicle("Corolla")
+        cache = flask_app.ReferenceCache()
+        cargas = []
+
+        def loader(conn):
+            cargas.append(1)
+            return [row[0] for row in conn.execute("SELECT alias FROM Vehiculo ORDER BY id")]
+
+        assert cache.get(conn, "vehiculos", None, ("vehiculos",), loader) == ["Corolla"]
+        assert cache.get(conn, "vehiculos", None, ("vehiculos",), loader) == ["Corolla"]
+        add_vehicle("Hilux")
+
+        assert cache.get(conn, "vehiculos", None, ("vehiculos",), loader) == ["Corolla", "Hilux"]
+        assert len(cargas) == 2
+        assert cache.stats() == {"entries": 1, "vehiculos": {"hits": 1, "misses": 2, "hit_ratio": 0.333}}
+
+    def test_vehicle_list_sees_writes_of_other_connections(self, conn, add_vehicle):
+        add_vehicle("Corolla")
+        otra = flask_app.get_db_connection()
+        try:
+            assert [v["alias"] for v in flask_app.get_vehiculos(otra)] == ["Corolla"]
+
+            with flask_app.transaction(conn):
+                conn.execute("UPDATE Vehiculo SET alias = 'Blanco'")
+
+            assert [v["alias"] for v in flask_app.get_vehiculos(otra)] == ["Blanco"]
+        finally:
+            otra.close()
+
+    def test_mechanic_list_reloads_after_an_insert(self, client, conn):
+        client.post("/add_mechanic_direct", data={"nombre": "Taller", "telefono": "8888"})
+        assert [m["nombre_mecanico"] for m in flask_app.get_mecanicos(conn)] == ["Taller"]
+
+        client.post("/add_mechanic_direct", data={"nombre": "Agencia", "telefono": ""})
+
+        assert [m["nombre_mecanico"] for m in flask_app.get_mecanicos(conn)] == ["Agencia", "Taller"]
+
+    def test_least_recently_used_entry_is_evicted(self, conn):
+        cache = flask_app.ReferenceCache(max_entries=2)
+        for clave in ("a", "b"):
+            cache.get(conn, "lista", clave, ("vehiculos",), lambda conn: clave)
+        cache.get(conn, "lista", "a", ("vehiculos",), lambda conn: "otra")
+
+        cache.get(conn, "lista", "c", ("vehiculos",), lambda conn: "c")
+
+        assert cache.get(conn, "lista", "a", ("vehiculos",), lambda conn: "otra") == "a"
+        assert cache.get(conn, "lista", "b", ("vehiculos",), lambda conn: "recargada") == "recargada"
@@ -0,0 +1,201 @@
+"""
+Unit tests for the suggestion backends: the offline rules backend, backend selection,
+and the retries and circuit breaker bounding model calls.
+"""
+import urllib.error
+
+import pytest
+
+import flask_app
+
+VEHICULO = {"marca": "Toyota", "modelo": "Corolla", "anio": 2020, "tipo": "Sedan",
+            "tipo_motor": "Gasolina", "tipo_transmision": "Automática"}
+ELECTRICO = dict(VEHICULO, modelo="bZ4X", tipo_motor="Eléctrico")
+
+
+@pytest.fixture
+def reglas():
+    return flask_app.RuleBasedSuggestionBackend()
+
+
+class TestRuleBasedSuggestionBackend:
+    """Tests for RuleBasedSuggestionBackend."""
+
+    @pytest.mark.parametrize("tipo, regla", [
+        ("Cambio de Aceite", "Cambio de Aceite"),
+        ("oil change", "Cambio de Aceite"),
+        ("Cambio de filtro de aceite y aceite", "Cambio de Filtro de Aceite"),
+        ("Transmission fluid flush", "Cambio de Aceite de Transmisión"),
+        ("Tire rotation", "Rotación de Llantas"),
+        ("New tires", "Cambio de Llantas"),
+        ("Lavado", None),
+    ])
+    def test_find_rule(self, reglas, tipo, regla):
+        assert reglas.find_rule(tipo) == regla
+
+    def test_interval_answer(self, reglas):
+        respuesta = reglas.suggest(VEHICULO, "Cambio de Aceite", "miles")
+
+        assert respuesta["success"]
+        assert respuesta["sugerencia"] == "5000"
+        assert respuesta["question"] == "Why do I need Cambio de Aceite?"
+
+    def test_all_fields(self, reglas):
+        respuesta = reglas.suggest(VEHICULO, "Battery Change", "todo")
+
+        assert respuesta["aplica"]
+        assert respuesta["miles"] == {"success": True, "sugerencia": "N/A",
+                                      "message": "Battery Change has no miles based interval"}
+        assert respuesta["meses"]["sugerencia"] == "48"
+        assert respuesta["categoria"] == {"success": True, "categoria": "Electrical"}
+
+    @pytest.mark.parametrize("vehiculo, tipo", [
+        (ELECTRICO, "Cambio de Aceite"),
+        (VEHICULO, "Cambio de Embrague"),
+        (dict(VEHICULO, tipo_transmision="Manual"), "Cambio de Aceite de Transmisión"),
+    ])
+    def test_not_applicable(self, reglas, vehiculo, tipo):
+        assert reglas.suggest(vehiculo, tipo, "miles")["sugerencia"] == "N/A"
+        assert reglas.suggest(vehiculo, tipo, "categoria")["categoria"] == "N/A"
+        assert not reglas.suggest(vehiculo, tipo, "todo")["aplica"]
+
+    def test_unknown_type(self, reglas):
+        assert reglas.suggest(VEHICULO, "Lavado", "miles") == {
+            "success": False, "error": "No maintenance rule for: Lavado"}
+        assert reglas.stats()["calls"] == 1
+
+
+class TestCreateSuggestionBackend:
+    """Tests for create_suggestion_backend."""
+
+    def test_creates_the_named_backend(self):
+        assert isinstance(flask_app.create_suggestion_backend("rules"), flask_app.RuleBasedSuggestionBackend)
+
+    def test_unknown_backend_is_rejected(self):
+        with pytest.raises(ValueError, match="Unknown suggestion backend 'gpt'. Valid backends: gemini, http, rules"):
+            flask_app.create_suggestion_backend("gpt")
+
+
+class Reloj:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(flask_app.time, "monotonic", reloj)
+    return reloj
+
+
+class TestCircuitBreaker:
+    """Tests for the closed, open and half open states of CircuitBreaker."""
+
+    def fallar(self, breaker, veces):
+        for _ in range(veces):
+            breaker.before_call()
+            breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self, reloj):
+        breaker = flask_app.CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.fallar(breaker, 2)
+        breaker.record_success()
+        self.fallar(breaker, 2)
+        assert breaker.state == "closed"
+
+        self.fallar(breaker, 1)
+
+        assert breaker.state == "open"
+        reloj.ahora += 10
+        with pytest.raises(flask_app.CircuitOpenError, match="try again in 20 seconds"):
+            breaker.before_call()
+        assert breaker.stats() == {"state": "open", "consecutive_failures": 3,
+                                   "times_opened": 1, "short_circuited": 1}
+
+    def test_one_trial_call_once_the_timeout_passes(self, reloj):
+        breaker = flask_app.CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        self.fallar(breaker, 1)
+
+        reloj.ahora += 30
+        breaker.before_call()
+        assert breaker.state == "half_open"
+        with pytest.raises(flask_app.CircuitOpenError):
+            breaker.before_call()
+
+        breaker.record_success()
+        assert breaker.state == "closed"
+        breaker.before_call()
+
+    def test_failed_trial_reopens(self, reloj):
+        breaker = flask_app.CircuitBreaker(failure_threshold=3, reset_timeout=30)
+        self.fallar(breaker, 3)
+        reloj.ahora += 30
+
+        self.fallar(breaker, 1)
+
+        assert breaker.state == "open"
+        assert breaker.stats()["times_opened"] == 2
+        with pytest.raises(flask_app.CircuitOpenError, match="try again in 30 seconds"):
+            breaker.before_call()
+
+
+class FakeModel(flask_app.PromptSuggestionBackend):
+    """A model answering from a list of texts and exceptions, one per request."""
+
+    name = "fake"
+
+    def __init__(self, respuestas, **kwargs):
+        kwargs.setdefault("breaker", flask_app.CircuitBreaker(2, 30))
+        super().__init__(timeout=5, deadline=20, max_retries=2, backoff=0, **kwargs)
+        self.respuestas = list(respuestas)
+
+    def send(self, prompt, timeout, on_text=None):
+        respuesta = self.respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+
+class TestGenerateText:
+    """Tests for the retries and breaker of PromptSuggestionBackend.generate_text."""
+
+    def test_transient_failures_are_retried(self):
+        modelo = FakeModel([TimeoutError(), urllib.error.HTTPError("url", 503, "busy", None, None), "MILES: 5000"])
+
+        assert modelo.suggest(VEHICULO, "Cambio de Aceite", "miles")["sugerencia"] == "5000"
+        stats = modelo.stats()
+        assert (stats["model_requests"], stats["retries"], stats["timeouts"]) == (3, 2, 1)
+        assert stats["circuit_breaker"]["consecutive_failures"] == 0
+
+    def test_retries_are_bounded(self):
+        modelo = FakeModel([ConnectionError()] * 3)
+
+        with pytest.raises(ConnectionError):
+            modelo.generate_text("prompt")
+
+        assert modelo.stats()["model_requests"] == 3
+        assert modelo.breaker.failures == 1
+
+    def test_bad_request_is_not_retried_nor_counted_by_the_breaker(self):
+        modelo = FakeModel([urllib.error.HTTPError("url", 400, "bad request", None, None)])
+
+        with pytest.raises(urllib.error.HTTPError):
+            modelo.generate_text("prompt")
+
+        assert modelo.stats()["retries"] == 0
+        assert modelo.breaker.failures == 0
+
+    def test_open_breaker_fails_without_calling_the_model(self):
+        modelo = FakeModel([ConnectionError()] * 6)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                modelo.generate_text("prompt")
+
+        with pytest.raises(flask_app.CircuitOpenError):
+            modelo.generate_text("prompt")
+        assert modelo.stats()["model_requests"] == 6
@@ -0,0 +1,126 @@
+"""
+Unit tests for the background suggestion jobs and their polling and SSE endpoints.
+"""
+import pytest
+
+import flask_app
+
+VEHICULO = {"marca": "Toyota", "modelo": "Corolla", "anio": 2020, "tipo": "Sedan",
+            "tipo_motor": "Gasolina", "tipo_transmision": "Automática"}
+
+
+class StreamingBackend(flask_app.SuggestionBackend):
+    """A backend streaming its answer in two steps."""
+
+    name = "streaming"
+
+    def _suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        if tipo_mantenimiento == "Falla":
+            raise ConnectionError("model down")
+        if on_text:
+            on_text("MILES:")
+            on_text("MILES: 5000")
+        return {"success": True, "sugerencia": "5000"}
+
+
+@pytest.fixture
+def jobs(db_path, monkeypatch):
+    monkeypatch.setattr(flask_app, "suggestion_backend", StreamingBackend())
+    monkeypatch.setattr(flask_app, "suggestion_fallback", None)
+    jobs = flask_app.SuggestionJobs(workers=2, ttl=60)
+    monkeypatch.setattr(flask_app, "suggestion_jobs", jobs)
+    yield jobs
+    # Jobs use the pooled connections, which the db_path fixture closes next
+    jobs._executor.shutdown(wait=True)
+
+
+def terminar(jobs, job_id, user_id):
+    """Wait for a job to finish and return its final state."""
+    job = jobs.get(job_id, user_id)
+    while job["estado"] != "done":
+        job = jobs.wait(job_id, user_id, job["version"], timeout=5)
+    return job
+
+
+class TestSuggestionJobs:
+    """Tests for SuggestionJobs."""
+
+    def test_job_runs_to_its_result(self, jobs):
+        job_id = jobs.submit(1, VEHICULO, "Cambio de Aceite", "miles")
+
+        job = terminar(jobs, job_id, 1)
+
+        assert job["resultado"] == {"success": True, "sugerencia": "5000"}
+        assert job["parcial"] == "MILES: 5000"
+        # running, two progress reports, done
+        assert job["version"] == 4
+        assert jobs.stats()["completed"] == 1
+
+    def test_jobs_are_private_to_their_user(self, jobs):
+        job_id = jobs.submit(1, VEHICULO, "Cambio de Aceite", "miles")
+        terminar(jobs, job_id, 1)
+
+        assert jobs.get(job_id, 2) is None
+        assert jobs.wait(job_id, 2, 0, timeout=0) is None
+
+    def test_failed_job_reports_the_error(self, jobs):
+        job_id = jobs.submit(1, VEHICULO, "Falla", "miles")
+
+        job = terminar(jobs, job_id, 1)
+
+        assert job["resultado"] == {"success": False, "error": "Suggestion unavailable: model down"}
+        assert jobs.stats()["failed"] == 1
+
+    def test_finished_jobs_are_forgotten_after_the_ttl(self, jobs, monkeypatch):
+        job_id = jobs.submit(1, VEHICULO, "Cambio de Aceite", "miles")
+        terminar(jobs, job_id, 1)
+        ahora = flask_app.time.time()
+
+        monkeypatch.setattr(flask_app.time, "time", lambda: ahora + 61)
+        otro = jobs.submit(1, VEHICULO, "Cambio de Aceite", "meses")
+
+        assert jobs.get(job_id, 1) is None
+        assert jobs.get(otro, 1) is not None
+
+
+class TestSuggestionJobEndpoints:
+    """Tests for /suggest_jobs and the routes following a job."""
+
+    @pytest.fixture
+    def job(self, client, jobs, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Corolla")
+        respuesta = client.post("/suggest_jobs", json={
+            "tipo_mantenimiento": "Cambio de Aceite", "campo": "miles", "vehiculo_id": vehiculo_id})
+        assert respuesta.status_code == 202
+        return respuesta.get_json()
+
+    def test_poll_until_done(self, client, jobs, job):
+        assert job["status_url"] == f"/suggest_jobs/{job['job_id']}"
+        user_id = next(iter(jobs._jobs.values()))["user_id"]
+        terminar(jobs, job["job_id"], user_id)
+
+        estado = client.get(job["status_url"]).get_json()
+
+        assert estado["success"] and estado["estado"] == "done"
+        assert estado["resultado"]["sugerencia"] == "5000"
+
+    def test_events_end_with_the_result(self, client, job):
+        eventos = client.get(job["events_url"]).get_data(as_text=True)
+
+        assert eventos.endswith("\n\n")
+        ultimo = eventos.strip().split("\n\n")[-1]
+        assert ultimo.startswith("event: done\ndata: ")
+        assert '"sugerencia": "5000"' in ultimo
+
+    def test_unknown_job(self, client, jobs):
+        assert client.get("/suggest_jobs/nope").status_code == 404
+        assert client.get("/suggest_jobs/nope/events").status_code == 404
+
+    def test_invalid_field(self, client, jobs, add_vehicle):
+        vehiculo_id, _ = add_vehicle("Corolla")
+
+        respuesta = client.post("/suggest_jobs", json={
+            "tipo_mantenimiento": "Cambio de Aceite", "campo": "color", "vehiculo_id": vehiculo_id})
+
+        assert respuesta.status_code == 400
+        assert respuesta.get_json() == {"success": False, "error": "Invalid field: color"}
@@ -0,0 +1,281 @@
+"""
+Unit tests for the suggestion path: parsing the combined answer, the shared suggestion
+cache, the coalescing of identical requests, and obtener_sugerencia's fallbacks when the
+backend fails.
+"""
+import threading
+import time
+
+import pytest
+
+import flask_app
+
+VEHICULO = {"marca": "Toyota", "modelo": "Corolla", "anio": 2020, "tipo": "Sedan",
+            "tipo_motor": "Gasolina", "tipo_transmision": "Automática"}
+
+
+class FallingBackend(flask_app.SuggestionBackend):
+    """A backend whose calls all fail."""
+
+    name = "falla"
+
+    def _suggest(self, vehiculo, tipo_mantenimiento, campo, on_text=None):
+        raise ConnectionError("model down")
+
+
+class TestCombinedAnswer:
+    """Tests for parse_sugerencias_combinadas."""
+
+    def test_every_field_is_parsed(self):
+        resultado = flask_app.parse_sugerencias_combinadas("""
+            APPLICABLE: YES
+            MILES: 5,000
+            MILES_EXPLANATION: Keeps the engine lubricated.
+            MONTHS: 6
+            MONTHS_EXPLANATION: Sludge builds up.
+            CATEGORY: engine
+        """, "Cambio de Aceite")
+
+        assert resultado == {
+            "success": True,
+            "aplica": True,
+            "miles": {"success": True, "sugerencia": "5000", "explanation": "Keeps the engine lubricated.",
+                      "question": "Why do I need Cambio de Aceite?"},
+            "meses": {"success": True, "sugerencia": "6", "explanation": "Sludge builds up.",
+                      "question": "What happens if I delay Cambio de Aceite?"},
+            "categoria": {"success": True, "categoria": "Engine"},
+        }
+
+    def test_markdown_labels_are_accepted(self):
+        resultado = flask_app.parse_sugerencias_combinadas(
+            "**APPLICABLE:** YES\n- **MILES:** 30000\n**MONTHS:** N/A\n**CATEGORY:** **Brakes**", "Frenos")
+
+        assert resultado["miles"]["sugerencia"] == "30000"
+        assert resultado["miles"]["explanation"] == "Regular Frenos is essential for vehicle longevity."
+        assert resultado["meses"] == {"success": True, "sugerencia": "N/A",
+                                      "message": "Frenos has no months based interval"}
+        assert resultado["categoria"] == {"success": True, "categoria": "Brakes"}
+
+    @pytest.mark.parametrize("texto", ["APPLICABLE: NO\nMILES: N/A", "N/A"])
+    def test_not_applicable(self, texto):
+        resultado = flask_app.parse_sugerencias_combinadas(texto, "Cambio de Aceite")
+
+        assert resultado["success"] and not resultado["aplica"]
+        assert resultado["miles"]["sugerencia"] == resultado["meses"]["sugerencia"] == "N/A"
+        assert resultado["categoria"]["categoria"] == "N/A"
+
+    def test_out_of_range_field_fails_alone(self):
+        resultado = flask_app.parse_sugerencias_combinadas(
+            "APPLICABLE: YES\nMILES: 200\nMONTHS: 500\nCATEGORY: Cooling", "Refrigerante")
+
+        assert resultado["miles"] == {"success": False,
+                                      "error": "Invalid recommendation: 200 - No valid interval found"}
+        assert not resultado["meses"]["success"]
+        assert resultado["categoria"] == {"success": True, "categoria": "Cooling"}
+
+    def test_nothing_usable_is_an_error(self):
+        resultado = flask_app.parse_sugerencias_combinadas("I don't know", "Cambio de Aceite")
+
+        assert resultado == {"success": False, "error": "Invalid recommendation: I don't know"}
+
+
+class TestSuggestionCache:
+    """Tests for SuggestionCache over the Sugerencia_Cache table."""
+
+    RESPUESTA = {"success": True, "sugerencia": 5000}
+
+    @pytest.fixture
+    def reloj(self, monkeypatch):
+        ahora = [1000.0]
+        monkeypatch.setattr(flask_app.time, "time", lambda: ahora[0])
+        return ahora
+
+    def test_stored_answer_is_served_until_it_expires(self, conn, reloj):
+        cache = flask_app.SuggestionCache(ttl=60, max_entries=10)
+        assert cache.get(conn, "clave") is None
+        cache.set(conn, "clave", "miles", self.RESPUESTA)
+
+        reloj[0] += 60
+        assert cache.get(conn, "clave") == self.RESPUESTA
+        reloj[0] += 1
+        assert cache.get(conn, "clave") is None
+        assert cache.get(conn, "clave", stale=True) == self.RESPUESTA
+        assert cache.stats(conn) == {"entries": 1, "hits": 1, "misses": 2, "stale_hits": 1, "hit_ratio": 0.333}
+
+    def test_hits_touch_the_entry_at_most_once_a_minute(self, conn, reloj):
+        cache = flask_app.SuggestionCache(ttl=600, max_entries=10)
+        cache.set(conn, "clave", "miles", self.RESPUESTA)
+
+        def ultimo_uso():
+            return conn.execute("SELECT ultimo_uso FROM Sugerencia_Cache").fetchone()[0]
+
+        reloj[0] += 30
+        cache.get(conn, "clave")
+        assert ultimo_uso() == 1000.0
+        reloj[0] += 31
+        cache.get(conn, "clave")
+        assert ultimo_uso() == 1061.0
+
+    def test_least_recently_used_entries_are_evicted(self, conn, reloj):
+        cache = flask_app.SuggestionCache(ttl=600, max_entries=2)
+        for clave in ("a", "b"):
+            cache.set(conn, clave, "miles", self.RESPUESTA)
+            reloj[0] += 100
+        cache.get(conn, "a")
+
+        cache.set(conn, "c", "miles", self.RESPUESTA)
+
+        claves = [row[0] for row in conn.execute("SELECT clave FROM Sugerencia_Cache ORDER BY clave")]
+        assert claves == ["a", "c"]
+
+    def test_key_ignores_case_and_spacing(self):
+        otro = dict(VEHICULO, marca=" TOYOTA ", modelo="corolla")
+
+        assert (flask_app.suggestion_cache_key(otro, "Cambio  de aceite", "miles")
+                == flask_app.suggestion_cache_key(VEHICULO, "Cambio de Aceite", "miles"))
+        assert (flask_app.suggestion_cache_key(VEHICULO, "Cambio de Aceite", "meses")
+                != flask_app.suggestion_cache_key(VEHICULO, "Cambio de Aceite", "miles"))
+
+
+def esperar(condicion, timeout=5):
+    """Wait until condicion() is true."""
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "timed out"
+        time.sleep(0.001)
+
+
+class TestSingleFlight:
+    """Tests for SingleFlight coalescing concurrent calls with the same key."""
+
+    def run_coalesced(self, flight, fn, n, on_text=None):
+        """Call flight.do from n threads while the leader is held inside fn; return their results."""
+        liberar = threading.Event()
+        resultados = [None] * n
+
+        def leader_fn(progreso):
+            liberar.wait(5)
+            return fn(progreso)
+
+        def llamar(i):
+            try:
+                resultados[i] = flight.do("clave", leader_fn, on_text and (lambda texto: on_text(i, texto)))
+            except Exception as e:
+                resultados[i] = e
+
+        hilos = [threading.Thread(target=llamar, args=(i,)) for i in range(n)]
+        hilos[0].start()
+        esperar(lambda: flight.stats()["in_flight"] == 1)
+        for hilo in hilos[1:]:
+            hilo.start()
+        esperar(lambda: flight.stats()["coalesced"] == n - 1)
+        if on_text:
+            # Followers add their listener right after being counted
+            esperar(lambda: len(flight._calls["clave"]["listeners"]) == n)
+        liberar.set()
+        for hilo in hilos:
+            hilo.join(5)
+        return resultados
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = flask_app.SingleFlight()
+        llamadas = []
+
+        resultados = self.run_coalesced(flight, lambda progreso: llamadas.append(1) or "respuesta", 4)
+
+        assert resultados == ["respuesta"] * 4
+        assert llamadas == [1]
+        assert flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 3}
+
+    def test_error_reaches_every_caller(self):
+        flight = flask_app.SingleFlight()
+        error = ConnectionError("model down")
+
+        def falla(progreso):
+            raise error
+
+        assert self.run_coalesced(flight, falla, 3) == [error] * 3
+
+    def test_progress_reaches_every_caller(self):
+        flight = flask_app.SingleFlight()
+        recibidos = {i: [] for i in range(3)}
+
+        def generar(progreso):
+            progreso("MILES")
+            progreso("MILES: 5000")
+            return "respuesta"
+
+        self.run_coalesced(flight, generar, 3, lambda i, texto: recibidos[i].append(texto))
+
+        assert recibidos == {i: ["MILES", "MILES: 5000"] for i in range(3)}
+
+    def test_late_caller_gets_the_latest_report_first(self):
+        flight = flask_app.SingleFlight()
+        reportado, liberar = threading.Event(), threading.Event()
+        recibidos = []
+
+        def generar(progreso):
+            progreso("MILES")
+            reportado.set()
+            liberar.wait(5)
+            return "respuesta"
+
+        lider = threading.Thread(target=flight.do, args=("clave", generar, lambda texto: None))
+        lider.start()
+        reportado.wait(5)
+        tardio = threading.Thread(target=flight.do, args=("clave", generar, recibidos.append))
+        tardio.start()
+        esperar(lambda: len(flight._calls["clave"]["listeners"]) == 2)
+        liberar.set()
+        lider.join(5)
+        tardio.join(5)
+
+        assert recibidos == ["MILES"]
+
+    def test_later_calls_run_again(self):
+        flight = flask_app.SingleFlight()
+
+        flight.do("clave", lambda progreso: 1)
+        flight.do("clave", lambda progreso: 2)
+
+        assert flight.stats()["executions"] == 2
+
+    def test_leader_without_on_text_gets_no_progress_callback(self):
+        flight = flask_app.SingleFlight()
+
+        assert flight.do("clave", lambda progreso: progreso) is None
+
+
+class TestFallbacks:
+    """Tests for what obtener_sugerencia answers when its backend fails."""
+
+    @pytest.fixture(autouse=True)
+    def backend(self, monkeypatch):
+        monkeypatch.setattr(flask_app, "suggestion_backend", FallingBackend())
+
+    def test_unavailable_without_a_fallback(self, conn, monkeypatch):
+        monkeypatch.setattr(flask_app, "suggestion_fallback", None)
+
+        with pytest.raises(flask_app.SuggestionUnavailableError, match="Suggestion unavailable: model down"):
+            flask_app.obtener_sugerencia(conn, VEHICULO, "Cambio de Aceite", "miles")
+
+    def test_fallback_answer_names_its_backend(self, conn, monkeypatch):
+        monkeypatch.setattr(flask_app, "suggestion_fallback", flask_app.RuleBasedSuggestionBackend())
+
+        respuesta = flask_app.obtener_sugerencia(conn, VEHICULO, "Cambio de Aceite", "miles")
+
+        assert respuesta["success"]
+        assert respuesta["fuente"] == "rules"
+        # Not cached: the next call tries the backend again
+        assert flask_app.suggestion_cache.get(
+            conn, flask_app.suggestion_cache_key(VEHICULO, "Cambio de Aceite", "miles"), stale=True) is None
+
+    def test_endpoint_reports_the_suggestion_unavailable(self, client, add_vehicle, monkeypatch):
+        monkeypatch.setattr(flask_app, "suggestion_fallback", None)
+        vehiculo_id, _ = add_vehicle("Corolla")
+
+        respuesta = client.post("/suggest_maintenance", json={
+            "tipo_mantenimiento": "Cambio de Aceite", "campo": "miles", "vehiculo_id": vehiculo_id,
+        }).get_json()
+
+        assert respuesta == {"success": False, "error": "Suggestion unavailable: model down"}
@@ -0,0 +1,106 @@
+"""
+Unit tests for the per-process cache of logged-in users.
+"""
+import pytest
+
+import flask_app
+
+
+class Reloj:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(flask_app.time, "monotonic", reloj)
+    return reloj
+
+
+class TestUserCache:
+    """Tests for UserCache."""
+
+    @pytest.fixture
+    def cargas(self):
+        cargas = []
+
+        def loader(user_id):
+            cargas.append(user_id)
+            return {"id": user_id, "username": f"user{user_id}"}
+
+        loader.cargas = cargas
+        return loader
+
+    def test_user_is_loaded_once_within_the_ttl(self, reloj, cargas):
+        cache = flask_app.UserCache(ttl=30)
+
+        assert cache.get(1, cargas) == {"id": 1, "username": "user1"}
+        reloj.ahora += 29
+        cache.get(1, cargas)
+
+        assert cargas.cargas == [1]
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+    def test_expired_user_is_reloaded(self, reloj, cargas):
+        cache = flask_app.UserCache(ttl=30)
+        cache.get(1, cargas)
+
+        reloj.ahora += 30
+        cache.get(1, cargas)
+
+        assert cargas.cargas == [1, 1]
+
+    def test_invalidate(self, reloj, cargas):
+        cache = flask_app.UserCache(ttl=30)
+        cache.get(1, cargas)
+        cache.get(2, cargas)
+
+        cache.invalidate(1)
+        cache.get(1, cargas)
+        cache.get(2, cargas)
+        assert cargas.cargas == [1, 2, 1]
+
+        cache.invalidate()
+        assert cache.stats()["entries"] == 0
+
+    def test_full_cache_drops_expired_entries_first(self, reloj, cargas):
+        cache = flask_app.UserCache(ttl=30, max_entries=2)
+        cache.get(1, cargas)
+        reloj.ahora += 20
+        cache.get(2, cargas)
+        reloj.ahora += 20
+
+        cache.get(3, cargas)
+
+        assert cache.stats()["entries"] == 2
+        cache.get(2, cargas)
+        assert cargas.cargas == [1, 2, 3]
+
+    def test_missing_user_is_cached_as_none(self, reloj, cargas):
+        cache = flask_app.UserCache(ttl=30)
+
+        assert cache.get(7, lambda user_id: None) is None
+        assert cache.get(7, cargas) is None
+
+
+class TestLoggedInUser:
+    """Tests for the user loaded before each request."""
+
+    def test_password_hash_is_not_cached(self, client):
+        client.get("/dashboard")
+
+        (usuario,) = [entrada[1] for entrada in flask_app.user_cache._entries.values()]
+        assert usuario == {"id": usuario["id"], "username": "tester"}
+
+    def test_requests_reuse_the_cached_user(self, client):
+        client.get("/dashboard")
+        client.get("/dashboard")
+
+        assert flask_app.user_cache.stats()["hits"] >= 1
+        assert flask_app.user_cache.stats()["misses"] == 1
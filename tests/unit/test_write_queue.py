@@ -0,0 +1,142 @@
+"""
+Unit tests for WriteQueue: savepoint isolation within a group commit, withdrawal of
+timed-out operations and supervision of the writer thread.
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import flask_app
+
+
+def insertar(nombre):
+    """Operation inserting a mechanic; returns its id."""
+    return lambda conn: conn.execute(
+        "INSERT INTO Mecánico (nombre_mecanico) VALUES (?)", (nombre,)
+    ).lastrowid
+
+
+def mecanicos(conn):
+    return [row[0] for row in conn.execute("SELECT nombre_mecanico FROM Mecánico ORDER BY id")]
+
+
+@pytest.fixture
+def writer(db_path):
+    return flask_app.WriteQueue("test-writer", commit_interval=0, max_batch=100, queue_size=10)
+
+
+@pytest.fixture
+def ocupado(writer):
+    """Keep the writer busy with one operation until the returned event is set, so the
+    operations submitted meanwhile are queued and committed together afterwards."""
+    empezo, soltar = threading.Event(), threading.Event()
+
+    def bloquear(conn):
+        empezo.set()
+        soltar.wait(5)
+
+    futuro = writer.submit(bloquear)
+    assert empezo.wait(5)
+    yield soltar
+    soltar.set()
+    futuro.result(5)
+
+
+class TestGroupCommit:
+    """Operations committed together are isolated from each other by savepoints."""
+
+    def test_failing_operation_is_rolled_back_alone(self, conn, writer, ocupado):
+        def falla(conn):
+            conn.execute("INSERT INTO Mecánico (nombre_mecanico) VALUES ('b')")
+            raise ValueError("no")
+
+        futuros = [writer.submit(insertar("a")), writer.submit(falla), writer.submit(insertar("c"))]
+        ocupado.set()
+
+        assert futuros[0].result(5)
+        with pytest.raises(ValueError, match="no"):
+            futuros[1].result(5)
+        assert futuros[2].result(5)
+        assert mecanicos(conn) == ["a", "c"]
+        stats = writer.stats()
+        assert (stats["commits"], stats["operations"], stats["failed_operations"]) == (2, 4, 1)
+
+    def test_constraint_violation_fails_only_its_operation(self, conn, writer, ocupado):
+        futuros = [writer.submit(insertar("a")), writer.submit(insertar("a")), writer.submit(insertar("b"))]
+        ocupado.set()
+
+        assert futuros[0].result(5)
+        with pytest.raises(sqlite3.IntegrityError):
+            futuros[1].result(5)
+        assert futuros[2].result(5)
+        assert mecanicos(conn) == ["a", "b"]
+
+    def test_result_is_returned_to_its_caller(self, writer):
+        assert writer.run(lambda conn: conn.execute("SELECT 40 + 2").fetchone()[0], timeout=5) == 42
+
+
+class TestTimeouts:
+    """A caller that stops waiting never leaves a write behind it does not know about."""
+
+    def test_queued_operation_is_withdrawn(self, conn, writer, ocupado):
+        futuro = writer.submit(insertar("tarde"))
+
+        with pytest.raises(flask_app.FutureTimeoutError):
+            writer.wait(futuro, 0.05)
+        ocupado.set()
+
+        writer.run(insertar("siguiente"), timeout=5)
+        assert mecanicos(conn) == ["siguiente"]
+        assert writer.stats()["cancelled_operations"] == 1
+
+    def test_run_reports_a_busy_database(self, conn, writer, ocupado):
+        with pytest.raises(sqlite3.OperationalError, match="database is busy"):
+            writer.run(insertar("tarde"), timeout=0.05)
+        ocupado.set()
+
+        writer.run(insertar("siguiente"), timeout=5)
+        assert mecanicos(conn) == ["siguiente"]
+
+    def test_running_operation_is_waited_for(self, conn, writer):
+        def lenta(conn):
+            time.sleep(0.3)
+            return insertar("lenta")(conn)
+
+        assert writer.run(lenta, timeout=0.05)
+        assert mecanicos(conn) == ["lenta"]
+
+    def test_full_queue_reports_a_busy_database(self, db_path):
+        writer = flask_app.WriteQueue("test-writer", commit_interval=0, max_batch=100, queue_size=1)
+        empezo, soltar = threading.Event(), threading.Event()
+        writer.submit(lambda conn: empezo.set() or soltar.wait(5))
+        assert empezo.wait(5)
+        writer.submit(insertar("en cola"))
+
+        with pytest.raises(queue.Full):
+            writer.submit(insertar("de mas"), block=False)
+        with pytest.raises(sqlite3.OperationalError, match="write queue is full"):
+            writer.run(insertar("de mas"), timeout=0.05)
+        soltar.set()
+
+
+class TestSupervision:
+    """The writer thread survives the errors of the operations it runs."""
+
+    # The dying writer logs the error and returns; nothing escapes the thread
+    @pytest.mark.filterwarnings("error::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_writer_is_restarted_after_a_fatal_error(self, conn, writer):
+        class Fatal(BaseException):
+            pass
+
+        def fatal(conn):
+            raise Fatal()
+
+        with pytest.raises(Fatal):
+            writer.run(fatal, timeout=5)
+
+        assert writer.run(insertar("despues"), timeout=5)
+        assert mecanicos(conn) == ["despues"]
+        assert writer.stats()["restarts"] == 1